@@ -1,34 +1,61 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
-import sqlite3
 import os
+
+# 服务器模式：threading（默认，Werkzeug 开发服务器）/ eventlet / gevent。
+# 协程模式必须在导入其他模块之前打好 monkey patch，SQLite 查询再由 SQLitePool 转交线程池执行。
+SERVER_MODES = ('threading', 'eventlet', 'gevent')
+SERVER_MODE = os.environ.get('QINYIN_SERVER_MODE', 'threading')
+if SERVER_MODE not in SERVER_MODES:
+    raise ValueError(f'未知的服务器模式 QINYIN_SERVER_MODE={SERVER_MODE}，可选: {", ".join(SERVER_MODES)}')
+if SERVER_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif SERVER_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+from flask import Flask, Request, render_template, request, jsonify, send_from_directory
+import sqlite3
 import pyperclip
 import threading
 import time
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, join_room, leave_room
 import re
 from datetime import datetime
-import shutil
+from contextlib import contextmanager
 # 获取本机IP地址
 import socket
 import pyperclip
 import json
-import requests
 import webbrowser
 from werkzeug.utils import secure_filename
-import tempfile
 import ffmpeg
 from werkzeug.exceptions import RequestEntityTooLarge
 from urllib.parse import urlparse
 import html
+import base64
+import uuid
+import hashlib
+import math
+import random
 from collections import Counter
+import csv
+from jianshang_crawler import JianshangCrawler, create_pooled_session, parse_video_media_info, project_work_fields
+from clipboard_source import PollingClipboardSource, create_clipboard_source
+from broadcast_bus import BroadcastBus, SubscriptionRegistry
 
 app = Flask(__name__)
-socketio = SocketIO(app, async_mode='threading', cors_allowed_origins="*")
+socketio = SocketIO(app, async_mode=SERVER_MODE, cors_allowed_origins="*")
+# 谱子状态变化经广播总线合并后以 score_updates 批量推送，其他事件也经总线发送以便统计；
+# score_updates 按客户端订阅的曲谱码拆分发送
+socket_subscriptions = SubscriptionRegistry()
+broadcast_bus = BroadcastBus(socketio.emit, start_task=socketio.start_background_task, sleep=socketio.sleep,
+                             targets=socket_subscriptions.targets)
 
 # —— 上传配置 ——
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'uploads', 'videos')
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB 上限（按需调整）
+# 上传流式写入磁盘、超过压缩阈值的由后台转码，上限需高于压缩阈值，否则大文件在到达转码队列前就被拒绝
+app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024 * 1024  # 2GB 上限（按需调整）
 ALLOWED_VIDEO_EXTS = {'mp4', 'mov', 'm4v', 'webm', 'avi', 'mkv'}
 
 # 视频压缩配置
@@ -229,37 +256,378 @@ JIANSHANG_API_HEADERS = {
     "Cookie": JIANSHANG_API_COOKIE,
 }
 
+# ========== 中文 n-gram 分词（供 FTS5 使用） ==========
+
+def fts_ngram_tokens(text):
+    """
+    把文本（先转小写）切成单字 + 相邻二字组，并编码成纯字母数字的词元：
+    单字 u+6位十六进制码点，二字组 b+两段码点。编码后 unicode61 分词器原样保留，
+    标点、emoji 等任意字符都能参与匹配。
+    """
+    if not text:
+        return []
+    chars = str(text).lower()
+    tokens = [f'u{ord(ch):06x}' for ch in chars]
+    tokens.extend(f'b{ord(a):06x}{ord(b):06x}' for a, b in zip(chars, chars[1:]))
+    return tokens
+
+
+def fts_ngrams(text):
+    """注册为 SQL 函数，供触发器写入 FTS 表"""
+    return ' '.join(fts_ngram_tokens(text))
+
+
+def fts_keyword_query(keyword):
+    """
+    关键字 -> FTS5 MATCH 表达式：单字查单字词元，多字查其全部二字组（隐式 AND）。
+    命中结果是子串匹配的超集，需要再用 text_contains 精确校验。
+    """
+    chars = str(keyword).lower()
+    if not chars:
+        return None
+    if len(chars) == 1:
+        return f'u{ord(chars):06x}'
+    bigrams = dict.fromkeys(f'b{ord(a):06x}{ord(b):06x}' for a, b in zip(chars, chars[1:]))
+    return ' '.join(bigrams)
+
+
+def text_contains(haystack, needle):
+    """不区分大小写的子串判断，注册为 SQL 函数"""
+    if not haystack or not needle:
+        return 0
+    return 1 if str(needle).lower() in str(haystack).lower() else 0
+
+
+# 每个池连接上都会注册这些函数；FTS 触发器依赖 fts_ngrams，
+# 用外部工具直接改写 remark / comment 时需要先删除触发器
+SQLITE_FUNCTIONS = (
+    ('fts_ngrams', 1, fts_ngrams),
+    ('text_contains', 2, text_contains),
+)
+
+# ========== SQLite 连接池 ==========
+
+SCORES_DB_PATH = 'scores.db'
+REVIEWS_DB_PATH = 'reviews.db'
+
+# 首次打开连接时执行的 PRAGMA：WAL 让读写互不阻塞，其余为常用调优项
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('temp_store', 'MEMORY'),
+    ('cache_size', -16000),          # 约 16MB 页缓存
+    ('mmap_size', 64 * 1024 * 1024),
+)
+SQLITE_POOL_MAX_SIZE = 16           # 每个数据库最多同时打开的连接数
+SQLITE_BUSY_TIMEOUT_MS = 5000       # 单次加锁等待上限
+SQLITE_BUSY_MAX_RETRIES = 5         # 提交遇到 busy/locked 时的重试次数
+SQLITE_STATEMENT_CACHE_SIZE = 256   # 每个连接缓存的预编译语句数量
+
+
+def is_sqlite_busy_error(error):
+    message = str(error).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+
+def make_blocking_offloader(mode):
+    """
+    协程模式下 sqlite3 的调用会阻塞整个事件循环，返回 run(func, *args)，把调用放到真实线程池里执行；
+    threading 模式返回 None（直接调用）。
+    """
+    if mode == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute
+    if mode == 'gevent':
+        import gevent
+        return lambda func, *args: gevent.get_hub().threadpool.apply(func, args)
+    return None
+
+
+SQLITE_OFFLOAD = make_blocking_offloader(SERVER_MODE)
+
+
+class OffloadedCursor:
+    """游标代理：执行与取结果都经 run 转交线程池，其余属性透传"""
+
+    def __init__(self, cursor, run):
+        object.__setattr__(self, '_cursor', cursor)
+        object.__setattr__(self, '_run', run)
+
+    def execute(self, *args):
+        self._run(self._cursor.execute, *args)
+        return self
+
+    def executemany(self, *args):
+        self._run(self._cursor.executemany, *args)
+        return self
+
+    def executescript(self, *args):
+        self._run(self._cursor.executescript, *args)
+        return self
+
+    def fetchone(self):
+        return self._run(self._cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._run(self._cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._run(self._cursor.fetchall)
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(256)
+            if not rows:
+                return
+            yield from rows
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+
+class OffloadedConnection:
+    """连接代理：cursor() / execute() 返回 OffloadedCursor，提交回滚也在线程池里执行"""
+
+    def __init__(self, conn, run):
+        self._conn = conn
+        self._run = run
+
+    def cursor(self):
+        return OffloadedCursor(self._conn.cursor(), self._run)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def executescript(self, *args):
+        return self.cursor().executescript(*args)
+
+    def commit(self):
+        self._run(self._conn.commit)
+
+    def rollback(self):
+        self._run(self._conn.rollback)
+
+    def backup(self, *args, **kwargs):
+        self._run(lambda: self._conn.backup(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class SQLitePool:
+    """
+    SQLite 连接池：
+      - 连接在借出期间归当前线程独占，同一线程内嵌套借用会复用同一连接；
+      - 首次打开时开启 WAL 与调优 PRAGMA，之后连接常驻复用，预编译语句缓存随之生效；
+      - 正常退出时提交（busy 时带退避重试），异常时回滚；
+      - attach={别名: 路径} 会在每个连接上 ATTACH 其他数据库，便于跨库 JOIN / EXISTS；
+      - functions 中的 Python 函数会注册到每个连接（FTS 分词、子串判断）；
+      - stats() 返回借出次数、等待时长、busy 重试次数等统计；
+      - offload 不为空时（eventlet / gevent 模式）借出的是 OffloadedConnection，查询在线程池中执行。
+    """
+
+    def __init__(self, path, pragmas=SQLITE_PRAGMAS, max_size=SQLITE_POOL_MAX_SIZE,
+                 busy_timeout_ms=SQLITE_BUSY_TIMEOUT_MS, max_busy_retries=SQLITE_BUSY_MAX_RETRIES,
+                 cached_statements=SQLITE_STATEMENT_CACHE_SIZE, attach=None,
+                 functions=SQLITE_FUNCTIONS, offload=SQLITE_OFFLOAD):
+        self.path = path
+        self.offload = offload
+        self.attach = dict(attach or {})
+        self.functions = functions
+        self.pragmas = pragmas
+        self.max_size = max_size
+        self.busy_timeout_ms = busy_timeout_ms
+        self.max_busy_retries = max_busy_retries
+        self.cached_statements = cached_statements
+        self._idle = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._stats = {
+            'opened': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'busy_retries': 0,
+            'busy_wait_time': 0.0,
+            'rollbacks': 0,
+        }
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout_ms)}')
+        for name, value in self.pragmas:
+            conn.execute(f'PRAGMA {name} = {value}')
+        for name, num_args, func in self.functions:
+            conn.create_function(name, num_args, func, deterministic=True)
+        for alias, attach_path in self.attach.items():
+            conn.execute(f'ATTACH DATABASE ? AS {alias}', (attach_path,))
+        with self._cond:
+            self._stats['opened'] += 1
+        return conn
+
+    def _checkout(self):
+        start = time.perf_counter()
+        waited = False
+        conn = None
+        with self._cond:
+            while not self._idle and self._size >= self.max_size:
+                waited = True
+                self._cond.wait()
+            if self._idle:
+                conn = self._idle.pop()
+            else:
+                self._size += 1
+        if conn is None:
+            try:
+                conn = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+        elapsed = time.perf_counter() - start
+        with self._cond:
+            self._stats['checkouts'] += 1
+            self._stats['wait_time'] += elapsed
+            if waited:
+                self._stats['waits'] += 1
+        return conn
+
+    def _checkin(self, conn):
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def _commit(self, conn):
+        delay = 0.05
+        for attempt in range(self.max_busy_retries + 1):
+            try:
+                conn.commit()
+                return
+            except sqlite3.OperationalError as e:
+                if not is_sqlite_busy_error(e) or attempt >= self.max_busy_retries:
+                    raise
+                start = time.perf_counter()
+                time.sleep(delay)
+                delay = min(delay * 2, 1.0)
+                with self._cond:
+                    self._stats['busy_retries'] += 1
+                    self._stats['busy_wait_time'] += time.perf_counter() - start
+
+    @contextmanager
+    def connection(self):
+        local = self._local
+        current = getattr(local, 'conn', None)
+        if current is not None:
+            # 同一线程内嵌套使用：复用外层连接，由外层负责提交/回滚
+            local.depth += 1
+            try:
+                yield current
+            finally:
+                local.depth -= 1
+            return
+
+        conn = self._checkout()
+        if self.offload is not None:
+            conn = OffloadedConnection(conn, self.offload)
+        local.conn = conn
+        local.depth = 1
+        try:
+            yield conn
+            self._commit(conn)
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+                with self._cond:
+                    self._stats['rollbacks'] += 1
+            raise
+        finally:
+            local.conn = None
+            local.depth = 0
+            self._checkin(conn._conn if isinstance(conn, OffloadedConnection) else conn)
+
+    def stats(self):
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot['size'] = self._size
+            snapshot['idle'] = len(self._idle)
+        snapshot['path'] = self.path
+        snapshot['max_size'] = self.max_size
+        snapshot['offload'] = self.offload is not None
+        snapshot['wait_time_ms'] = round(snapshot.pop('wait_time') * 1000, 3)
+        snapshot['busy_wait_time_ms'] = round(snapshot.pop('busy_wait_time') * 1000, 3)
+        return snapshot
+
+
+# scores 连接上挂载 reviews.db（别名 rv），列表接口可直接用 EXISTS 判断是否有评价；
+# reviews 连接上挂载 scores.db（别名 sc），评价列表可在同一条 SQL 里带上完成率与作品标题
+scores_db = SQLitePool(SCORES_DB_PATH, attach={'rv': REVIEWS_DB_PATH})
+reviews_db = SQLitePool(REVIEWS_DB_PATH, attach={'sc': SCORES_DB_PATH})
+
+
 def backup_database():
     """备份数据库文件"""
-    if not os.path.exists('scores.db'):
+    if not os.path.exists(SCORES_DB_PATH):
         return
-        
+
     # 创建backups目录（如果不存在）
     if not os.path.exists('backups'):
         os.makedirs('backups')
-    
+
     # 生成备份文件名（使用当前时间戳）
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     backup_filename = f'backups/scores_{timestamp}.db'
-    
+
     try:
-        # 复制数据库文件
-        shutil.copy2('scores.db', backup_filename)
+        # WAL 模式下直接复制文件可能漏掉 -wal 中的内容，改用在线备份接口
+        dst = sqlite3.connect(backup_filename)
+        try:
+            with scores_db.connection() as conn:
+                conn.backup(dst)
+        finally:
+            dst.close()
         print(f'数据库已备份到: {os.path.abspath(backup_filename)}')
     except Exception as e:
         print(f'备份数据库时出错: {e}')
 
-# 数据库初始化
-def init_db():
-    conn = sqlite3.connect('scores.db')
-    c = conn.cursor()
-    
-    # 创建曲谱表（如果不存在）
+# ========== scores.db 版本化迁移 ==========
+
+def prepare_scores_v1(c):
+    """v1 会删除重复记录：有重复时在迁移事务开始前先备份数据库"""
+    c.execute('SELECT COUNT(*), COUNT(DISTINCT score_code) FROM scores')
+    total, distinct = c.fetchone()
+    if total != distinct:
+        print(f'scores 表存在 {total - distinct} 条重复记录，迁移前先备份数据库')
+        backup_database()
+
+
+def migrate_scores_v1(c):
+    """
+    每个曲谱码只保留一行：
+      - 按 created_at、id 取每个曲谱码最新的一行作为规范行，其余重复行删除；
+      - 重建表以放开 completion 的 NOT NULL（收藏/备注可能先于完成率写入）；
+      - 建立 score_code 唯一索引，以及 completion / is_favorite 索引。
+    """
+    c.execute('SELECT COUNT(*), COUNT(DISTINCT score_code) FROM scores')
+    total, distinct = c.fetchone()
+
     c.execute('''
-        CREATE TABLE IF NOT EXISTS scores (
+        CREATE TABLE scores_v1 (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             score_code TEXT NOT NULL,
-            completion INTEGER NOT NULL,
+            completion INTEGER,
             difficulty INTEGER NOT NULL DEFAULT 0,
             region TEXT NOT NULL DEFAULT 'CN',
             is_favorite BOOLEAN DEFAULT 0,
@@ -267,86 +635,534 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+    c.execute('''
+        INSERT INTO scores_v1 (id, score_code, completion, difficulty, region, is_favorite, remark, created_at)
+        SELECT id, score_code, completion, difficulty, region, is_favorite, remark, created_at
+        FROM (
+            SELECT *, ROW_NUMBER() OVER (
+                PARTITION BY score_code ORDER BY created_at DESC, id DESC
+            ) AS rn
+            FROM scores
+        )
+        WHERE rn = 1
+    ''')
+    c.execute('DROP TABLE scores')
+    c.execute('ALTER TABLE scores_v1 RENAME TO scores')
+    c.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_scores_code ON scores(score_code)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_scores_completion ON scores(completion)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_scores_favorite ON scores(is_favorite)')
+    if total != distinct:
+        print(f'scores 表迁移完成：{total} 条记录合并为 {distinct} 个曲谱码')
+
+
+def migrate_scores_v2(c):
+    """为历史记录分页建立 (created_at, score_code) 复合索引，并补齐缺失的 created_at"""
+    c.execute("UPDATE scores SET created_at = '1970-01-01 00:00:00' WHERE created_at IS NULL")
+    c.execute('CREATE INDEX IF NOT EXISTS idx_scores_created_code ON scores(created_at, score_code)')
+
+
+def migrate_scores_v4(c):
+    """鉴赏码快照：每次爬取一行快照，曲谱码按 position 存放，支持按时间 / 按曲谱码的索引查询"""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS jianshang_snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            taken_at TIMESTAMP NOT NULL,
+            code_count INTEGER NOT NULL DEFAULT 0,
+            mode TEXT,
+            source TEXT
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_snapshots_taken_at ON jianshang_snapshots(taken_at)')
+    c.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_snapshots_source ON jianshang_snapshots(source) WHERE source IS NOT NULL')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS jianshang_snapshot_codes (
+            snapshot_id INTEGER NOT NULL REFERENCES jianshang_snapshots(id),
+            position INTEGER NOT NULL,
+            score_code TEXT NOT NULL,
+            PRIMARY KEY (snapshot_id, position)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_snapshot_codes_code ON jianshang_snapshot_codes(score_code, snapshot_id)')
+
+
+def migrate_scores_v5(c):
+    """快照留存统计：每个曲谱码的首次/最近出现、出现次数与连续上榜次数；快照对差异缓存"""
+    c.execute('ALTER TABLE jianshang_snapshots ADD COLUMN presence_applied INTEGER NOT NULL DEFAULT 0')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS jianshang_code_presence (
+            score_code TEXT PRIMARY KEY,
+            first_snapshot_id INTEGER NOT NULL,
+            first_seen_at TIMESTAMP NOT NULL,
+            last_snapshot_id INTEGER NOT NULL,
+            last_seen_at TIMESTAMP NOT NULL,
+            appearances INTEGER NOT NULL DEFAULT 0,
+            current_streak INTEGER NOT NULL DEFAULT 0,
+            longest_streak INTEGER NOT NULL DEFAULT 0,
+            streak_started_at TIMESTAMP
+        ) WITHOUT ROWID
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_presence_last_snapshot ON jianshang_code_presence(last_snapshot_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_presence_longest ON jianshang_code_presence(longest_streak)')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS jianshang_snapshot_diffs (
+            from_snapshot_id INTEGER NOT NULL,
+            to_snapshot_id INTEGER NOT NULL,
+            entered_json TEXT NOT NULL,
+            left_json TEXT NOT NULL,
+            computed_at TIMESTAMP,
+            PRIMARY KEY (from_snapshot_id, to_snapshot_id)
+        ) WITHOUT ROWID
+    ''')
+
+
+def migrate_scores_v6(c):
+    """作品元数据：按 share_code（即曲谱码）存标题、作者与各项热度指标；works_sources 记录已导入的文件"""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS works (
+            share_code TEXT PRIMARY KEY,
+            work_id INTEGER,
+            title TEXT,
+            description TEXT,
+            cover_url TEXT,
+            region TEXT,
+            music_id INTEGER,
+            note_count INTEGER,
+            nickname TEXT,
+            uid TEXT,
+            like_cnt INTEGER,
+            save_cnt INTEGER,
+            game_like_cnt INTEGER,
+            publish_time INTEGER,
+            hot_score REAL,
+            quality_score REAL,
+            video_json TEXT,
+            source TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_works_hot_score ON works(hot_score)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_works_quality_score ON works(quality_score)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_works_like_cnt ON works(like_cnt)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_works_note_count ON works(note_count)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_works_publish_time ON works(publish_time)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_works_work_id ON works(work_id)')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS works_sources (
+            path TEXT PRIMARY KEY,
+            mtime REAL,
+            size INTEGER,
+            row_count INTEGER,
+            imported_at TIMESTAMP
+        )
+    ''')
+
+
+def migrate_scores_v7(c):
+    """
+    视频信息规范化：video_json 在导入时解析进 work_videos（每个高度一行，只留地址 / 尺寸 / 码率），
+    时长存到 works.video_duration。已导入的 video_json 在这里解析后清空，之后不再写入原始 JSON。
+    """
+    c.execute('ALTER TABLE works ADD COLUMN video_duration INTEGER')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS work_videos (
+            share_code TEXT NOT NULL,
+            height INTEGER NOT NULL,
+            width INTEGER,
+            url TEXT NOT NULL,
+            size INTEGER,
+            bitrate INTEGER,
+            PRIMARY KEY (share_code, height)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('SELECT share_code, video_json FROM works WHERE video_json IS NOT NULL')
+    for share_code, video_json in c.fetchall():
+        duration, videos = parse_video_media_info(video_json)
+        if videos is None:
+            continue
+        c.execute('UPDATE works SET video_duration = ? WHERE share_code = ?', (duration, share_code))
+        c.executemany('''
+            INSERT OR REPLACE INTO work_videos (share_code, height, width, url, size, bitrate)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [(share_code, v['height'], v['width'], v['url'], v['size'], v['bitrate']) for v in videos])
+    c.execute('UPDATE works SET video_json = NULL')
+
+
+def migrate_scores_v8(c):
+    """排序用的预计算列：各热度指标的百分位（0~1）及默认权重下的综合分，综合分带索引"""
+    for column in ('hot_pct', 'quality_pct', 'like_pct', 'save_pct', 'game_like_pct', 'blend_score'):
+        c.execute(f'ALTER TABLE works ADD COLUMN {column} REAL')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_works_save_cnt ON works(save_cnt)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_works_game_like_cnt ON works(game_like_cnt)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_works_blend_score ON works(blend_score)')
+
+
+def migrate_scores_v9(c):
+    """
+    随机池成员拆到 pool_members 表，每个池每个曲谱码一行：
+      - position：在原始池中的顺序（查询/排除时新加入的码排在原始码之后，is_origin = 0）；
+      - slot：可抽取的成员编号为 0..剩余数-1 的连续整数，已抽走或被筛掉时为 NULL；
+      - drawn_at：被抽中的时间。
+    原来的 codes_json / origin_codes_json 迁移后清空。
+    """
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS pool_members (
+            pool_id INTEGER NOT NULL,
+            code TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            is_origin INTEGER NOT NULL DEFAULT 1,
+            slot INTEGER,
+            drawn_at TIMESTAMP,
+            PRIMARY KEY (pool_id, code)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_pool_members_slot
+        ON pool_members(pool_id, slot) WHERE slot IS NOT NULL
+    ''')
+    c.execute('SELECT id, codes_json, origin_codes_json FROM random_pools')
+    for pool_id, codes_json, origin_codes_json in c.fetchall():
+        current = list(dict.fromkeys(json.loads(codes_json or '[]')))
+        origin = list(dict.fromkeys(json.loads(origin_codes_json or codes_json or '[]')))
+        slots = {code: slot for slot, code in enumerate(current)}
+        origin_set = set(origin)
+        extra = [code for code in current if code not in origin_set]
+        c.executemany('''
+            INSERT OR IGNORE INTO pool_members (pool_id, code, position, is_origin, slot)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(pool_id, code, position, 1 if position < len(origin) else 0, slots.get(code))
+              for position, code in enumerate(origin + extra)])
+    c.execute("UPDATE random_pools SET codes_json = '[]', origin_codes_json = NULL")
+
+
+def migrate_scores_v10(c):
+    """
+    随机池预洗牌：slot 改为洗牌后的抽取顺序，random_pools 记录游标 draw_cursor、序列长度 draw_total
+    和可选的 draw_seed；pool_members.origin_slot 保存原始成员的洗牌顺序，供带 seed 的池重置。
+    """
+    c.execute('ALTER TABLE random_pools ADD COLUMN draw_cursor INTEGER NOT NULL DEFAULT 0')
+    c.execute('ALTER TABLE random_pools ADD COLUMN draw_total INTEGER NOT NULL DEFAULT 0')
+    c.execute('ALTER TABLE random_pools ADD COLUMN draw_seed TEXT')
+    c.execute('ALTER TABLE pool_members ADD COLUMN origin_slot INTEGER')
+    c.execute('SELECT id FROM random_pools')
+    for (pool_id,) in c.fetchall():
+        c.execute('SELECT code FROM pool_members WHERE pool_id = ? AND is_origin = 1 ORDER BY position', (pool_id,))
+        origin = [row[0] for row in c.fetchall()]
+        random.shuffle(origin)
+        c.executemany('UPDATE pool_members SET origin_slot = ? WHERE pool_id = ? AND code = ?',
+                      [(slot, pool_id, code) for slot, code in enumerate(origin)])
+        c.execute('SELECT code FROM pool_members WHERE pool_id = ? AND slot IS NOT NULL', (pool_id,))
+        current = [row[0] for row in c.fetchall()]
+        random.shuffle(current)
+        c.executemany('UPDATE pool_members SET slot = ? WHERE pool_id = ? AND code = ?',
+                      [(slot, pool_id, code) for slot, code in enumerate(current)])
+        c.execute('UPDATE random_pools SET draw_cursor = 0, draw_total = ? WHERE id = ?', (len(current), pool_id))
+
+
+def migrate_scores_v11(c):
+    """
+    随机池二次筛选改为声明式：random_pools.active_filter_json 保存当前筛选条件，抽取 / 列表时与 scores 联表判断；
+    filter_remain 缓存满足条件的剩余数量，池成员的完成率 / 收藏变化时由触发器置空，下次用到时重新统计。
+    """
+    c.execute('ALTER TABLE random_pools ADD COLUMN active_filter_json TEXT')
+    c.execute('ALTER TABLE random_pools ADD COLUMN filter_remain INTEGER')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_pool_members_code ON pool_members(code)')
+    for name, event, row in (('ai', 'INSERT', 'NEW'),
+                             ('au', 'UPDATE OF completion, is_favorite', 'NEW'),
+                             ('ad', 'DELETE', 'OLD')):
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS scores_pool_filter_{name} AFTER {event} ON scores BEGIN
+                UPDATE random_pools SET filter_remain = NULL
+                WHERE filter_remain IS NOT NULL
+                  AND id IN (SELECT pool_id FROM pool_members WHERE code = {row}.score_code);
+            END
+        ''')
+
+
+def migrate_scores_v12(c):
+    """随机池加权抽取：draw_weight 记录池的加权方式，NULL 为等概率"""
+    c.execute('ALTER TABLE random_pools ADD COLUMN draw_weight TEXT')
+
+
+def migrate_scores_v13(c):
+    """
+    快照曲谱码区分实际爬到（observed = 1）与增量爬取时沿用上一份快照的（observed = 0）；
+    留存统计改为只按完整快照计算，清空后由 refresh_code_presence 重算，差异缓存一并清空。
+    """
+    c.execute('ALTER TABLE jianshang_snapshot_codes ADD COLUMN observed INTEGER NOT NULL DEFAULT 1')
+    c.execute('DELETE FROM jianshang_code_presence')
+    c.execute('UPDATE jianshang_snapshots SET presence_applied = 0')
+    c.execute('DELETE FROM jianshang_snapshot_diffs')
+
+
+def migrate_scores_v3(c):
+    """鉴赏爬取检查点：已见过的 work_id 及发布时间，单行的爬取状态（发布时间高水位等）"""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS jianshang_seen_works (
+            work_id INTEGER PRIMARY KEY,
+            share_code TEXT,
+            publish_time INTEGER,
+            first_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_seen_works_publish ON jianshang_seen_works(publish_time)')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS jianshang_crawl_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            max_publish_time INTEGER,
+            last_crawl_at TIMESTAMP,
+            last_full_crawl_at TIMESTAMP,
+            last_mode TEXT
+        )
+    ''')
+
+
+# (目标版本, 迁移函数)，按顺序执行，版本号记录在 PRAGMA user_version 中
+SCORES_MIGRATIONS = [
+    (1, migrate_scores_v1),
+    (2, migrate_scores_v2),
+    (3, migrate_scores_v3),
+    (4, migrate_scores_v4),
+    (5, migrate_scores_v5),
+    (6, migrate_scores_v6),
+    (7, migrate_scores_v7),
+    (8, migrate_scores_v8),
+    (9, migrate_scores_v9),
+    (10, migrate_scores_v10),
+    (11, migrate_scores_v11),
+    (12, migrate_scores_v12),
+    (13, migrate_scores_v13),
+]
+
+# 需要在迁移事务之外先执行的准备步骤（如在线备份，不能在写事务中进行）
+SCORES_MIGRATION_PREPARE = {
+    1: prepare_scores_v1,
+}
+
+
+def run_scores_migrations(conn):
+    c = conn.cursor()
+    current = c.execute('PRAGMA user_version').fetchone()[0]
+    for version, migrate in SCORES_MIGRATIONS:
+        if current >= version:
+            continue
+        if conn.in_transaction:
+            conn.commit()
+        prepare = SCORES_MIGRATION_PREPARE.get(version)
+        if prepare:
+            prepare(c)
+        try:
+            # sqlite3 模块不会为 DDL 自动开启事务：显式开启，让 DDL 与 user_version 一起提交或回滚
+            c.execute('BEGIN IMMEDIATE')
+            migrate(c)
+            c.execute(f'PRAGMA user_version = {int(version)}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        current = version
+
+# ========== 全文索引（FTS5） ==========
+
+# 各 FTS 表是否可用；SQLite 未编译 FTS5 时为 False，接口回退为逐行子串匹配
+FTS_READY = {'scores': False, 'reviews': False}
+
+
+def ensure_fts_index(c, table, fts_table, source_sql, watch_columns):
+    """
+    为 table 建立 FTS5 索引表 fts_table（rowid 与源表 id 一致，存放 n-gram 词元），
+    并用触发器保持同步；只有 watch_columns 变化时才重建该行的词元。
+    source_sql 为待索引文本的 SQL 表达式，{row} 占位符会替换为 new 或表名。
+    首次创建时回填已有数据，返回 FTS 是否可用。
+    """
+    exists = c.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts_table,)
+    ).fetchone() is not None
+    if not exists:
+        try:
+            c.execute(f'CREATE VIRTUAL TABLE {fts_table} USING fts5(tokens, tokenize = "unicode61")')
+        except sqlite3.OperationalError as e:
+            print(f"当前 SQLite 不支持 FTS5，{table} 不建立全文索引: {e}")
+            return False
+
+    new_text = source_sql.format(row='new')
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts_table}(rowid, tokens) VALUES (new.id, fts_ngrams({new_text}));
+        END
+    ''')
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE OF {', '.join(watch_columns)} ON {table} BEGIN
+            DELETE FROM {fts_table} WHERE rowid = old.id;
+            INSERT INTO {fts_table}(rowid, tokens) VALUES (new.id, fts_ngrams({new_text}));
+        END
+    ''')
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {table} BEGIN
+            DELETE FROM {fts_table} WHERE rowid = old.id;
+        END
+    ''')
+
+    if not exists:
+        c.execute(f'''
+            INSERT INTO {fts_table}(rowid, tokens)
+            SELECT id, fts_ngrams({source_sql.format(row=table)}) FROM {table}
+        ''')
+        print(f"已为 {table} 建立全文索引 {fts_table}")
+    return True
+
+
+def fts_match_conditions(id_expr, fts_table, text_exprs, keyword, use_fts):
+    """
+    生成“文本包含 keyword”的 SQL 条件及参数：
+    FTS 可用时先按 n-gram 索引取候选 rowid，再用 text_contains 精确校验；
+    text_exprs 中任一列包含即算命中。
+    """
+    contains_sql = ' OR '.join(f'text_contains({expr}, ?)' for expr in text_exprs)
+    params = [keyword] * len(text_exprs)
+    match_query = fts_keyword_query(keyword) if use_fts else None
+    if not match_query:
+        return f'({contains_sql})', params
+    sql = f'({id_expr} IN (SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH ?) AND ({contains_sql}))'
+    return sql, [match_query] + params
+
+# 数据库初始化
+def init_db():
+    with scores_db.connection() as conn:
+        c = conn.cursor()
+
+        # 创建曲谱表（如果不存在）
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS scores (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                score_code TEXT NOT NULL,
+                completion INTEGER,
+                difficulty INTEGER NOT NULL DEFAULT 0,
+                region TEXT NOT NULL DEFAULT 'CN',
+                is_favorite BOOLEAN DEFAULT 0,
+                remark TEXT DEFAULT '',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
     
-    # 检查并添加缺失的列
-    try:
-        # 检查 completion 列是否存在
-        c.execute('SELECT completion FROM scores LIMIT 1')
-    except sqlite3.OperationalError:
-        # 如果不存在，添加 completion 列
-        c.execute('ALTER TABLE scores ADD COLUMN completion INTEGER DEFAULT 0')
+        # 检查并添加缺失的列
+        try:
+            # 检查 completion 列是否存在
+            c.execute('SELECT completion FROM scores LIMIT 1')
+        except sqlite3.OperationalError:
+            # 如果不存在，添加 completion 列
+            c.execute('ALTER TABLE scores ADD COLUMN completion INTEGER DEFAULT 0')
     
-    try:
-        # 检查 difficulty 列是否存在
-        c.execute('SELECT difficulty FROM scores LIMIT 1')
-    except sqlite3.OperationalError:
-        # 如果不存在，添加 difficulty 列
-        c.execute('ALTER TABLE scores ADD COLUMN difficulty INTEGER NOT NULL DEFAULT 0')
+        try:
+            # 检查 difficulty 列是否存在
+            c.execute('SELECT difficulty FROM scores LIMIT 1')
+        except sqlite3.OperationalError:
+            # 如果不存在，添加 difficulty 列
+            c.execute('ALTER TABLE scores ADD COLUMN difficulty INTEGER NOT NULL DEFAULT 0')
     
-    try:
-        # 检查 region 列是否存在
-        c.execute('SELECT region FROM scores LIMIT 1')
-    except sqlite3.OperationalError:
-        # 如果不存在，添加 region 列
-        c.execute('ALTER TABLE scores ADD COLUMN region TEXT NOT NULL DEFAULT "CN"')
+        try:
+            # 检查 region 列是否存在
+            c.execute('SELECT region FROM scores LIMIT 1')
+        except sqlite3.OperationalError:
+            # 如果不存在，添加 region 列
+            c.execute('ALTER TABLE scores ADD COLUMN region TEXT NOT NULL DEFAULT "CN"')
     
-    try:
-        # 检查 is_favorite 列是否存在
-        c.execute('SELECT is_favorite FROM scores LIMIT 1')
-    except sqlite3.OperationalError:
-        # 如果不存在，添加 is_favorite 列
-        c.execute('ALTER TABLE scores ADD COLUMN is_favorite BOOLEAN DEFAULT 0')
+        try:
+            # 检查 is_favorite 列是否存在
+            c.execute('SELECT is_favorite FROM scores LIMIT 1')
+        except sqlite3.OperationalError:
+            # 如果不存在，添加 is_favorite 列
+            c.execute('ALTER TABLE scores ADD COLUMN is_favorite BOOLEAN DEFAULT 0')
 
-    try:
-        # 检查 remark 列是否存在
-        c.execute('SELECT remark FROM scores LIMIT 1')
-    except sqlite3.OperationalError:
-        # 如果不存在，添加 remark 列
-        c.execute('ALTER TABLE scores ADD COLUMN remark TEXT DEFAULT ""')
-    
-    try:
-        # 检查 created_at 列是否存在
-        c.execute('SELECT created_at FROM scores LIMIT 1')
-    except sqlite3.OperationalError:
-        # 如果不存在，添加 created_at 列
-        c.execute('ALTER TABLE scores ADD COLUMN created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP')
+        try:
+            # 检查 remark 列是否存在
+            c.execute('SELECT remark FROM scores LIMIT 1')
+        except sqlite3.OperationalError:
+            # 如果不存在，添加 remark 列
+            c.execute('ALTER TABLE scores ADD COLUMN remark TEXT DEFAULT ""')
     
-    # 新建随机池表，升级支持origin_codes_json
-    try:
-        c.execute('ALTER TABLE random_pools ADD COLUMN origin_codes_json TEXT')
-    except Exception:
-        pass
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS random_pools (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            filter_json TEXT NOT NULL,
-            codes_json TEXT NOT NULL,
-            origin_codes_json TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        try:
+            # 检查 created_at 列是否存在
+            c.execute('SELECT created_at FROM scores LIMIT 1')
+        except sqlite3.OperationalError:
+            # 如果不存在，添加 created_at 列
+            c.execute('ALTER TABLE scores ADD COLUMN created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP')
+
+        # 新建随机池表，升级支持origin_codes_json（需在迁移前建好，成员迁移会读取它）
+        try:
+            c.execute('ALTER TABLE random_pools ADD COLUMN origin_codes_json TEXT')
+        except Exception:
+            pass
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS random_pools (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                filter_json TEXT NOT NULL,
+                codes_json TEXT NOT NULL,
+                origin_codes_json TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # 执行版本化迁移（合并重复曲谱码、建立索引等）
+        # 先关闭上面的游标，避免未读完的探测语句锁住 scores 表
+        c.close()
+        run_scores_migrations(conn)
+        c = conn.cursor()
+
+        # 备注全文索引
+        FTS_READY['scores'] = ensure_fts_index(
+            c, 'scores', 'scores_fts', "COALESCE({row}.remark, '')", ('remark',)
         )
-    ''')
 
-    conn.commit()
-    conn.close()
 
 def init_reviews_db():
-    conn = sqlite3.connect('reviews.db')
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS reviews (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            score_code TEXT NOT NULL,
-            rating INTEGER NOT NULL CHECK(rating BETWEEN 1 AND 5),
-            comment TEXT,
-            video_path TEXT,
-            is_top BOOLEAN DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    with reviews_db.connection() as conn:
+        c = conn.cursor()
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS reviews (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                score_code TEXT NOT NULL,
+                rating INTEGER NOT NULL CHECK(rating BETWEEN 1 AND 5),
+                comment TEXT,
+                video_path TEXT,
+                is_top BOOLEAN DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_reviews_score ON reviews(score_code)')
+
+        try:
+            # 检查 video_status 列是否存在（processing 表示视频在后台转码，NULL 表示可用）
+            c.execute('SELECT video_status FROM reviews LIMIT 1')
+        except sqlite3.OperationalError:
+            c.execute('ALTER TABLE reviews ADD COLUMN video_status TEXT')
+
+        # 视频转码任务：source_name / target_name 为上传目录下的文件名
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS transcode_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                review_id INTEGER NOT NULL,
+                source_name TEXT NOT NULL,
+                target_name TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_transcode_jobs_status ON transcode_jobs(status, id)')
+        # 上次退出时还在执行的任务重新排队
+        c.execute("UPDATE transcode_jobs SET status = 'queued' WHERE status = 'running'")
+
+        # 曲谱码 + 评价内容全文索引（供 q 搜索）
+        FTS_READY['reviews'] = ensure_fts_index(
+            c, 'reviews', 'reviews_fts',
+            "{row}.score_code || char(10) || COALESCE({row}.comment, '')",
+            ('score_code', 'comment')
         )
-    ''')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_reviews_score ON reviews(score_code)')
-    conn.commit()
-    conn.close()
 
 # 初始化数据库
 init_db()
@@ -354,33 +1170,114 @@ init_db()
 # 初始化评价数据库
 init_reviews_db()
 
+# ========== 曲谱码状态批量查询 ==========
+
+SQLITE_IN_CHUNK_SIZE = 500  # 回退路径下单条 IN (...) 的最大占位符数量，低于 SQLite 变量上限
+
+
+def _empty_code_state(code):
+    return {
+        'score_code': code,
+        'exists': False,
+        'completion': None,
+        'is_favorite': False,
+        'remark': '',
+        'has_review': False,
+        'title': None,
+        'author': None,
+    }
+
+
+def _resolve_code_states_chunked(c, unique_codes, states):
+    """不支持 json_each 时按 SQLITE_IN_CHUNK_SIZE 分块查询"""
+    for i in range(0, len(unique_codes), SQLITE_IN_CHUNK_SIZE):
+        chunk = unique_codes[i:i + SQLITE_IN_CHUNK_SIZE]
+        placeholders = ','.join(['?'] * len(chunk))
+        c.execute(f'''
+            SELECT score_code, completion, is_favorite, remark
+            FROM scores WHERE score_code IN ({placeholders})
+        ''', chunk)
+        for code, completion, is_favorite, remark in c.fetchall():
+            states[code].update(exists=True, completion=completion,
+                                is_favorite=bool(is_favorite), remark=remark or '')
+        c.execute(f'''
+            SELECT DISTINCT score_code FROM rv.reviews WHERE score_code IN ({placeholders})
+        ''', chunk)
+        for (code,) in c.fetchall():
+            states[code]['has_review'] = True
+        c.execute(f'''
+            SELECT share_code, title, nickname FROM works WHERE share_code IN ({placeholders})
+        ''', chunk)
+        for code, title, author in c.fetchall():
+            states[code].update(title=title, author=author)
+
+
+def resolve_code_states(codes):
+    """
+    批量解析曲谱码状态：返回 {score_code: {exists, completion, is_favorite, remark, has_review, title, author}}，
+    title / author 来自 works 表（没有作品元数据时为 None）。
+    不论多少个曲谱码都只执行一条 SQL（json_each 展开 + LEFT JOIN + EXISTS），
+    不在库中的曲谱码也会返回默认状态。
+    """
+    unique_codes = list(dict.fromkeys(code for code in codes if code))
+    states = {code: _empty_code_state(code) for code in unique_codes}
+    if not unique_codes:
+        return states
+
+    with scores_db.connection() as conn:
+        c = conn.cursor()
+        try:
+            c.execute('''
+                SELECT w.value, sc.id IS NOT NULL, sc.completion, sc.is_favorite, sc.remark,
+                       EXISTS (SELECT 1 FROM rv.reviews r WHERE r.score_code = w.value),
+                       wk.title, wk.nickname
+                FROM json_each(?) w
+                LEFT JOIN scores sc ON sc.score_code = w.value
+                LEFT JOIN works wk ON wk.share_code = w.value
+            ''', (json.dumps(unique_codes),))
+        except sqlite3.OperationalError as e:
+            if 'json_each' not in str(e):
+                raise
+            _resolve_code_states_chunked(c, unique_codes, states)
+            return states
+        for code, exists, completion, is_favorite, remark, has_review, title, author in c.fetchall():
+            states[code].update(
+                exists=bool(exists),
+                completion=completion,
+                is_favorite=bool(is_favorite),
+                remark=remark or '',
+                has_review=bool(has_review),
+                title=title,
+                author=author,
+            )
+    return states
+
 # ========== API爬虫相关函数 ==========
 
-def fetch_jianshang_api_page(session, page, timeout=12):
-    """获取单页鉴赏数据"""
-    params = dict(JIANSHANG_API_PARAMS, page=page)
-    try:
-        resp = session.get(
-            jianshang_api_url,
-            params=params,
-            headers=JIANSHANG_API_HEADERS,
-            timeout=timeout
-        )
-        resp.raise_for_status()
-        data = resp.json()
-        if data.get("retcode") != 0:
-            raise RuntimeError(f"API返回错误: retcode={data.get('retcode')}, message={data.get('message')}")
-        return data
-    except Exception as e:
-        print(f"获取第{page}页数据失败: {e}")
-        raise
-
-def extract_share_codes_from_api_response(payload):
-    """从API响应中提取share_code字段"""
-    data = payload.get("data") or {}
-    slide = data.get("slide") or {}
-    work_list = slide.get("work_list") or []
-    
+# 并发爬虫参数：同时在途请求数、令牌桶每秒请求数
+JIANSHANG_CRAWL_CONCURRENCY = 4
+JIANSHANG_CRAWL_RATE = 5.0
+
+# 所有爬取共用一个带连接池的 Session
+jianshang_session = create_pooled_session(JIANSHANG_CRAWL_CONCURRENCY)
+
+
+def create_jianshang_crawler(**overrides):
+    """按应用配置创建并发爬虫，overrides 可覆盖并发数、限速、base_url 等"""
+    options = dict(
+        base_url=jianshang_api_url,
+        params=JIANSHANG_API_PARAMS,
+        headers=JIANSHANG_API_HEADERS,
+        concurrency=JIANSHANG_CRAWL_CONCURRENCY,
+        rate=JIANSHANG_CRAWL_RATE,
+        session=jianshang_session,
+    )
+    options.update(overrides)
+    return JianshangCrawler(**options)
+
+
+def extract_share_codes_from_work_list(work_list):
+    """从作品列表中提取share_code字段"""
     share_codes = []
     for work in work_list:
         share_code = work.get("share_code")
@@ -389,44 +1286,6 @@ def extract_share_codes_from_api_response(payload):
     
     return share_codes
 
-def crawl_all_jianshang_codes(max_pages=50, sleep_sec=0.3):
-    """爬取所有鉴赏码"""
-    session = requests.Session()
-    page = 1
-    all_share_codes = []
-    seen_codes = set()
-    
-    for _ in range(max_pages):
-        try:
-            payload = fetch_jianshang_api_page(session, page)
-            share_codes = extract_share_codes_from_api_response(payload)
-            
-            print(f"第{page}页 -> 找到{len(share_codes)}个曲谱码")
-            
-            # 去重并添加到结果
-            for code in share_codes:
-                if code not in seen_codes:
-                    seen_codes.add(code)
-                    all_share_codes.append(code)
-            
-            # 检查是否还有更多数据
-            data = payload.get("data") or {}
-            slide = data.get("slide") or {}
-            work_list = slide.get("work_list") or []
-            
-            if len(work_list) < JIANSHANG_API_PARAMS["page_size"]:
-                print(f"第{page}页数据不足，停止爬取")
-                break
-                
-            page += 1
-            time.sleep(sleep_sec)  # 限速防止被封
-            
-        except Exception as e:
-            print(f"获取第{page}页失败: {e}")
-            break
-    
-    return all_share_codes
-
 # 存储上一次的剪贴板内容
 last_clipboard_content = ''
 current_score_code = None
@@ -493,63 +1352,46 @@ def is_valid_completion(text):
     except:
         return False
 
-def check_clipboard():
-    """监控剪贴板变化"""
+# 剪贴板来源：auto 在 Linux 上优先用 Wayland / X11 的事件通知，其他情况自适应轮询；测试时可设为 stub
+CLIPBOARD_SOURCE = os.environ.get('QINYIN_CLIPBOARD_SOURCE', 'auto')
+clipboard_source = create_clipboard_source(CLIPBOARD_SOURCE, paste=pyperclip.paste)
+
+
+def handle_clipboard_change(current_content):
+    """剪贴板内容变化（已去重）：是曲谱码时查出状态推送到前端"""
     global last_clipboard_content, current_score_code
-    retry_count = 0
-    max_retries = 3
-    retry_delay = 1  # 重试延迟（秒）
-    
-    print("剪贴板监控线程开始运行...")
-    
+    last_clipboard_content = current_content
+    print(f"检测到剪贴板变化: {current_content}")
+    try:
+        # 检查是否是有效的曲谱码
+        if is_valid_score_code(current_content):
+            print(f"检测到有效曲谱码: {current_content}")
+            current_score_code = current_content
+            # 一次查询拿到完成率 / 收藏 / 备注 / 是否有评价
+            state = resolve_code_states([current_content])[current_content]
+
+            # 发送曲谱码到前端
+            broadcast_bus.emit_now('clipboard_update', {'type': 'score_code', **state}, to=page_room('index'))
+            print(f"已发送曲谱码到前端: {current_content}")
+    except Exception as e:
+        print(f"处理剪贴板内容失败: {e}")
+
+
+def check_clipboard():
+    """监控剪贴板变化；事件驱动的来源出错退出时改用轮询"""
+    global clipboard_source
+    print(f"剪贴板监控线程开始运行（来源: {clipboard_source.name}）...")
+
     while True:
         try:
-            current_content = pyperclip.paste()
-            if current_content and current_content != last_clipboard_content:
-                last_clipboard_content = current_content
-                print(f"检测到剪贴板变化: {current_content}")
-                
-                # 检查是否是有效的曲谱码
-                if is_valid_score_code(current_content):
-                    print(f"检测到有效曲谱码: {current_content}")
-                    current_score_code = current_content
-                    # 检查数据库中是否存在该曲谱码（原有）
-                    conn = sqlite3.connect('scores.db')
-                    c = conn.cursor()
-                    c.execute('SELECT completion, is_favorite, remark FROM scores WHERE score_code = ? ORDER BY created_at DESC LIMIT 1', (current_content,))
-                    result = c.fetchone()
-                    conn.close()
-
-                    # 新增：检查是否有评价（喜欢）
-                    conn_r = sqlite3.connect('reviews.db')
-                    cr = conn_r.cursor()
-                    cr.execute('SELECT 1 FROM reviews WHERE score_code = ? LIMIT 1', (current_content,))
-                    has_review = cr.fetchone() is not None
-                    conn_r.close()
-
-                    # 发送曲谱码到前端（新增 has_review）
-                    socketio.emit('clipboard_update', {
-                        'type': 'score_code',
-                        'score_code': current_content,
-                        'exists': bool(result),
-                        'completion': result[0] if result else None,
-                        'is_favorite': result[1] if result else False,
-                        'remark': result[2] if (result and result[2] is not None) else '',
-                        'has_review': has_review
-                    })
-                    print(f"已发送曲谱码到前端: {current_content}")
-            retry_count = 0  # 重置重试计数
+            clipboard_source.run(handle_clipboard_change)
+            return
         except Exception as e:
-            retry_count += 1
-            if retry_count >= max_retries:
-                print(f"剪贴板监控错误: {e}，已达到最大重试次数")
-                retry_count = 0
-                time.sleep(retry_delay * 2)  # 增加更长的等待时间
-            else:
-                print(f"剪贴板监控错误: {e}，正在重试 ({retry_count}/{max_retries})")
-                time.sleep(retry_delay)
-            continue
-        time.sleep(0.5)  # 每0.5秒检查一次
+            print(f"剪贴板监控来源 {clipboard_source.name} 出错: {e}，改用轮询")
+            last_text = clipboard_source.last_text
+            clipboard_source = PollingClipboardSource(pyperclip.paste)
+            clipboard_source.last_text = last_text
+            time.sleep(1)
 
 # 启动剪贴板监控线程
 clipboard_thread = threading.Thread(target=check_clipboard, daemon=True, name="ClipboardMonitor")
@@ -576,65 +1418,114 @@ def serve_uploaded_video(filename):
 def index():
     return render_template('index.html')
 
+SCORES_PAGE_DEFAULT_LIMIT = 100
+SCORES_PAGE_MAX_LIMIT = 500
+
+
+def encode_scores_cursor(created_at, score_code):
+    raw = json.dumps([created_at, score_code], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_scores_cursor(cursor):
+    """解析分页游标，返回 (created_at, score_code)；格式不对时返回 None"""
+    try:
+        created_at, score_code = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        return None
+    if not isinstance(created_at, str) or not isinstance(score_code, str):
+        return None
+    return created_at, score_code
+
+
 @app.route('/api/scores', methods=['GET'])
 def get_scores():
+    """
+    历史记录列表，按 (created_at, score_code) 倒序。
+      - 不带 limit / cursor 时返回完整数组（兼容旧调用方）；
+      - 带 limit 或 cursor 时按游标分页，返回 {results, next_cursor, has_more}。
+    """
     try:
         # 获取筛选参数
         min_completion = request.args.get('min_completion', type=int)
         max_completion = request.args.get('max_completion', type=int)
         favorite_filter = request.args.get('favorite', type=int)  # 0: 全部, 1: 收藏, 2: 未收藏
-        
-        conn = sqlite3.connect('scores.db')
-        c = conn.cursor()
-        
+        limit = request.args.get('limit', type=int)
+        cursor = request.args.get('cursor')
+        paginated = limit is not None or cursor is not None
+        if paginated:
+            if limit is None or limit <= 0:
+                limit = SCORES_PAGE_DEFAULT_LIMIT
+            limit = min(limit, SCORES_PAGE_MAX_LIMIT)
+
         # 构建查询条件
         conditions = []
         params = []
         
         if min_completion is not None:
-            conditions.append('completion >= ?')
+            conditions.append('s.completion >= ?')
             params.append(min_completion)
         if max_completion is not None:
-            conditions.append('completion <= ?')
+            conditions.append('s.completion <= ?')
             params.append(max_completion)
         if favorite_filter is not None:
             if favorite_filter == 1:
-                conditions.append('is_favorite = 1')
+                conditions.append('s.is_favorite = 1')
             elif favorite_filter == 2:
-                conditions.append('is_favorite = 0')
-        
+                conditions.append('s.is_favorite = 0')
+        if cursor:
+            position = decode_scores_cursor(cursor)
+            if position is None:
+                return jsonify({'success': False, 'error': '无效的分页游标'}), 400
+            conditions.append('(s.created_at, s.score_code) < (?, ?)')
+            params.extend(position)
+
         # 构建SQL查询
         query = '''
-        SELECT score_code, completion, is_favorite, remark, created_at 
-        FROM scores 
+        SELECT s.score_code, s.completion, s.is_favorite, s.remark, s.created_at,
+               EXISTS (SELECT 1 FROM rv.reviews r WHERE r.score_code = s.score_code) AS has_review,
+               w.title, w.nickname
+        FROM scores s
+        LEFT JOIN works w ON w.share_code = s.score_code
         '''
         if conditions:
             query += ' WHERE ' + ' AND '.join(conditions)
-        query += ' ORDER BY created_at DESC'
-        
-        c.execute(query, params)
-        rows = c.fetchall()
-        conn.close()
-
-        # —— 新增：批量查询这些 code 是否有评价 ——
-        codes = [r[1] for r in rows]
-        has_map = set()
-        if codes:
-            conn_r = sqlite3.connect('reviews.db')
-            cr = conn_r.cursor()
-            placeholders = ','.join(['?']*len(codes))
-            cr.execute(f'SELECT DISTINCT score_code FROM reviews WHERE score_code IN ({placeholders})', codes)
-            has_map = {t[0] for t in cr.fetchall()}
-            conn_r.close()
+        query += ' ORDER BY s.created_at DESC, s.score_code DESC'
+        if paginated:
+            # 多取一行用来判断是否还有下一页
+            query += ' LIMIT ?'
+            params.append(limit + 1)
+
+        with scores_db.connection() as conn:
+            c = conn.cursor()
+            c.execute(query, params)
+            rows = c.fetchall()
+
+        has_more = paginated and len(rows) > limit
+        if has_more:
+            rows = rows[:limit]
 
-        return jsonify([{
+        results = [{
             'score_code': s[0],
             'completion': s[1],
             'is_favorite': bool(s[2]),
             'remark': s[3] or '',
             'created_at': s[4],
-            'has_review': s[0] in has_map   # ★ 新增字段
-        } for s in rows])
+            'has_review': bool(s[5]),
+            'title': s[6],
+            'author': s[7]
+        } for s in rows]
+
+        if not paginated:
+            return jsonify(results)
+
+        next_cursor = encode_scores_cursor(rows[-1][4], rows[-1][0]) if has_more else None
+        return jsonify({
+            'success': True,
+            'results': results,
+            'next_cursor': next_cursor,
+            'has_more': has_more
+        })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -651,37 +1542,18 @@ def save_score():
         if not is_valid_completion(str(completion)):
             return jsonify({'success': False, 'error': '无效的完成率'}), 400
         
-        conn = sqlite3.connect('scores.db')
-        c = conn.cursor()
-        
-        # 检查曲谱码是否存在
-        c.execute('SELECT id FROM scores WHERE score_code = ? ORDER BY created_at DESC LIMIT 1', (score_code,))
-        existing_record = c.fetchone()
-        
-        if existing_record:
-            # 如果存在，更新记录
-            c.execute('''
-                UPDATE scores 
-                SET completion = ?, created_at = CURRENT_TIMESTAMP
-                WHERE score_code = ?
-            ''', (completion, score_code))
-        else:
-            # 如果不存在，创建新记录
-            c.execute('''
-                INSERT INTO scores (score_code, completion, difficulty, region, created_at) 
+        with scores_db.connection() as conn:
+            # 不存在则新建，存在则更新完成率
+            conn.execute('''
+                INSERT INTO scores (score_code, completion, difficulty, region, created_at)
                 VALUES (?, ?, 0, 'CN', CURRENT_TIMESTAMP)
+                ON CONFLICT(score_code) DO UPDATE SET
+                    completion = excluded.completion,
+                    created_at = CURRENT_TIMESTAMP
             ''', (score_code, completion))
         
-        conn.commit()
-        conn.close()
-        
         # 发送完成率到前端
-        socketio.emit('clipboard_update', {
-            'type': 'completion',
-            'score_code': score_code,
-            'completion': completion,
-            'message': '保存成功'
-        })
+        broadcast_bus.publish(score_code, completion=int(completion))
         
         return jsonify({'success': True})
     except Exception as e:
@@ -690,42 +1562,23 @@ def save_score():
 @app.route('/api/scores/<score_code>/favorite', methods=['POST'])
 def toggle_favorite(score_code):
     try:
-        conn = sqlite3.connect('scores.db')
-        c = conn.cursor()
-        # 获取当前收藏状态
-        c.execute('SELECT is_favorite FROM scores WHERE score_code = ? ORDER BY created_at DESC LIMIT 1', (score_code,))
-        result = c.fetchone()
-        
-        if result:
-            # 更新收藏状态
-            new_status = not result[0]
-            c.execute('UPDATE scores SET is_favorite = ?, created_at = CURRENT_TIMESTAMP WHERE score_code = ?', (new_status, score_code))
-            conn.commit()
-            conn.close()
-            
-            # 发送更新到前端
-            socketio.emit('favorite_update', {
-                'score_code': score_code,
-                'is_favorite': new_status
-            })
-            
-            return jsonify({'success': True, 'is_favorite': new_status})
-        else:
-            # 如果记录不存在，创建新记录并标记为收藏
+        with scores_db.connection() as conn:
+            c = conn.cursor()
+            # 记录不存在时新建并标记为收藏，存在时切换收藏状态
             c.execute('''
-                INSERT INTO scores (score_code, completion, difficulty, region, is_favorite, created_at) 
-                VALUES (?, ?, 0, 'CN', 1, CURRENT_TIMESTAMP)
-            ''', (score_code, None))
-            conn.commit()
-            conn.close()
-            
-            # 发送更新到前端
-            socketio.emit('favorite_update', {
-                'score_code': score_code,
-                'is_favorite': True
-            })
-            
-            return jsonify({'success': True, 'is_favorite': True})
+                INSERT INTO scores (score_code, completion, difficulty, region, is_favorite, created_at)
+                VALUES (?, NULL, 0, 'CN', 1, CURRENT_TIMESTAMP)
+                ON CONFLICT(score_code) DO UPDATE SET
+                    is_favorite = NOT COALESCE(is_favorite, 0),
+                    created_at = CURRENT_TIMESTAMP
+            ''', (score_code,))
+            c.execute('SELECT is_favorite FROM scores WHERE score_code = ?', (score_code,))
+            new_status = bool(c.fetchone()[0])
+
+        # 发送更新到前端
+        broadcast_bus.publish(score_code, is_favorite=new_status)
+
+        return jsonify({'success': True, 'is_favorite': new_status})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -735,11 +1588,10 @@ def handle_remark(score_code):
         return jsonify({'success': False, 'error': '无效的曲谱码'}), 400
     try:
         if request.method == 'GET':
-            conn = sqlite3.connect('scores.db')
-            c = conn.cursor()
-            c.execute('SELECT remark FROM scores WHERE score_code = ? ORDER BY created_at DESC LIMIT 1', (score_code,))
-            row = c.fetchone()
-            conn.close()
+            with scores_db.connection() as conn:
+                c = conn.cursor()
+                c.execute('SELECT remark FROM scores WHERE score_code = ?', (score_code,))
+                row = c.fetchone()
             remark = ''
             if row and row[0] is not None:
                 remark = row[0]
@@ -751,24 +1603,16 @@ def handle_remark(score_code):
             remark = ''
         remark = remark.strip()
 
-        conn = sqlite3.connect('scores.db')
-        c = conn.cursor()
-        c.execute('SELECT id FROM scores WHERE score_code = ? ORDER BY created_at DESC LIMIT 1', (score_code,))
-        existing = c.fetchone()
-        if existing:
-            c.execute('UPDATE scores SET remark = ?, created_at = CURRENT_TIMESTAMP WHERE score_code = ?', (remark, score_code))
-        else:
-            c.execute('''
+        with scores_db.connection() as conn:
+            conn.execute('''
                 INSERT INTO scores (score_code, completion, difficulty, region, is_favorite, remark, created_at)
-                VALUES (?, ?, 0, 'CN', 0, ?, CURRENT_TIMESTAMP)
-            ''', (score_code, None, remark))
-        conn.commit()
-        conn.close()
+                VALUES (?, NULL, 0, 'CN', 0, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(score_code) DO UPDATE SET
+                    remark = excluded.remark,
+                    created_at = CURRENT_TIMESTAMP
+            ''', (score_code, remark))
 
-        socketio.emit('remark_update', {
-            'score_code': score_code,
-            'remark': remark
-        })
+        broadcast_bus.publish(score_code, remark=remark)
         return jsonify({'success': True, 'remark': remark})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -792,72 +1636,59 @@ def batch_update_remarks():
 
         unique_codes = list(dict.fromkeys(valid_codes))
 
-        conn = sqlite3.connect('scores.db')
-        c = conn.cursor()
+        with scores_db.connection() as conn:
+            c = conn.cursor()
 
-        # 批量获取已有备注，避免逐条查询造成的性能瓶颈
-        existing_map = {}
-        chunk_size = 500  # 小于 SQLite 变量上限 999
-        for start in range(0, len(unique_codes), chunk_size):
-            chunk = unique_codes[start:start + chunk_size]
-            placeholders = ','.join(['?'] * len(chunk))
-            c.execute(
-                f'''
-                SELECT score_code, remark, created_at
-                FROM scores
-                WHERE score_code IN ({placeholders})
-                ''',
-                chunk
-            )
-            for score_code, existing_remark, created_at in c.fetchall():
-                prev = existing_map.get(score_code)
-                # 仅保留最新的 created_at 记录
-                if not prev or (created_at or '') > prev[1]:
-                    existing_map[score_code] = ((existing_remark or ''), created_at or '')
-
-        updates = []
-        skipped = []
-        update_payload = []
-        insert_payload = []
-
-        for code in unique_codes:
-            existing_entry = existing_map.get(code)
-            existing_remark = existing_entry[0] if existing_entry else ''
-            merged = merge_remark(existing_remark, remark)
-            original_trimmed = (existing_remark or '').strip()
-
-            if existing_entry:
-                if merged != original_trimmed:
-                    update_payload.append((merged, code))
-                    updates.append({'score_code': code, 'remark': merged})
-                else:
-                    skipped.append({'score_code': code, 'remark': original_trimmed})
-            else:
-                if merged:
-                    insert_payload.append((code, None, merged))
-                    updates.append({'score_code': code, 'remark': merged})
+            # 批量获取已有备注，避免逐条查询造成的性能瓶颈
+            existing_map = {}
+            chunk_size = 500  # 小于 SQLite 变量上限 999
+            for start in range(0, len(unique_codes), chunk_size):
+                chunk = unique_codes[start:start + chunk_size]
+                placeholders = ','.join(['?'] * len(chunk))
+                c.execute(
+                    f'''
+                    SELECT score_code, remark
+                    FROM scores
+                    WHERE score_code IN ({placeholders})
+                    ''',
+                    chunk
+                )
+                for score_code, existing_remark in c.fetchall():
+                    existing_map[score_code] = existing_remark or ''
+
+            updates = []
+            skipped = []
+            upsert_payload = []
+
+            for code in unique_codes:
+                existing_remark = existing_map.get(code)
+                merged = merge_remark(existing_remark, remark)
+                original_trimmed = (existing_remark or '').strip()
+
+                if existing_remark is not None:
+                    if merged != original_trimmed:
+                        upsert_payload.append((code, merged))
+                        updates.append({'score_code': code, 'remark': merged})
+                    else:
+                        skipped.append({'score_code': code, 'remark': original_trimmed})
                 else:
-                    skipped.append({'score_code': code, 'remark': ''})
-
-        if update_payload:
-            c.executemany(
-                'UPDATE scores SET remark = ?, created_at = CURRENT_TIMESTAMP WHERE score_code = ?',
-                update_payload
-            )
-        if insert_payload:
-            c.executemany('''
-                INSERT INTO scores (score_code, completion, difficulty, region, is_favorite, remark, created_at)
-                VALUES (?, ?, 0, 'CN', 0, ?, CURRENT_TIMESTAMP)
-            ''', insert_payload)
+                    if merged:
+                        upsert_payload.append((code, merged))
+                        updates.append({'score_code': code, 'remark': merged})
+                    else:
+                        skipped.append({'score_code': code, 'remark': ''})
 
-        conn.commit()
-        conn.close()
+            if upsert_payload:
+                c.executemany('''
+                    INSERT INTO scores (score_code, completion, difficulty, region, is_favorite, remark, created_at)
+                    VALUES (?, NULL, 0, 'CN', 0, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(score_code) DO UPDATE SET
+                        remark = excluded.remark,
+                        created_at = CURRENT_TIMESTAMP
+                ''', upsert_payload)
 
-        for item in updates:
-            socketio.emit('remark_update', {
-                'score_code': item['score_code'],
-                'remark': item['remark']
-            })
+        # 整批备注合并成一个 score_updates 事件发出
+        broadcast_bus.publish_many(updates)
 
         return jsonify({
             'success': True,
@@ -873,18 +1704,16 @@ def batch_update_remarks():
 @app.route('/api/scores/stats', methods=['GET'])
 def get_stats():
     try:
-        conn = sqlite3.connect('scores.db')
-        c = conn.cursor()
-        
-        # 获取总记录数
-        c.execute('SELECT COUNT(*) FROM scores')
-        total_records = c.fetchone()[0]
-        
-        # 获取收藏歌曲数
-        c.execute('SELECT COUNT(DISTINCT score_code) FROM scores WHERE is_favorite = 1')
-        favorite_songs = c.fetchone()[0]
+        with scores_db.connection() as conn:
+            c = conn.cursor()
+
+            # 获取总记录数
+            c.execute('SELECT COUNT(*) FROM scores')
+            total_records = c.fetchone()[0]
 
-        conn.close()
+            # 获取收藏歌曲数
+            c.execute('SELECT COUNT(*) FROM scores WHERE is_favorite = 1')
+            favorite_songs = c.fetchone()[0]
 
         return jsonify({
             'total_records': total_records,
@@ -893,10 +1722,230 @@ def get_stats():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/db/stats', methods=['GET'])
+def get_db_pool_stats():
+    """连接池统计：借出次数、等待时长、busy 重试次数等，以及当前的服务器模式"""
+    return jsonify({
+        'success': True,
+        'server_mode': SERVER_MODE,
+        'pools': {
+            'scores': scores_db.stats(),
+            'reviews': reviews_db.stats(),
+        }
+    })
+
+@app.route('/api/socket/metrics', methods=['GET'])
+def get_socket_metrics():
+    """广播统计：合并前的变化数、合并次数、批量发送次数，以及各事件的发送次数与负载字节数、订阅情况"""
+    return jsonify({'success': True, 'metrics': broadcast_bus.metrics(),
+                    'subscriptions': socket_subscriptions.stats()})
+
+# ========== Socket.IO 订阅 ==========
+# 每个页面连接后发送 subscribe {page, codes}：
+#   - page 决定加入哪个页面房间，只对该页面有用的事件（当前曲谱码、爬取进度）只发到对应房间；
+#   - codes 为页面上正在显示的曲谱码，score_updates 只发与这些码相关的变化；不传 codes 表示接收全部。
+# 还没订阅的客户端（旧页面）默认加入所有房间，行为与之前一致。
+SOCKET_PAGES = ('index', 'batch', 'random_pool', 'likes')
+
+
+def page_room(page):
+    return f'page:{page}'
+
+
+@socketio.on('connect')
+def handle_socket_connect():
+    for page in SOCKET_PAGES:
+        join_room(page_room(page))
+    join_room(socket_subscriptions.all_room)
+
+
+@socketio.on('subscribe')
+def handle_socket_subscribe(data):
+    data = data or {}
+    page = data.get('page')
+    codes = data.get('codes')
+    if page not in SOCKET_PAGES:
+        return {'success': False, 'error': '未知页面'}
+    if codes is not None:
+        if not isinstance(codes, list):
+            return {'success': False, 'error': '参数格式错误'}
+        codes = [code for code in codes if isinstance(code, str) and is_valid_score_code(code)]
+    for other in SOCKET_PAGES:
+        if other != page:
+            leave_room(page_room(other))
+    join_room(page_room(page))
+    if socket_subscriptions.subscribe(request.sid, codes):
+        join_room(socket_subscriptions.all_room)
+        return {'success': True, 'all': True}
+    leave_room(socket_subscriptions.all_room)
+    return {'success': True, 'all': False, 'codes': len(codes)}
+
+
+@socketio.on('disconnect')
+def handle_socket_disconnect(*args):
+    socket_subscriptions.unsubscribe(request.sid)
+
 @app.route('/batch')
 def batch_query():
     return render_template('batch_query.html', initial_chrome_initialized=False)
 
+
+def _batch_filter_sql(min_completion, max_completion, favorite, has_review,
+                      include_keywords=(), exclude_keywords=(), uncompleted=False):
+    """把完成率 / 未完成 / 收藏 / 是否有评价 / 备注关键字筛选拼成 SQL 条件，列别名见 query_scores_by_codes"""
+    conditions = []
+    params = []
+    if uncompleted:
+        # 与页面上“仅显示未完成”一致：还没有录入完成率
+        conditions.append('s.completion IS NULL')
+    if min_completion is not None:
+        conditions.append('s.completion >= ?')
+        params.append(min_completion)
+    if max_completion is not None:
+        conditions.append('s.completion <= ?')
+        params.append(max_completion)
+    if favorite == 1:
+        conditions.append('s.is_favorite = 1')
+    elif favorite == 2:
+        conditions.append('COALESCE(s.is_favorite, 0) = 0')
+    if has_review == 1:
+        conditions.append('has_review = 1')
+    elif has_review == 2:
+        conditions.append('has_review = 0')
+    for keyword in include_keywords:
+        cond, cond_params = fts_match_conditions(
+            's.score_id', 'scores_fts', ['s.remark'], keyword, FTS_READY['scores'])
+        conditions.append(cond)
+        params.extend(cond_params)
+    for keyword in exclude_keywords:
+        cond, cond_params = fts_match_conditions(
+            's.score_id', 'scores_fts', ['s.remark'], keyword, FTS_READY['scores'])
+        conditions.append(f'NOT {cond}')
+        params.extend(cond_params)
+    return conditions, params
+
+
+def remark_matches_keywords(remark, include_keywords, exclude_keywords):
+    text = (remark or '').lower()
+    for kw in include_keywords:
+        if kw.lower() not in text:
+            return False
+    for kw in exclude_keywords:
+        if kw.lower() in text:
+            return False
+    return True
+
+
+def _query_scores_by_codes_fallback(conn, score_codes, exclude_codes, min_completion, max_completion,
+                                    favorite, has_review, include_keywords=(), exclude_keywords=(),
+                                    uncompleted=False, rank_by=None, rank_weights=None, top_n=None):
+    """
+    不支持 json_each 时的回退：resolve_code_states 分块查询 + Python 集合排除，排序值同样分块取出。
+    """
+    exclude_set = set(exclude_codes)
+    wanted = [code for code in score_codes if code not in exclude_set]
+    states = {code: _empty_code_state(code) for code in wanted}
+    _resolve_code_states_chunked(conn.cursor(), list(states), states)
+
+    rows = []
+    for code in wanted:
+        state = states[code]
+        row = (code, state['completion'], state['is_favorite'], state['remark'], state['has_review'],
+               state['title'], state['author'], None)
+        completion = row[1]
+        if uncompleted and completion is not None:
+            continue
+        if min_completion is not None and (completion is None or completion < min_completion):
+            continue
+        if max_completion is not None and (completion is None or completion > max_completion):
+            continue
+        if favorite == 1 and not row[2]:
+            continue
+        if favorite == 2 and row[2]:
+            continue
+        if has_review == 1 and not row[4]:
+            continue
+        if has_review == 2 and row[4]:
+            continue
+        if not remark_matches_keywords(row[3], include_keywords, exclude_keywords):
+            continue
+        rows.append(row)
+
+    if rank_by:
+        rank_expr, rank_params = work_rank_sql(rank_by, rank_weights)
+        rank_values = {}
+        c = conn.cursor()
+        codes = [row[0] for row in rows]
+        for i in range(0, len(codes), SQLITE_IN_CHUNK_SIZE):
+            chunk = codes[i:i + SQLITE_IN_CHUNK_SIZE]
+            c.execute(f'''
+                SELECT wk.share_code, {rank_expr} FROM works wk
+                WHERE wk.share_code IN ({','.join(['?'] * len(chunk))})
+            ''', rank_params + chunk)
+            rank_values.update(c.fetchall())
+        rows = [row[:7] + (rank_values.get(row[0]),) for row in rows]
+        # 有排序值的在前（降序），没有作品数据的保持输入顺序排在最后
+        rows.sort(key=lambda row: (row[7] is None, -(row[7] or 0)))
+    if top_n:
+        rows = rows[:top_n]
+    return rows
+
+
+def query_scores_by_codes(conn, score_codes, exclude_codes=(), min_completion=None,
+                          max_completion=None, favorite=None, has_review=None,
+                          include_keywords=(), exclude_keywords=(), uncompleted=False,
+                          rank_by=None, rank_weights=None, top_n=None):
+    """
+    批量查询曲谱码的完成率 / 收藏 / 备注 / 是否有评价及作品标题、作者，返回
+    (score_code, completion, is_favorite, remark, has_review, title, author, rank_value) 元组列表。
+    默认按输入顺序；指定 rank_by 时按作品指标降序（见 work_rank_sql），top_n 只取前 N 条，
+    排序与截取都在 SQL 里完成。
+
+    曲谱码与排除列表以 JSON 数组整体绑定，由 json_each 展开后在一条 SQL 里
+    完成排除、筛选和 EXISTS 判断，不受 SQLite 变量数量上限影响；
+    备注关键字走 scores_fts 全文索引（不区分大小写的子串语义）。
+    SQLite 不带 JSON1 时回退到分块查询。数据库中没有的曲谱码也会返回（completion 为 None）。
+    """
+    conditions, params = _batch_filter_sql(min_completion, max_completion, favorite, has_review,
+                                           include_keywords, exclude_keywords, uncompleted)
+    where_sql = ''.join(f' AND {cond}' for cond in conditions)
+    rank_expr, rank_params = work_rank_sql(rank_by, rank_weights) if rank_by else ('NULL', [])
+    order_sql = 's.rank_value DESC, s.pos' if rank_by else 's.pos'
+    limit_sql = ' LIMIT ?' if top_n else ''
+    sql = f'''
+        WITH wanted(pos, code) AS (
+            SELECT key, value FROM json_each(?)
+        ),
+        excluded(code) AS (
+            SELECT value FROM json_each(?)
+        )
+        SELECT * FROM (
+            SELECT w.pos, w.code, sc.completion, sc.is_favorite, sc.remark, sc.id AS score_id,
+                   EXISTS (SELECT 1 FROM rv.reviews r WHERE r.score_code = w.code) AS has_review,
+                   wk.title, wk.nickname, {rank_expr} AS rank_value
+            FROM wanted w
+            LEFT JOIN scores sc ON sc.score_code = w.code
+            LEFT JOIN works wk ON wk.share_code = w.code
+            WHERE w.code NOT IN (SELECT code FROM excluded)
+        ) s
+        WHERE 1 = 1{where_sql}
+        ORDER BY {order_sql}{limit_sql}
+    '''
+    try:
+        c = conn.cursor()
+        c.execute(sql, [json.dumps(list(score_codes)), json.dumps(list(exclude_codes))]
+                  + rank_params + params + ([top_n] if top_n else []))
+        return [(row[1], row[2], row[3], row[4], row[6], row[7], row[8], row[9]) for row in c.fetchall()]
+    except sqlite3.OperationalError as e:
+        if 'json_each' not in str(e):
+            raise
+        print(f"json_each 不可用，批量查询回退到分块模式: {e}")
+        return _query_scores_by_codes_fallback(
+            conn, score_codes, exclude_codes, min_completion, max_completion, favorite, has_review,
+            include_keywords, exclude_keywords, uncompleted, rank_by, rank_weights, top_n
+        )
+
+
 @app.route('/api/scores/batch', methods=['POST'])
 def batch_query_scores():
     try:
@@ -906,6 +1955,7 @@ def batch_query_scores():
         min_completion = data.get('min_completion')
         max_completion = data.get('max_completion')
         favorite = data.get('favorite')
+        has_review = data.get('has_review')  # 0/None: 全部, 1: 有评价, 2: 无评价
         include_remark_val = data.get('include_remark')
         exclude_remark_val = data.get('exclude_remark')
 
@@ -918,176 +1968,1252 @@ def batch_query_scores():
                 items = re.split(r'[\n,;]+', str(raw))
             return [item.strip() for item in items if item and item.strip()]
 
+        def normalize_flag(raw):
+            try:
+                return int(raw) if raw is not None else None
+            except (TypeError, ValueError):
+                return None
+
         include_keywords = [kw.lower() for kw in normalize_keywords(include_remark_val)]
         exclude_keywords = [kw.lower() for kw in normalize_keywords(exclude_remark_val)]
+        favorite = normalize_flag(favorite)
+        has_review = normalize_flag(has_review)
+        uncompleted = normalize_flag(data.get('uncompleted')) == 1
+        # 排序：rank_by = hot_score / quality_score / like_cnt / save_cnt / game_like_cnt / blend，
+        # blend 可带 rank_weights（如 {"quality_score": 0.7, "like_cnt": 0.3}），top_n 取前 N 条
+        try:
+            rank_by, rank_weights, top_n = parse_rank_options(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
 
-        # 调试打印参数
-        #print("score_codes:", score_codes)
-        #print("exclude_codes:", exclude_codes)
-#
-        conn = sqlite3.connect('scores.db')
-        c = conn.cursor()
+        with scores_db.connection() as conn:
+            c = conn.cursor()
 
-        # 如果 score_codes 为空，则查所有曲谱码
-        if not score_codes:
-            c.execute("SELECT DISTINCT score_code FROM scores")
-            score_codes = [row[0] for row in c.fetchall()]
+            # 如果 score_codes 为空，则查所有曲谱码；scope=works 时改为全部已知作品（含没录入过的）
+            if not score_codes:
+                if data.get('scope') == 'works':
+                    c.execute("SELECT share_code FROM works")
+                else:
+                    c.execute("SELECT score_code FROM scores")
+                score_codes = [row[0] for row in c.fetchall()]
+
+            if not score_codes:
+                return jsonify({'success': False, 'error': '未提供曲谱码'}), 400
+
+            # 验证所有曲谱码都是有效的
+            if not all(isinstance(code, str) and is_valid_score_code(code) for code in score_codes):
+                return jsonify({'success': False, 'error': '包含无效的曲谱码'}), 400
+
+            rows = query_scores_by_codes(
+                conn, score_codes,
+                exclude_codes=[code for code in exclude_codes if isinstance(code, str)],
+                min_completion=min_completion,
+                max_completion=max_completion,
+                favorite=favorite,
+                has_review=has_review,
+                include_keywords=include_keywords,
+                exclude_keywords=exclude_keywords,
+                uncompleted=uncompleted,
+                rank_by=rank_by,
+                rank_weights=rank_weights,
+                top_n=top_n,
+            )
 
-        if not score_codes:
-            conn.close()
-            return jsonify({'success': False, 'error': '未提供曲谱码'}), 400
+        results = [{
+            'score_code': row[0],
+            'completion': row[1],
+            'is_favorite': bool(row[2]),
+            'remark': row[3] or '',
+            'has_review': bool(row[4]),
+            'title': row[5],
+            'author': row[6]
+        } for row in rows]
+        if rank_by:
+            for result, row in zip(results, rows):
+                result['rank_value'] = row[7]
 
-        # 验证所有曲谱码都是有效的
-        if not all(is_valid_score_code(code) for code in score_codes):
-            return jsonify({'success': False, 'error': '包含无效的曲谱码'}), 400
+        return jsonify({
+            'success': True,
+            'results': results,
+            'total': len(score_codes),
+            'found': len(results)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-        # 只查所有 score_codes
-        c.execute(
-            f"SELECT score_code, completion, is_favorite, remark FROM scores WHERE score_code IN ({','.join(['?']*len(score_codes))}) GROUP BY score_code ORDER BY MAX(created_at) DESC",
-            score_codes
-        )
-        db_results = {row[0]: row for row in c.fetchall()}
-        conn.close()
+# Selenium浏览器相关代码已移除，使用API爬虫替代
 
-        # 先排除 exclude_codes
-        results = []
-        for code in score_codes:
-            if code in exclude_codes:
+# ========== 作品元数据（works 表） ==========
+
+WORKS_CSV_PATH = 'musicugc_all.csv'            # 爬虫实验.py 导出的字段表
+WORKS_RAW_JSON_PATH = 'musicugc_all_raw.json'  # 爬虫实验.py 保存的原始作品 JSON
+WORKS_IMPORT_BATCH_SIZE = 500
+
+# works 表列名 -> 导出字段名（与 jianshang_crawler.project_work_fields 一致）
+WORKS_FIELD_MAP = (
+    ('share_code', 'share_code'),
+    ('work_id', 'work_id'),
+    ('title', 'title'),
+    ('description', 'desc'),
+    ('cover_url', 'cover_url'),
+    ('region', 'region'),
+    ('music_id', 'music_id'),
+    ('note_count', 'note_count'),
+    ('nickname', 'nickname'),
+    ('uid', 'uid'),
+    ('like_cnt', 'like_cnt'),
+    ('save_cnt', 'save_cnt'),
+    ('game_like_cnt', 'game_like_cnt'),
+    ('publish_time', 'publish_time'),
+    ('hot_score', 'hot_score'),
+    ('quality_score', 'quality_score'),
+    ('video_duration', 'video_duration'),
+)
+WORKS_INT_COLUMNS = {'work_id', 'music_id', 'note_count', 'like_cnt', 'save_cnt', 'game_like_cnt', 'publish_time',
+                     'video_duration'}
+WORKS_REAL_COLUMNS = {'hot_score', 'quality_score'}
+
+
+def _work_column_value(column, value):
+    """CSV 里全是字符串、原始 JSON 里可能是数字或对象，统一转换；空值返回 None"""
+    if value is None or value == '':
+        return None
+    try:
+        if column in WORKS_INT_COLUMNS:
+            return int(float(value))
+        if column in WORKS_REAL_COLUMNS:
+            return float(value)
+    except (TypeError, ValueError):
+        return None
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+def normalize_work_row(fields):
+    """
+    把一条导出字段（CSV 行或 project_work_fields 的结果）转成 works 表的一行，
+    同时解析 video_json：返回 (row, videos)，videos 为 None 表示这条数据没有可用的视频信息。
+    没有 share_code 时返回 (None, None)。
+    """
+    duration, videos = parse_video_media_info(fields.get('video_json'))
+    values = dict(fields, video_duration=duration)
+    row = tuple(_work_column_value(column, values.get(key)) for column, key in WORKS_FIELD_MAP)
+    if not row[0]:
+        return None, None
+    return row, videos
+
+
+def upsert_works(items, source=None):
+    """
+    分批写入 works 表（按 share_code 覆盖），items 可以是任意可迭代对象，不会整体读入内存。
+    新数据中为空的字段保留旧值；带视频信息的作品整体替换其 work_videos 行。返回写入的行数。
+    不会重算排序列：调用方写完一整批数据（导入文件、一次爬取）后调用一次 refresh_work_ranks()。
+    """
+    columns = [column for column, _ in WORKS_FIELD_MAP]
+    updates = ',\n            '.join(
+        f'{column} = COALESCE(excluded.{column}, works.{column})' for column in columns[1:])
+    sql = f'''
+        INSERT INTO works ({', '.join(columns)}, source, updated_at)
+        VALUES ({', '.join(['?'] * len(columns))}, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(share_code) DO UPDATE SET
+            {updates},
+            source = excluded.source,
+            updated_at = excluded.updated_at
+    '''
+    count = 0
+    batch = []
+    video_codes = []
+    video_rows = []
+
+    def flush(conn):
+        conn.executemany(sql, batch)
+        conn.executemany('DELETE FROM work_videos WHERE share_code = ?', [(code,) for code in video_codes])
+        conn.executemany('''
+            INSERT OR REPLACE INTO work_videos (share_code, height, width, url, size, bitrate)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', video_rows)
+        batch.clear()
+        video_codes.clear()
+        video_rows.clear()
+
+    with scores_db.connection() as conn:
+        for fields in items:
+            row, videos = normalize_work_row(fields)
+            if row is None:
                 continue
-            row = db_results.get(code)
-            if not row:
-                # 数据库没有的曲谱码也要返回（如 completion=None, is_favorite=False）
-                results.append({'score_code': code, 'completion': None, 'is_favorite': False, 'remark': ''})
+            batch.append(row + (source,))
+            if videos is not None:
+                video_codes.append(row[0])
+                video_rows.extend((row[0], v['height'], v['width'], v['url'], v['size'], v['bitrate'])
+                                  for v in videos)
+            count += 1
+            if len(batch) >= WORKS_IMPORT_BATCH_SIZE:
+                flush(conn)
+        if batch:
+            flush(conn)
+    return count
+
+
+# ---------- 排序 ----------
+
+# 可用的排序指标：名称 -> (原始列, 百分位列)；原始列都有索引
+WORK_RANK_METRICS = {
+    'hot_score': ('hot_score', 'hot_pct'),
+    'quality_score': ('quality_score', 'quality_pct'),
+    'like_cnt': ('like_cnt', 'like_pct'),
+    'save_cnt': ('save_cnt', 'save_pct'),
+    'game_like_cnt': ('game_like_cnt', 'game_like_pct'),
+}
+# 综合排序的默认权重（作用在百分位上），对应预计算的 blend_score 列
+WORK_BLEND_DEFAULT_WEIGHTS = {'quality_score': 0.5, 'hot_score': 0.3, 'like_cnt': 0.2}
+
+
+def refresh_work_ranks():
+    """重算各指标的百分位与默认综合分（窗口函数一次完成），在作品数据写入后调用"""
+    pct_columns = ',\n                '.join(
+        f'CASE WHEN {raw} IS NULL THEN NULL ELSE cume_dist() OVER (PARTITION BY {raw} IS NULL ORDER BY {raw}) END AS {pct}'
+        for raw, pct in WORK_RANK_METRICS.values())
+    blend_sql = ' + '.join(
+        f'{weight} * COALESCE({WORK_RANK_METRICS[name][1]}, 0)' for name, weight in WORK_BLEND_DEFAULT_WEIGHTS.items())
+    with scores_db.connection() as conn:
+        c = conn.cursor()
+        c.execute('DROP TABLE IF EXISTS temp.work_ranks')
+        c.execute(f'''
+            CREATE TEMP TABLE work_ranks AS
+            SELECT share_code,
+                {pct_columns}
+            FROM works
+        ''')
+        c.execute('CREATE UNIQUE INDEX temp.idx_work_ranks_code ON work_ranks(share_code)')
+        assignments = ', '.join(
+            f'{pct} = (SELECT r.{pct} FROM temp.work_ranks r WHERE r.share_code = works.share_code)'
+            for _, pct in WORK_RANK_METRICS.values())
+        c.execute(f'UPDATE works SET {assignments}')
+        c.execute(f'UPDATE works SET blend_score = {blend_sql}')
+        c.execute('DROP TABLE temp.work_ranks')
+
+
+def work_rank_sql(rank_by, weights=None, alias='wk'):
+    """
+    排序表达式（值越大越靠前）及参数：
+      - rank_by 为单个指标时直接用原始列；
+      - rank_by='blend' 且未给权重时用预计算的 blend_score；给了 weights 时按权重加权各指标的百分位。
+    rank_by 不支持时抛出 ValueError。
+    """
+    if rank_by in WORK_RANK_METRICS:
+        return f'{alias}.{WORK_RANK_METRICS[rank_by][0]}', []
+    if rank_by != 'blend':
+        raise ValueError(f'不支持的排序方式: {rank_by}')
+    if not weights:
+        return f'{alias}.blend_score', []
+    parts = []
+    params = []
+    for name, weight in weights.items():
+        if name not in WORK_RANK_METRICS:
+            raise ValueError(f'不支持的综合排序指标: {name}')
+        try:
+            weight = float(weight)
+        except (TypeError, ValueError):
+            raise ValueError(f'无效的权重: {name}')
+        parts.append(f'? * COALESCE({alias}.{WORK_RANK_METRICS[name][1]}, 0)')
+        params.append(weight)
+    if not parts:
+        return f'{alias}.blend_score', []
+    # 没有作品数据（LEFT JOIN 不到）时返回 NULL，与单指标排序一致地排在最后
+    return f'(CASE WHEN {alias}.share_code IS NULL THEN NULL ELSE ' + ' + '.join(parts) + ' END)', params
+
+
+def parse_rank_options(data):
+    """从请求体 / 筛选条件里取 rank_by、rank_weights、top_n，返回 (rank_by, weights, top_n)"""
+    rank_by = (data.get('rank_by') or '').strip() or None
+    weights = data.get('rank_weights') if isinstance(data.get('rank_weights'), dict) else None
+    top_n = data.get('top_n')
+    try:
+        top_n = int(top_n) if top_n not in (None, '') else None
+    except (TypeError, ValueError):
+        raise ValueError('无效的 top_n')
+    if top_n is not None and top_n <= 0:
+        top_n = None
+    if rank_by:
+        work_rank_sql(rank_by, weights)  # 提前校验
+    return rank_by, weights, top_n
+
+
+def iter_works_csv(path):
+    """逐行读取 musicugc_all.csv 格式的文件"""
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        for row in csv.DictReader(f):
+            yield row
+
+
+def iter_works_json(path):
+    """
+    读取原始作品 JSON：可以是作品数组、second_page 响应，或每行一个作品的 JSON Lines。
+    原始作品（带 user / game_data / interact_data）先经 project_work_fields 取出导出字段。
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            items = (json.loads(line) for line in f if line.strip())
+        else:
+            data = json.load(f)
+            if isinstance(data, dict):
+                data = ((data.get('data') or {}).get('slide') or {}).get('work_list') or []
+            items = data
+        for item in items:
+            if not isinstance(item, dict):
                 continue
-            results.append({
-                'score_code': row[0],
-                'completion': row[1],
-                'is_favorite': bool(row[2]),
-                'remark': row[3] or ''
-            })
+            if 'user' in item or 'game_data' in item or 'interact_data' in item:
+                yield project_work_fields(item)
+            else:
+                yield item
 
-        # 排除后打印结果
-        print("results after exclude:", [r['score_code'] for r in results])
 
-        # 再根据完成率/收藏筛选
-        if min_completion is not None:
-            results = [r for r in results if r['completion'] is not None and r['completion'] >= min_completion]
-        if max_completion is not None:
-            results = [r for r in results if r['completion'] is not None and r['completion'] <= max_completion]
-        if favorite is not None:
-            try:
-                favorite = int(favorite)
-                if favorite == 1:
-                    results = [r for r in results if r['is_favorite']]
-                elif favorite == 2:
-                    results = [r for r in results if not r['is_favorite']]
-            except:
-                pass
-
-        # —— 新增：批量查询喜欢 ——
-        all_codes = [r['score_code'] for r in results]
-        has_map = set()
-        if all_codes:
-            conn_r = sqlite3.connect('reviews.db')
-            cr = conn_r.cursor()
-            placeholders = ','.join(['?']*len(all_codes))
-            cr.execute(f'SELECT DISTINCT score_code FROM reviews WHERE score_code IN ({placeholders})', all_codes)
-            has_map = {t[0] for t in cr.fetchall()}
-            conn_r.close()
-
-        for r in results:
-            r['has_review'] = r['score_code'] in has_map  # ★ 新增字段
-
-        def match_remark(value):
-            text = (value or '').lower()
-            for kw in include_keywords:
-                if kw not in text:
-                    return False
-            for kw in exclude_keywords:
-                if kw in text:
-                    return False
-            return True
-
-        if include_keywords or exclude_keywords:
-            results = [r for r in results if match_remark(r.get('remark', ''))]
+def import_works_file(path, force=False, refresh_ranks=True):
+    """
+    导入作品元数据文件（.csv / .json / .jsonl）。文件的修改时间和大小没变时跳过，
+    因此可以在每次启动时调用。返回导入的行数，跳过或文件不存在时返回 0。
+    refresh_ranks=False 时不重算排序列，由调用方在导入多个文件后统一重算。
+    """
+    if not os.path.exists(path):
+        return 0
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    with scores_db.connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT mtime, size FROM works_sources WHERE path = ?', (key,))
+        row = c.fetchone()
+    if not force and row and row[0] == stat.st_mtime and row[1] == stat.st_size:
+        return 0
+
+    items = iter_works_csv(path) if path.lower().endswith('.csv') else iter_works_json(path)
+    count = upsert_works(items, source=os.path.basename(path))
+    with scores_db.connection() as conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO works_sources (path, mtime, size, row_count, imported_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (key, stat.st_mtime, stat.st_size, count))
+    print(f"已从 {os.path.basename(path)} 导入 {count} 条作品元数据")
+    if count and refresh_ranks:
+        refresh_work_ranks()
+    return count
+
+
+def import_default_works_files(force=False):
+    total = 0
+    for path in (WORKS_CSV_PATH, WORKS_RAW_JSON_PATH):
+        try:
+            total += import_works_file(path, force=force, refresh_ranks=False)
+        except Exception as e:
+            print(f"导入作品元数据 {path} 失败: {e}")
+    if total:
+        refresh_work_ranks()
+    return total
+
+
+def ensure_work_ranks():
+    """升级后已有作品还没有排序列时补算一次"""
+    with scores_db.connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT 1 FROM works WHERE blend_score IS NULL LIMIT 1')
+        missing = c.fetchone() is not None
+    if missing:
+        refresh_work_ranks()
+
 
+# 启动时导入（或在文件更新后重新导入）作品元数据
+import_default_works_files()
+ensure_work_ranks()
+
+
+WORK_DETAIL_FIELDS = ('share_code', 'work_id', 'title', 'description', 'cover_url', 'region', 'music_id',
+                      'note_count', 'nickname', 'uid', 'like_cnt', 'save_cnt', 'game_like_cnt',
+                      'publish_time', 'hot_score', 'quality_score', 'video_duration', 'source', 'updated_at')
+WORK_VIDEO_FIELDS = ('height', 'width', 'url', 'size', 'bitrate')
+
+
+def get_work_videos(share_code):
+    """作品的各清晰度视频（按高度升序），来自导入时解析好的 work_videos"""
+    with scores_db.connection() as conn:
+        c = conn.cursor()
+        c.execute(f'''
+            SELECT {", ".join(WORK_VIDEO_FIELDS)} FROM work_videos
+            WHERE share_code = ? ORDER BY height
+        ''', (share_code,))
+        return [dict(zip(WORK_VIDEO_FIELDS, row)) for row in c.fetchall()]
+
+
+def pick_work_video(videos, max_height=None):
+    """不超过 max_height 的最高清晰度；都超过时退回最低清晰度；max_height 为空时取最高清晰度"""
+    if not videos:
+        return None
+    if max_height is None:
+        return videos[-1]
+    fitting = [v for v in videos if v['height'] <= max_height]
+    return fitting[-1] if fitting else videos[0]
+
+
+@app.route('/api/works/<share_code>', methods=['GET'])
+def get_work(share_code):
+    """单个作品的元数据及各清晰度视频"""
+    try:
+        with scores_db.connection() as conn:
+            c = conn.cursor()
+            c.execute(f'SELECT {", ".join(WORK_DETAIL_FIELDS)} FROM works WHERE share_code = ?', (share_code,))
+            row = c.fetchone()
+        if not row:
+            return jsonify({'success': False, 'error': '没有该作品的元数据'}), 404
+        work = dict(zip(WORK_DETAIL_FIELDS, row))
+        work['videos'] = get_work_videos(share_code)
+        return jsonify({'success': True, 'work': work})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/works/<share_code>/video', methods=['GET'])
+def get_work_video(share_code):
+    """作品的播放地址：?max_height=720 取不超过该高度的最高清晰度，缺省取最高清晰度"""
+    try:
+        videos = get_work_videos(share_code)
+        video = pick_work_video(videos, request.args.get('max_height', type=int))
+        if not video:
+            return jsonify({'success': False, 'error': '该作品没有视频信息'}), 404
+        with scores_db.connection() as conn:
+            c = conn.cursor()
+            c.execute('SELECT video_duration FROM works WHERE share_code = ?', (share_code,))
+            row = c.fetchone()
+        return jsonify({'success': True, 'video': dict(video, duration=row[0] if row else None),
+                        'heights': [v['height'] for v in videos]})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/works/import', methods=['POST'])
+def import_works():
+    """重新导入 musicugc_all.csv / musicugc_all_raw.json；force=1 时忽略文件未变化的判断"""
+    try:
+        data = request.get_json(silent=True) or {}
+        force = bool(data.get('force')) or request.args.get('force', default=0, type=int) == 1
+        imported = import_default_works_files(force=force)
+        with scores_db.connection() as conn:
+            c = conn.cursor()
+            c.execute('SELECT COUNT(*) FROM works')
+            total = c.fetchone()[0]
+        return jsonify({'success': True, 'imported': imported, 'total': total})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+# ========== 鉴赏爬取检查点 ==========
+
+# 增量模式下连续多少页全部是已见过的作品就停止（列表并非严格按发布时间排序，留一页余量）
+JIANSHANG_INCREMENTAL_STOP_PAGES = 2
+# 增量爬取看不到下榜的曲谱码，距上次全量爬取超过这么多天时自动改为全量，保证留存统计有新的完整快照
+JIANSHANG_FULL_CRAWL_INTERVAL_DAYS = 7
+
+
+def _work_id_of(work):
+    try:
+        return int(work.get('work_id'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _publish_time_of(work):
+    game = work.get('game_data') or {}
+    try:
+        return int(game.get('publish_time') or work.get('publish_time'))
+    except (TypeError, ValueError):
+        return None
+
+
+def filter_unseen_works(work_list):
+    """返回 work_list 中检查点里还没有的作品"""
+    ids = [wid for wid in (_work_id_of(w) for w in work_list) if wid is not None]
+    if not ids:
+        return list(work_list)
+    with scores_db.connection() as conn:
+        c = conn.cursor()
+        c.execute('''
+            SELECT work_id FROM jianshang_seen_works
+            WHERE work_id IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(ids),))
+        seen = {row[0] for row in c.fetchall()}
+    return [w for w in work_list if _work_id_of(w) not in seen]
+
+
+def record_seen_works(work_list):
+    """把本页作品写入检查点（已存在的只刷新 last_seen_at / 发布时间）"""
+    rows = []
+    for work in work_list:
+        work_id = _work_id_of(work)
+        if work_id is not None:
+            rows.append((work_id, work.get('share_code'), _publish_time_of(work)))
+    if not rows:
+        return
+    with scores_db.connection() as conn:
+        conn.executemany('''
+            INSERT INTO jianshang_seen_works (work_id, share_code, publish_time, first_seen_at, last_seen_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+            ON CONFLICT(work_id) DO UPDATE SET
+                share_code = COALESCE(excluded.share_code, share_code),
+                publish_time = COALESCE(excluded.publish_time, publish_time),
+                last_seen_at = CURRENT_TIMESTAMP
+        ''', rows)
+
+
+def get_crawl_checkpoint():
+    with scores_db.connection() as conn:
+        c = conn.cursor()
+        c.execute('''
+            SELECT max_publish_time, last_crawl_at, last_full_crawl_at, last_mode
+            FROM jianshang_crawl_state WHERE id = 1
+        ''')
+        row = c.fetchone()
+        c.execute('SELECT COUNT(*) FROM jianshang_seen_works')
+        seen_count = c.fetchone()[0]
+    return {
+        'max_publish_time': row[0] if row else None,
+        'last_crawl_at': row[1] if row else None,
+        'last_full_crawl_at': row[2] if row else None,
+        'last_mode': row[3] if row else None,
+        'seen_works': seen_count,
+    }
+
+
+def full_crawl_due():
+    """从未全量爬取过，或距上次全量爬取已超过 JIANSHANG_FULL_CRAWL_INTERVAL_DAYS 天"""
+    with scores_db.connection() as conn:
+        row = conn.execute('''
+            SELECT julianday('now') - julianday(last_full_crawl_at) FROM jianshang_crawl_state WHERE id = 1
+        ''').fetchone()
+    return row is None or row[0] is None or row[0] >= JIANSHANG_FULL_CRAWL_INTERVAL_DAYS
+
+
+def update_crawl_checkpoint(mode):
+    """一次爬取结束后推进发布时间高水位并记录模式"""
+    with scores_db.connection() as conn:
+        conn.execute('''
+            INSERT INTO jianshang_crawl_state (id, max_publish_time, last_crawl_at, last_full_crawl_at, last_mode)
+            VALUES (1, (SELECT MAX(publish_time) FROM jianshang_seen_works), CURRENT_TIMESTAMP,
+                    CASE WHEN ? = 'full' THEN CURRENT_TIMESTAMP END, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                max_publish_time = excluded.max_publish_time,
+                last_crawl_at = excluded.last_crawl_at,
+                last_full_crawl_at = COALESCE(excluded.last_full_crawl_at, last_full_crawl_at),
+                last_mode = excluded.last_mode
+        ''', (mode, mode))
+
+
+@app.route('/api/fetch_jianshang/checkpoint', methods=['GET'])
+def get_jianshang_checkpoint():
+    try:
+        return jsonify({'success': True, 'checkpoint': get_crawl_checkpoint()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+# ========== 鉴赏码快照存储 ==========
+
+JIANSHANG_CODES_DIR = 'The old appreciation code'
+JIANSHANG_EXPORT_TXT = False  # 为 True 时每次爬取后仍额外导出一份 score_codes_*.txt（兼容旧工具）
+JIANSHANG_FILE_TS_FORMAT = '%Y%m%d_%H%M%S'
+JIANSHANG_TAKEN_AT_FORMAT = '%Y-%m-%d %H:%M:%S'
+# 增量快照只有前几页是实际爬到的，其余沿用上一份完整快照；对比与留存统计只使用完整快照
+FULL_SNAPSHOT_SQL = "COALESCE(mode, '') <> 'incremental'"
+
+
+def jianshang_snapshot_filename(taken_at):
+    """快照对应的旧版文件名，前端提示与导出沿用"""
+    dt = datetime.strptime(taken_at, JIANSHANG_TAKEN_AT_FORMAT)
+    return f'score_codes_{dt.strftime(JIANSHANG_FILE_TS_FORMAT)}.txt'
+
+
+def _snapshot_row_to_dict(row):
+    snapshot_id, taken_at, code_count, mode, source = row
+    return {
+        'snapshot_id': snapshot_id,
+        'taken_at': taken_at,
+        'code_count': code_count,
+        'mode': mode,
+        'source': source,
+        'filename': jianshang_snapshot_filename(taken_at),
+    }
+
+
+def save_jianshang_snapshot(score_codes, mode=None, taken_at=None, source=None, carried_codes=()):
+    """
+    写入一份快照（曲谱码按出现顺序记录 position，重复的只保留第一次），返回快照信息。
+    carried_codes 为本次没有爬到、沿用上一份快照的曲谱码，排在后面并记为 observed = 0。
+    """
+    codes = list(dict.fromkeys(code for code in score_codes if code))
+    observed_count = len(codes)
+    observed = set(codes)
+    codes.extend(dict.fromkeys(code for code in carried_codes if code and code not in observed))
+    taken_at = taken_at or datetime.now().strftime(JIANSHANG_TAKEN_AT_FORMAT)
+    with scores_db.connection() as conn:
+        c = conn.cursor()
+        c.execute('''
+            INSERT INTO jianshang_snapshots (taken_at, code_count, mode, source)
+            VALUES (?, ?, ?, ?)
+        ''', (taken_at, len(codes), mode, source))
+        snapshot_id = c.lastrowid
+        c.executemany('''
+            INSERT INTO jianshang_snapshot_codes (snapshot_id, position, score_code, observed)
+            VALUES (?, ?, ?, ?)
+        ''', [(snapshot_id, position, code, int(position < observed_count)) for position, code in enumerate(codes)])
+    return _snapshot_row_to_dict((snapshot_id, taken_at, len(codes), mode, source))
+
+
+def get_jianshang_snapshot(snapshot_id):
+    with scores_db.connection() as conn:
+        c = conn.cursor()
+        c.execute('''
+            SELECT id, taken_at, code_count, mode, source
+            FROM jianshang_snapshots WHERE id = ?
+        ''', (snapshot_id,))
+        row = c.fetchone()
+    return _snapshot_row_to_dict(row) if row else None
+
+
+def find_latest_jianshang_snapshot(prefer_before_today=True, full_only=False):
+    """
+    最新快照（走 taken_at 索引）。
+    prefer_before_today=True 时优先返回“今天之前”最新的快照，没有再退回今天的；
+    full_only=True 时跳过增量快照。
+    """
+    today_start = datetime.now().strftime('%Y-%m-%d 00:00:00')
+    full_sql = f'AND {FULL_SNAPSHOT_SQL}' if full_only else ''
+    with scores_db.connection() as conn:
+        c = conn.cursor()
+        row = None
+        if prefer_before_today:
+            c.execute(f'''
+                SELECT id, taken_at, code_count, mode, source FROM jianshang_snapshots
+                WHERE taken_at < ? {full_sql} ORDER BY taken_at DESC, id DESC LIMIT 1
+            ''', (today_start,))
+            row = c.fetchone()
+        if row is None:
+            c.execute(f'''
+                SELECT id, taken_at, code_count, mode, source FROM jianshang_snapshots
+                WHERE 1 = 1 {full_sql} ORDER BY taken_at DESC, id DESC LIMIT 1
+            ''')
+            row = c.fetchone()
+    return _snapshot_row_to_dict(row) if row else None
+
+
+def get_jianshang_snapshot_codes(snapshot_id):
+    with scores_db.connection() as conn:
+        c = conn.cursor()
+        c.execute('''
+            SELECT score_code FROM jianshang_snapshot_codes
+            WHERE snapshot_id = ? ORDER BY position
+        ''', (snapshot_id,))
+        return [row[0] for row in c.fetchall()]
+
+
+def get_codes_new_since(snapshot_id, since_snapshot_id):
+    """snapshot_id 中实际爬到、since_snapshot_id 中没有的曲谱码（按 position 排序）"""
+    with scores_db.connection() as conn:
+        c = conn.cursor()
+        c.execute('''
+            SELECT cur.score_code FROM jianshang_snapshot_codes cur
+            WHERE cur.snapshot_id = ? AND cur.observed = 1
+              AND NOT EXISTS (
+                  SELECT 1 FROM jianshang_snapshot_codes prev
+                  WHERE prev.score_code = cur.score_code AND prev.snapshot_id = ?
+              )
+            ORDER BY cur.position
+        ''', (snapshot_id, since_snapshot_id))
+        return [row[0] for row in c.fetchall()]
+
+
+def export_jianshang_snapshot_file(snapshot):
+    """把快照导出为旧版 txt（目录与文件名格式不变），返回文件路径"""
+    output_dir = JIANSHANG_CODES_DIR
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    filename = os.path.join(output_dir, snapshot['filename'])
+    with open(filename, 'w', encoding='utf-8') as f:
+        for code in get_jianshang_snapshot_codes(snapshot['snapshot_id']):
+            f.write(f'{code}\n')
+    return filename
+
+
+def import_jianshang_snapshot_files():
+    """
+    一次性导入旧版 score_codes_*.txt：以文件名作为 source，已导入过的文件跳过，
+    因此可以在每次启动时安全调用。返回新导入的快照数量。
+    """
+    output_dir = JIANSHANG_CODES_DIR
+    if not os.path.exists(output_dir):
+        return 0
+    with scores_db.connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT source FROM jianshang_snapshots WHERE source IS NOT NULL')
+        imported = {row[0] for row in c.fetchall()}
+
+    count = 0
+    for f in sorted(os.listdir(output_dir)):
+        if f in imported or not (f.startswith('score_codes_') and f.endswith('.txt')):
+            continue
+        try:
+            dt = datetime.strptime(f[len('score_codes_'):-len('.txt')], JIANSHANG_FILE_TS_FORMAT)
+        except ValueError:
+            continue
+        with open(os.path.join(output_dir, f), 'r', encoding='utf-8') as fh:
+            codes = [line.strip() for line in fh if line.strip()]
+        save_jianshang_snapshot(codes, mode='import', taken_at=dt.strftime(JIANSHANG_TAKEN_AT_FORMAT), source=f)
+        count += 1
+    if count:
+        print(f"已将 {count} 个旧版鉴赏码文件导入快照表")
+    return count
+
+
+# 启动时导入尚未入库的旧版快照文件
+import_jianshang_snapshot_files()
+
+
+@app.route('/api/jianshang_snapshots', methods=['GET'])
+def list_jianshang_snapshots():
+    """快照列表，按时间倒序；limit 默认 100"""
+    try:
+        limit = request.args.get('limit', default=100, type=int)
+        with scores_db.connection() as conn:
+            c = conn.cursor()
+            c.execute('''
+                SELECT id, taken_at, code_count, mode, source FROM jianshang_snapshots
+                ORDER BY taken_at DESC, id DESC LIMIT ?
+            ''', (limit,))
+            rows = c.fetchall()
+        return jsonify({'success': True, 'snapshots': [_snapshot_row_to_dict(row) for row in rows]})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/jianshang_snapshots/<int:snapshot_id>/new_codes', methods=['GET'])
+def get_jianshang_snapshot_new_codes(snapshot_id):
+    """
+    snapshot_id 相对 since 快照新增的曲谱码；since 缺省时取它之前的上一份快照。
+    """
+    try:
+        snapshot = get_jianshang_snapshot(snapshot_id)
+        if not snapshot:
+            return jsonify({'success': False, 'error': '快照不存在'}), 404
+        since_id = request.args.get('since', type=int)
+        if since_id is None:
+            with scores_db.connection() as conn:
+                c = conn.cursor()
+                c.execute('''
+                    SELECT id FROM jianshang_snapshots
+                    WHERE (taken_at, id) < (?, ?) ORDER BY taken_at DESC, id DESC LIMIT 1
+                ''', (snapshot['taken_at'], snapshot_id))
+                row = c.fetchone()
+            since_id = row[0] if row else None
+        if since_id is not None and not get_jianshang_snapshot(since_id):
+            return jsonify({'success': False, 'error': '对比快照不存在'}), 404
+        codes = (get_codes_new_since(snapshot_id, since_id) if since_id is not None
+                 else get_jianshang_snapshot_codes(snapshot_id))
         return jsonify({
             'success': True,
-            'results': results,
+            'snapshot_id': snapshot_id,
+            'since': since_id,
+            'codes': codes,
+            'count': len(codes)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/jianshang_snapshots/<int:snapshot_id>/export', methods=['GET'])
+def export_jianshang_snapshot(snapshot_id):
+    """以旧版 txt 格式下载快照；?save=1 时同时写入鉴赏码目录"""
+    try:
+        snapshot = get_jianshang_snapshot(snapshot_id)
+        if not snapshot:
+            return jsonify({'success': False, 'error': '快照不存在'}), 404
+        if request.args.get('save', default=0, type=int) == 1:
+            export_jianshang_snapshot_file(snapshot)
+        body = ''.join(f'{code}\n' for code in get_jianshang_snapshot_codes(snapshot_id))
+        return app.response_class(
+            body,
+            mimetype='text/plain',
+            headers={'Content-Disposition': f'attachment; filename={snapshot["filename"]}'}
+        )
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+# ========== 鉴赏码快照对比与留存统计 ==========
+
+def _apply_snapshot_presence(c, snapshot_id, taken_at, previous_id):
+    """把一份快照计入留存统计：与上一份快照连续出现则连续次数 +1，否则重新计数"""
+    c.execute('''
+        INSERT INTO jianshang_code_presence (
+            score_code, first_snapshot_id, first_seen_at, last_snapshot_id, last_seen_at,
+            appearances, current_streak, longest_streak, streak_started_at
+        )
+        SELECT score_code, ?1, ?2, ?1, ?2, 1, 1, 1, ?2
+        FROM jianshang_snapshot_codes WHERE snapshot_id = ?1
+        ON CONFLICT(score_code) DO UPDATE SET
+            current_streak = CASE WHEN last_snapshot_id = ?3 THEN current_streak + 1 ELSE 1 END,
+            longest_streak = MAX(longest_streak,
+                                 CASE WHEN last_snapshot_id = ?3 THEN current_streak + 1 ELSE 1 END),
+            streak_started_at = CASE WHEN last_snapshot_id = ?3 THEN streak_started_at
+                                     ELSE excluded.last_seen_at END,
+            appearances = appearances + 1,
+            last_snapshot_id = excluded.last_snapshot_id,
+            last_seen_at = excluded.last_seen_at
+    ''', (snapshot_id, taken_at, previous_id))
+    c.execute('UPDATE jianshang_snapshots SET presence_applied = 1 WHERE id = ?', (snapshot_id,))
+
+
+def refresh_code_presence():
+    """
+    增量更新留存统计：只处理尚未计入的完整快照（按 taken_at 顺序），增量快照不计入，
+    连续上榜按相邻的两份完整快照判断。
+    如果有比已计入快照更早的新快照（例如补导入旧文件），则整体重算。
+    返回本次处理的快照数量。
+    """
+    with scores_db.connection() as conn:
+        c = conn.cursor()
+        c.execute(f'''
+            SELECT taken_at, id FROM jianshang_snapshots
+            WHERE presence_applied = 1 AND {FULL_SNAPSHOT_SQL} ORDER BY taken_at DESC, id DESC LIMIT 1
+        ''')
+        last_applied = c.fetchone()
+        if last_applied:
+            c.execute(f'''
+                SELECT 1 FROM jianshang_snapshots
+                WHERE presence_applied = 0 AND {FULL_SNAPSHOT_SQL} AND (taken_at, id) < (?, ?) LIMIT 1
+            ''', last_applied)
+            if c.fetchone():
+                print("检测到早于已统计快照的新快照，重算留存统计")
+                c.execute('DELETE FROM jianshang_code_presence')
+                c.execute('UPDATE jianshang_snapshots SET presence_applied = 0')
+                last_applied = None
+
+        c.execute(f'''
+            SELECT id, taken_at FROM jianshang_snapshots
+            WHERE presence_applied = 0 AND {FULL_SNAPSHOT_SQL} ORDER BY taken_at, id
+        ''')
+        pending = c.fetchall()
+        previous_id = last_applied[1] if last_applied else None
+        for snapshot_id, taken_at in pending:
+            _apply_snapshot_presence(c, snapshot_id, taken_at, previous_id)
+            previous_id = snapshot_id
+    return len(pending)
+
+
+def get_snapshot_diff(from_id, to_id):
+    """
+    两份快照的差异：entered = to 有 from 没有，left = from 有 to 没有。
+    快照写入后不再变化，结果按 (from_id, to_id) 永久缓存。
+    """
+    with scores_db.connection() as conn:
+        c = conn.cursor()
+        c.execute('''
+            SELECT entered_json, left_json, computed_at FROM jianshang_snapshot_diffs
+            WHERE from_snapshot_id = ? AND to_snapshot_id = ?
+        ''', (from_id, to_id))
+        row = c.fetchone()
+        if row:
+            return {'entered': json.loads(row[0]), 'left': json.loads(row[1]),
+                    'computed_at': row[2], 'cached': True}
+
+        entered = get_codes_new_since(to_id, from_id)
+        left = get_codes_new_since(from_id, to_id)
+        computed_at = datetime.now().strftime(JIANSHANG_TAKEN_AT_FORMAT)
+        c.execute('''
+            INSERT OR REPLACE INTO jianshang_snapshot_diffs
+                (from_snapshot_id, to_snapshot_id, entered_json, left_json, computed_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (from_id, to_id, json.dumps(entered), json.dumps(left), computed_at))
+    return {'entered': entered, 'left': left, 'computed_at': computed_at, 'cached': False}
+
+
+def _previous_full_snapshot_id(snapshot):
+    with scores_db.connection() as conn:
+        c = conn.cursor()
+        c.execute(f'''
+            SELECT id FROM jianshang_snapshots
+            WHERE (taken_at, id) < (?, ?) AND {FULL_SNAPSHOT_SQL} ORDER BY taken_at DESC, id DESC LIMIT 1
+        ''', (snapshot['taken_at'], snapshot['snapshot_id']))
+        row = c.fetchone()
+    return row[0] if row else None
+
+
+# 启动时把尚未计入的快照（包括刚导入的旧文件）补进留存统计
+refresh_code_presence()
+
+
+PRESENCE_COLUMNS = '''
+    p.score_code, p.first_seen_at, p.last_seen_at, p.appearances, p.current_streak,
+    p.longest_streak, p.streak_started_at, p.last_snapshot_id = latest.id AS is_current,
+    ROUND(julianday(p.last_seen_at) - julianday(p.streak_started_at), 2) AS streak_days
+'''
+PRESENCE_FIELDS = ('score_code', 'first_seen_at', 'last_seen_at', 'appearances', 'current_streak',
+                   'longest_streak', 'streak_started_at', 'is_current', 'streak_days')
+LATEST_SNAPSHOT_SQL = f'(SELECT id FROM jianshang_snapshots WHERE {FULL_SNAPSHOT_SQL} ORDER BY taken_at DESC, id DESC LIMIT 1)'
+
+
+def _presence_row_to_dict(row):
+    item = dict(zip(PRESENCE_FIELDS, row))
+    item['is_current'] = bool(item['is_current'])
+    if not item['is_current']:
+        # 已经下榜的曲谱码没有“当前”连续段
+        item['current_streak'] = 0
+    return item
+
+
+@app.route('/api/jianshang_snapshots/diff', methods=['GET'])
+def diff_jianshang_snapshots():
+    """
+    快照对比：?from=<id>&to=<id>，to 缺省为最新的完整快照，from 缺省为 to 之前的上一份完整快照。
+    返回新上榜（entered）与下榜（left）的曲谱码。增量快照没有爬完整个列表、看不出下榜，不能参与对比。
+    """
+    try:
+        to_id = request.args.get('to', type=int)
+        to_snapshot = (get_jianshang_snapshot(to_id) if to_id is not None
+                       else find_latest_jianshang_snapshot(False, full_only=True))
+        if not to_snapshot:
+            return jsonify({'success': False, 'error': '快照不存在'}), 404
+        from_id = request.args.get('from', type=int)
+        if from_id is None:
+            from_id = _previous_full_snapshot_id(to_snapshot)
+            if from_id is None:
+                return jsonify({'success': False, 'error': '没有可对比的上一份完整快照'}), 404
+        from_snapshot = get_jianshang_snapshot(from_id)
+        if not from_snapshot:
+            return jsonify({'success': False, 'error': '对比快照不存在'}), 404
+        if 'incremental' in (from_snapshot['mode'], to_snapshot['mode']):
+            return jsonify({'success': False, 'error': '增量快照只包含部分曲谱码，请选择完整快照对比'}), 400
+
+        diff = get_snapshot_diff(from_snapshot['snapshot_id'], to_snapshot['snapshot_id'])
+        return jsonify({
+            'success': True,
+            'from': from_snapshot,
+            'to': to_snapshot,
+            'entered': diff['entered'],
+            'left': diff['left'],
+            'entered_count': len(diff['entered']),
+            'left_count': len(diff['left']),
+            'cached': diff['cached']
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/jianshang_codes/<score_code>/history', methods=['GET'])
+def get_jianshang_code_history(score_code):
+    """单个曲谱码的上榜历史：首次/最近出现、出现次数、连续上榜次数与天数；?snapshots=1 附带出现过的快照"""
+    try:
+        refresh_code_presence()
+        with scores_db.connection() as conn:
+            c = conn.cursor()
+            c.execute(f'''
+                SELECT {PRESENCE_COLUMNS}
+                FROM jianshang_code_presence p CROSS JOIN {LATEST_SNAPSHOT_SQL} AS latest
+                WHERE p.score_code = ?
+            ''', (score_code,))
+            row = c.fetchone()
+            if not row:
+                return jsonify({'success': False, 'error': '该曲谱码从未出现在鉴赏快照中'}), 404
+            history = _presence_row_to_dict(row)
+            if request.args.get('snapshots', default=0, type=int) == 1:
+                c.execute('''
+                    SELECT s.id, s.taken_at FROM jianshang_snapshot_codes sc
+                    JOIN jianshang_snapshots s ON s.id = sc.snapshot_id
+                    WHERE sc.score_code = ? AND sc.observed = 1
+                    ORDER BY s.taken_at, s.id
+                ''', (score_code,))
+                history['snapshots'] = [{'snapshot_id': sid, 'taken_at': t} for sid, t in c.fetchall()]
+        return jsonify({'success': True, 'history': history})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/jianshang_codes/churn', methods=['GET'])
+def list_jianshang_code_churn():
+    """
+    全部曲谱码的留存统计：
+      - sort: longest_streak(默认) / current_streak / appearances / first_seen / last_seen
+      - current: 1 只看仍在榜上的，0 只看已下榜的
+      - limit / offset: 分页，默认 100 / 0
+    """
+    try:
+        refresh_code_presence()
+        sort_sql = {
+            'longest_streak': 'p.longest_streak DESC, p.last_seen_at DESC',
+            'current_streak': 'is_current DESC, p.current_streak DESC, p.last_seen_at DESC',
+            'appearances': 'p.appearances DESC, p.last_seen_at DESC',
+            'first_seen': 'p.first_seen_at DESC',
+            'last_seen': 'p.last_seen_at DESC',
+        }.get((request.args.get('sort') or 'longest_streak').lower())
+        if not sort_sql:
+            return jsonify({'success': False, 'error': '不支持的排序方式'}), 400
+        current = request.args.get('current', type=int)
+        limit = request.args.get('limit', default=100, type=int)
+        offset = request.args.get('offset', default=0, type=int)
+
+        where_sql = ''
+        if current == 1:
+            where_sql = 'WHERE p.last_snapshot_id = latest.id'
+        elif current == 0:
+            where_sql = 'WHERE p.last_snapshot_id <> latest.id'
+        with scores_db.connection() as conn:
+            c = conn.cursor()
+            c.execute(f'''
+                SELECT {PRESENCE_COLUMNS}
+                FROM jianshang_code_presence p CROSS JOIN {LATEST_SNAPSHOT_SQL} AS latest
+                {where_sql}
+                ORDER BY {sort_sql}
+                LIMIT ? OFFSET ?
+            ''', (limit, offset))
+            rows = c.fetchall()
+        return jsonify({'success': True, 'results': [_presence_row_to_dict(row) for row in rows]})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+# ========== 鉴赏码后台爬取任务 ==========
+
+JIANSHANG_CRAWL_MAX_PAGES = 50
+JIANSHANG_JOB_HISTORY = 10  # 内存中保留的已结束任务数量
+
+jianshang_jobs = {}          # job_id -> 任务状态
+jianshang_jobs_lock = threading.Lock()
+active_jianshang_job_id = None
+
+
+def jianshang_job_snapshot(job, include_results=True):
+    with jianshang_jobs_lock:
+        snapshot = {key: value for key, value in job.items() if key not in ('results', 'done_event')}
+        if include_results:
+            snapshot['results'] = list(job['results'])
+    return snapshot
+
+
+def run_jianshang_crawl_job(job):
+    """
+    后台执行爬取：每页完成后立即解析曲谱码状态并推送 jianshang_crawl_page，
+    结束时推送 jianshang_crawl_done（字段与旧版 /api/fetch_jianshang 返回值一致）。
+
+    incremental 模式下，连续 JIANSHANG_INCREMENTAL_STOP_PAGES 页全是检查点里已有的作品就停止，
+    保存的快照 = 本次爬到的曲谱码 + 上一份快照中其余的曲谱码（保持原顺序）；
+    检查点为空时自动按全量处理。full 模式始终爬到短页为止。
+    """
+    global active_jianshang_job_id
+    job_id = job['job_id']
+    incremental = job['mode'] == 'incremental' and get_crawl_checkpoint()['seen_works'] > 0
+    if incremental and full_crawl_due():
+        print(f"距上次全量爬取已超过 {JIANSHANG_FULL_CRAWL_INTERVAL_DAYS} 天，本次改为全量爬取")
+        incremental = False
+    seen_codes = set()
+    score_codes = []
+    stale_pages = 0
+    stopped_by_checkpoint = False
+    works_written = 0
+
+    def on_page(page, work_list):
+        nonlocal stale_pages, stopped_by_checkpoint, works_written
+        unseen_works = filter_unseen_works(work_list)
+        unseen_codes = set(extract_share_codes_from_work_list(unseen_works))
+        record_seen_works(work_list)
+        # 顺带刷新作品元数据（标题、作者、热度），下面解析状态时即可带上标题
+        works_written += upsert_works((project_work_fields(work) for work in work_list if isinstance(work, dict)),
+                                      source='crawl')
+
+        new_codes = [code for code in extract_share_codes_from_work_list(work_list) if code not in seen_codes]
+        seen_codes.update(new_codes)
+        score_codes.extend(new_codes)
+        states = resolve_code_states(new_codes)
+        page_results = [dict(states[code], is_new=code in unseen_codes) for code in new_codes]
+        with jianshang_jobs_lock:
+            job['pages'] = page
+            job['results'].extend(page_results)
+            job['total'] = len(score_codes)
+            job['found'] += sum(1 for r in page_results if r['completion'] is not None)
+            job['new_count'] += len(unseen_works)
+        print(f"第{page}页 -> 新增{len(new_codes)}个曲谱码，其中未见过的作品{len(unseen_works)}个")
+        broadcast_bus.emit_now('jianshang_crawl_page', to=page_room('batch'), data={
+            'job_id': job_id,
+            'page': page,
+            'codes': new_codes,
+            'results': page_results,
             'total': len(score_codes),
-            'found': len(results)
+            'new_count': job['new_count'],
+        })
+
+        if incremental:
+            stale_pages = 0 if unseen_works else stale_pages + 1
+            if stale_pages >= JIANSHANG_INCREMENTAL_STOP_PAGES:
+                print(f"连续{stale_pages}页均为已见过的作品，增量爬取在第{page}页停止")
+                stopped_by_checkpoint = True
+                return True
+        return False
+
+    try:
+        crawler = create_jianshang_crawler()
+        start = time.perf_counter()
+        crawler.crawl(max_pages=job['max_pages'], on_page=on_page)
+        print(f"爬取完成: 共{len(score_codes)}个曲谱码，用时{time.perf_counter() - start:.1f}s，统计: {crawler.stats}")
+        if works_written:
+            # 每页只写入作品数据，排序列在整次爬取结束后重算一次
+            refresh_work_ranks()
+        if score_codes:
+            # 增量模式没有提前停止时也爬完了整个列表，按完整快照记录
+            snapshot_mode = 'incremental' if stopped_by_checkpoint else 'full'
+            update_crawl_checkpoint(snapshot_mode)
+            carried_codes = []
+            if stopped_by_checkpoint:
+                # 未爬到的部分沿用上一份完整快照（不沿用增量快照，避免已下榜的曲谱码一直累积）
+                previous = find_latest_jianshang_snapshot(prefer_before_today=False, full_only=True)
+                if previous:
+                    carried_codes = [code for code in get_jianshang_snapshot_codes(previous['snapshot_id'])
+                                     if code not in seen_codes]
+            taken_at = datetime.now().strftime(JIANSHANG_TAKEN_AT_FORMAT)
+            # 导出 txt 时以文件名作为 source，避免下次启动时被当作旧文件重复导入
+            source = jianshang_snapshot_filename(taken_at) if JIANSHANG_EXPORT_TXT else None
+            snapshot = save_jianshang_snapshot(score_codes, mode=snapshot_mode,
+                                               taken_at=taken_at, source=source, carried_codes=carried_codes)
+            if JIANSHANG_EXPORT_TXT:
+                export_jianshang_snapshot_file(snapshot)
+            refresh_code_presence()
+            update = {
+                'status': 'done',
+                'snapshot_id': snapshot['snapshot_id'],
+                'filename': snapshot['filename'],
+                'extracted_count': snapshot['code_count'],
+                'stopped_by_checkpoint': stopped_by_checkpoint,
+            }
+        else:
+            error = crawler.last_error or '未找到任何曲谱码'
+            update = {'status': 'error', 'error': str(error)}
+    except Exception as e:
+        print(f"通过API获取鉴赏码时发生错误: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        update = {'status': 'error', 'error': str(e)}
+
+    with jianshang_jobs_lock:
+        job.update(update)
+        job['finished_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        if active_jianshang_job_id == job_id:
+            active_jianshang_job_id = None
+    job['done_event'].set()
+
+    broadcast_bus.emit_now('jianshang_crawl_done', to=page_room('batch'), data={
+        'job_id': job_id,
+        'success': job['status'] == 'done',
+        'status': job['status'],
+        'error': job['error'],
+        'mode': job['mode'],
+        'new_count': job['new_count'],
+        'total': job['total'],
+        'found': job['found'],
+        'snapshot_id': job['snapshot_id'],
+        'filename': job['filename'],
+        'extracted_count': job['extracted_count'],
+    })
+
+
+def start_jianshang_crawl_job(mode='incremental', max_pages=JIANSHANG_CRAWL_MAX_PAGES):
+    """启动爬取任务（mode: incremental / full）；已有任务在运行时直接复用，返回 (job, reused)"""
+    global active_jianshang_job_id
+    with jianshang_jobs_lock:
+        active = jianshang_jobs.get(active_jianshang_job_id)
+        if active and active['status'] == 'running':
+            return active, True
+
+        job_id = uuid.uuid4().hex
+        job = {
+            'job_id': job_id,
+            'status': 'running',
+            'mode': mode,
+            'max_pages': max_pages,
+            'pages': 0,
+            'new_count': 0,
+            'stopped_by_checkpoint': False,
+            'total': 0,
+            'found': 0,
+            'results': [],
+            'error': None,
+            'snapshot_id': None,
+            'filename': None,
+            'extracted_count': 0,
+            'started_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'finished_at': None,
+            'done_event': threading.Event(),
+        }
+        jianshang_jobs[job_id] = job
+        active_jianshang_job_id = job_id
+
+        # 只保留最近的若干个已结束任务
+        finished = [jid for jid, j in jianshang_jobs.items() if j['status'] != 'running']
+        for jid in finished[:max(0, len(finished) - JIANSHANG_JOB_HISTORY)]:
+            jianshang_jobs.pop(jid, None)
+
+    print(f"开始通过API获取鉴赏码，任务 {job_id}")
+    socketio.start_background_task(run_jianshang_crawl_job, job)
+    return job, False
+
+
+@app.route('/api/fetch_jianshang/jobs', methods=['POST'])
+def create_jianshang_job():
+    """
+    启动（或复用正在运行的）后台爬取任务，进度通过 socketio 推送。
+    默认增量爬取，请求体 {"full": true} 或 ?full=1 时全量重新爬取。
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        full = bool(data.get('full')) or request.args.get('full', default=0, type=int) == 1
+        job, reused = start_jianshang_crawl_job(mode='full' if full else 'incremental')
+        return jsonify({
+            'success': True,
+            'job_id': job['job_id'],
+            'reused': reused,
+            'mode': job['mode'],
+            'status': job['status'],
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-# Selenium浏览器相关代码已移除，使用API爬虫替代
+
+@app.route('/api/fetch_jianshang/jobs/<job_id>', methods=['GET'])
+def get_jianshang_job(job_id):
+    """查询任务状态；include_results=0 时不返回已解析的结果列表"""
+    job = jianshang_jobs.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    include_results = request.args.get('include_results', default=1, type=int) != 0
+    return jsonify({'success': True, 'job': jianshang_job_snapshot(job, include_results)})
+
 
 @app.route('/api/fetch_jianshang', methods=['GET'])
 def fetch_jianshang():
+    """兼容旧调用：启动或复用后台任务并等待其结束，一次性返回全部结果（?full=1 全量）"""
     try:
-        print("开始通过API获取鉴赏码...")
-        
-        # 使用API爬取鉴赏码
-        score_codes = crawl_all_jianshang_codes(max_pages=50, sleep_sec=0.3)
-        
-        if not score_codes:
+        full = request.args.get('full', default=0, type=int) == 1
+        job, _ = start_jianshang_crawl_job(mode='full' if full else 'incremental')
+        job['done_event'].wait()
+        snapshot = jianshang_job_snapshot(job)
+        if snapshot['status'] != 'done':
             return jsonify({
                 'success': False,
-                'error': '未找到任何曲谱码'
+                'error': snapshot['error'] or '未找到任何曲谱码'
             }), 404
-        
-        print(f"共找到 {len(score_codes)} 个曲谱码")
-        
-        # 批量查询这些曲谱码
-        conn = sqlite3.connect('scores.db')
-        c = conn.cursor()
-        
-        results = []
-        for score_code in score_codes:
-            c.execute('''
-                SELECT score_code, completion, is_favorite, remark
-                FROM scores 
-                WHERE score_code = ? 
-                ORDER BY created_at DESC 
-                LIMIT 1
-            ''', (score_code,))
-            result = c.fetchone()
-            
-            if result:
-                results.append({
-                    'score_code': result[0],
-                    'completion': result[1],
-                    'is_favorite': bool(result[2]),
-                    'remark': result[3] or ''
-                })
-            else:
-                results.append({
-                    'score_code': score_code,
-                    'completion': None,
-                    'is_favorite': False,
-                    'remark': ''
-                })
-        
-        conn.close()
-        
-        # 保存曲谱码到文件
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        # 确保目录存在
-        output_dir = 'The old appreciation code'
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-        filename = os.path.join(output_dir, f'score_codes_{timestamp}.txt')
-        with open(filename, 'w', encoding='utf-8') as f:
-            for code in score_codes:
-                f.write(f'{code}\n')
-        
+
+        print(f"共找到 {snapshot['total']} 个曲谱码")
         return jsonify({
             'success': True,
-            'results': results,
-            'total': len(score_codes),
-            'found': len([r for r in results if r['completion'] is not None]),
-            'filename': os.path.basename(filename),
-            'extracted_count': len(score_codes)
+            'job_id': snapshot['job_id'],
+            'results': snapshot['results'],
+            'total': snapshot['total'],
+            'found': snapshot['found'],
+            'snapshot_id': snapshot['snapshot_id'],
+            'filename': snapshot['filename'],
+            'extracted_count': snapshot['extracted_count']
         })
             
     except Exception as e:
@@ -1100,62 +3226,21 @@ def fetch_jianshang():
 def get_latest_jianshang_codes():
     try:
         print("收到获取最新鉴赏码的请求")
-        # 查找最新的鉴赏码文件
-        output_dir = 'The old appreciation code'
-        print(f"检查目录: {output_dir}")
-        if not os.path.exists(output_dir):
-            print("鉴赏码目录不存在")
-            return jsonify({'success': False, 'error': '鉴赏码目录不存在', 'filename': None, 'extracted_count': 0}), 404
+        # 优先选择“今天之前”最新的快照
+        snapshot = find_latest_jianshang_snapshot(prefer_before_today=True)
+        if not snapshot:
+            print("未找到任何鉴赏码快照")
+            return jsonify({'success': False, 'error': '未找到任何鉴赏码快照', 'filename': None, 'extracted_count': 0}), 404
+
+        latest_file = snapshot['filename']
+        codes = get_jianshang_snapshot_codes(snapshot['snapshot_id'])
         
-        # 获取目录中的所有文件，优先选择“今天之前”最新的文件
-        files = os.listdir(output_dir)
-        current_date_str = datetime.now().strftime('%Y%m%d')
-        latest_before_today = None
-        latest_before_today_ts = None
-        latest_today = None
-        latest_today_ts = None
-
-        for f in files:
-            if not (f.startswith('score_codes_') and f.endswith('.txt')):
-                continue
-            try:
-                timestamp_str = f.replace('score_codes_', '').replace('.txt', '')
-                dt = datetime.strptime(timestamp_str, '%Y%m%d_%H%M%S')
-            except ValueError:
-                continue
-
-            date_part = dt.strftime('%Y%m%d')
-            ts = dt.timestamp()
-
-            if date_part < current_date_str:
-                if latest_before_today_ts is None or ts > latest_before_today_ts:
-                    latest_before_today_ts = ts
-                    latest_before_today = f
-            elif date_part == current_date_str:
-                if latest_today_ts is None or ts > latest_today_ts:
-                    latest_today_ts = ts
-                    latest_today = f
-
-        latest_file = latest_before_today or latest_today
-
-        if not latest_file:
-            print("未找到任何鉴赏码文件")
-            return jsonify({'success': False, 'error': '未找到任何鉴赏码文件', 'filename': None, 'extracted_count': 0}), 404
-
-        file_path = os.path.join(output_dir, latest_file)
-        print(f"找到最新鉴赏码文件: {file_path}")
-
-        codes = []
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                code = line.strip()
-                if code:
-                    codes.append(code)
-        
-        print(f"从文件 {latest_file} 中提取了 {len(codes)} 个鉴赏码")
+        print(f"从快照 {latest_file} 中提取了 {len(codes)} 个鉴赏码")
         return jsonify({
             'success': True,
             'codes': codes,
+            'snapshot_id': snapshot['snapshot_id'],
+            'taken_at': snapshot['taken_at'],
             'filename': latest_file,
             'extracted_count': len(codes)
         })
@@ -1165,9 +3250,17 @@ def get_latest_jianshang_codes():
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def describe_server_mode():
+    """启动时打印的服务器模式说明"""
+    if SERVER_MODE == 'threading':
+        return 'threading（Werkzeug 开发服务器，每个请求一个线程）'
+    return f'{SERVER_MODE}（协程服务器，SQLite 查询在线程池中执行）'
+
+
 def start_server():
     """启动Flask服务器"""
     import socket
+    print(f"服务器模式: {describe_server_mode()}，可用环境变量 QINYIN_SERVER_MODE 切换")
     hostname = socket.gethostname()
     local_ip = socket.gethostbyname(hostname)
 
@@ -1225,8 +3318,318 @@ def start_server():
             print("所有备用端口都被占用，无法启动服务器")
             return
 
-# ========== 随机池相关API ==========
-from flask import abort
+# ========== 随机池相关API ==========
+from flask import abort
+
+# 随机池成员操作：成员按 Fisher–Yates 洗牌后的顺序编号（slot），池记录抽取游标 draw_cursor，
+# slot >= draw_cursor 的成员为剩余可抽取的，每次抽取只需把游标往后推。
+# 设置了 seed 的池洗牌结果可复现，原始成员的洗牌顺序保存在 origin_slot，重置时一条 UPDATE 即可恢复。
+# 按完成率 / 收藏的二次筛选只保存条件（active_filter_json），抽取时沿 slot 顺序联表 scores 取满足条件的成员，
+# 只把取出的成员记为已抽取（drawn_at），暂不满足的留在原位，之后满足条件时仍可抽到；
+# 游标只越过开头连续已抽取的部分。满足条件的剩余数量缓存在 filter_remain，由 scores 上的触发器在池成员数据变化时失效。
+# 加权抽取同样体现在洗牌顺序里：按权重做不放回的加权随机排列（Efraimidis–Spirakis），
+# 抽取仍然只是推进游标，不需要每次请求重算权重。
+
+# 加权方式 -> 权重表达式（s 为 scores，wk 为 works），权重必须为正
+UNPLAYED_DRAW_WEIGHT = 10  # unplayed 模式下未录入完成率的谱子相对已玩过的权重
+POOL_DRAW_WEIGHTS = {
+    'completion': 'MAX(100 - COALESCE(s.completion, 0), 1)',
+    'unplayed': f'CASE WHEN s.completion IS NULL THEN {UNPLAYED_DRAW_WEIGHT} ELSE 1 END',
+    'quality': 'COALESCE(wk.quality_pct, 0) + 0.05',
+}
+
+
+def shuffled_order(codes, seed=None, weights=None):
+    """
+    Fisher–Yates 洗牌，返回新列表；seed 相同则顺序相同。
+    给了 weights 时改为加权随机排列：每个元素取 key = ln(u) / w，按 key 从大到小排，
+    排在前面的概率与权重成正比，依次取出即为按权重的不放回抽样。
+    """
+    order = list(codes)
+    rng = random.Random(seed) if seed is not None else random.SystemRandom()
+    if weights is not None:
+        keys = [math.log(1.0 - rng.random()) / weight for weight in weights]
+        return [order[i] for i in sorted(range(len(order)), key=keys.__getitem__, reverse=True)]
+    for i in range(len(order) - 1, 0, -1):
+        j = rng.randint(0, i)
+        order[i], order[j] = order[j], order[i]
+    return order
+
+
+def normalize_pool_weight(raw):
+    """加权方式：uniform / 空值为等概率（返回 None），未知的方式抛 ValueError"""
+    if raw is None or raw in ('', 'uniform'):
+        return None
+    if raw not in POOL_DRAW_WEIGHTS:
+        raise ValueError(f'不支持的加权方式: {raw}')
+    return raw
+
+
+def get_pool_draw_weights(c, codes, weight):
+    """按加权方式查出 codes 对应的权重（与 codes 顺序一致），等概率时返回 None"""
+    if weight is None:
+        return None
+    c.execute(f'''
+        SELECT {POOL_DRAW_WEIGHTS[weight]}
+        FROM json_each(?) j
+        LEFT JOIN scores s ON s.score_code = j.value
+        LEFT JOIN works wk ON wk.share_code = j.value
+        ORDER BY j.key
+    ''', (json.dumps(codes),))
+    return [row[0] for row in c.fetchall()]
+
+
+def get_pool_weight(c, pool_id):
+    c.execute('SELECT draw_weight FROM random_pools WHERE id = ?', (pool_id,))
+    row = c.fetchone()
+    return row[0] if row else None
+
+
+def get_pool_draw_state(c, pool_id):
+    """(draw_cursor, draw_total, draw_seed)，池不存在时返回 None"""
+    c.execute('SELECT draw_cursor, draw_total, draw_seed FROM random_pools WHERE id = ?', (pool_id,))
+    return c.fetchone()
+
+
+def pool_filter_conditions(filter_obj):
+    """池的筛选条件 -> (conditions, params)，条件针对 scores 别名 s；没有条件时返回空列表"""
+    conditions = []
+    params = []
+    min_completion = filter_obj.get('min_completion')
+    max_completion = filter_obj.get('max_completion')
+    favorite = filter_obj.get('favorite')
+    if min_completion is not None:
+        conditions.append('s.completion >= ?')
+        params.append(min_completion)
+    if max_completion is not None:
+        conditions.append('s.completion <= ?')
+        params.append(max_completion)
+    if favorite == 1:
+        conditions.append('s.is_favorite = 1')
+    elif favorite == 2:
+        conditions.append('s.is_favorite = 0')
+    return conditions, params
+
+
+def get_pool_filter(c, pool_id):
+    """池当前生效的筛选条件 (conditions, params)，未筛选时返回 None"""
+    c.execute('SELECT active_filter_json FROM random_pools WHERE id = ?', (pool_id,))
+    row = c.fetchone()
+    if not row or row[0] is None:
+        return None
+    conditions, params = pool_filter_conditions(json.loads(row[0]))
+    return (conditions, params) if conditions else None
+
+
+def pool_remaining(c, pool_id):
+    """剩余可抽取数量；有筛选条件时优先用缓存的 filter_remain，失效了再联表统计并写回"""
+    state = get_pool_draw_state(c, pool_id)
+    if not state:
+        return 0
+    cursor, total, _ = state
+    pool_filter = get_pool_filter(c, pool_id)
+    if pool_filter is None:
+        return max(total - cursor, 0)
+    c.execute('SELECT filter_remain FROM random_pools WHERE id = ?', (pool_id,))
+    cached = c.fetchone()[0]
+    if cached is not None:
+        return cached
+    conditions, params = pool_filter
+    c.execute(f'''
+        SELECT COUNT(*) FROM pool_members m
+        JOIN scores s ON s.score_code = m.code
+        WHERE m.pool_id = ? AND m.slot >= ? AND m.drawn_at IS NULL AND {' AND '.join(conditions)}
+    ''', [pool_id, cursor] + params)
+    remain = c.fetchone()[0]
+    c.execute('UPDATE random_pools SET filter_remain = ? WHERE id = ?', (remain, pool_id))
+    return remain
+
+
+def set_pool_filter(c, pool_id, filter_obj):
+    """保存二次筛选条件（None 表示取消），缓存的剩余数量随之失效"""
+    filter_json = json.dumps(filter_obj, ensure_ascii=False) if filter_obj else None
+    c.execute('UPDATE random_pools SET active_filter_json = ?, filter_remain = NULL WHERE id = ?',
+              (filter_json, pool_id))
+
+
+def _start_pool_sequence(c, pool_id, codes, seed, origin=False):
+    """按洗牌顺序（池设置了加权方式时为加权排列）给 codes 编 slot，游标归零；origin=True 时同时记为原始顺序"""
+    codes = list(codes)
+    order = shuffled_order(codes, seed, get_pool_draw_weights(c, codes, get_pool_weight(c, pool_id)))
+    column = 'slot = ?, origin_slot = ?' if origin else 'slot = ?'
+    c.executemany(f'UPDATE pool_members SET {column} WHERE pool_id = ? AND code = ?',
+                  [((slot, slot) if origin else (slot,)) + (pool_id, code) for slot, code in enumerate(order)])
+    c.execute('UPDATE random_pools SET draw_cursor = 0, draw_total = ? WHERE id = ?', (len(order), pool_id))
+    return len(order)
+
+
+def insert_pool_members(c, pool_id, codes, seed=None):
+    """新建池时写入成员并洗牌，全部可抽取"""
+    codes = list(dict.fromkeys(codes))
+    c.executemany('''
+        INSERT INTO pool_members (pool_id, code, position, is_origin)
+        VALUES (?, ?, ?, 1)
+    ''', [(pool_id, code, position) for position, code in enumerate(codes)])
+    return _start_pool_sequence(c, pool_id, codes, seed, origin=True)
+
+
+def assign_pool_slots(c, pool_id, codes, seed=None):
+    """
+    把可抽取集合换成 codes 并重新洗牌；不在池里的码作为非原始成员追加，
+    重置池时会被移出。返回剩余数量。
+    """
+    codes = list(dict.fromkeys(codes))
+    set_pool_filter(c, pool_id, None)
+    c.execute('UPDATE pool_members SET slot = NULL, drawn_at = NULL WHERE pool_id = ?', (pool_id,))
+    c.execute('SELECT COALESCE(MAX(position), -1) FROM pool_members WHERE pool_id = ?', (pool_id,))
+    next_position = c.fetchone()[0] + 1
+    c.executemany('''
+        INSERT OR IGNORE INTO pool_members (pool_id, code, position, is_origin)
+        VALUES (?, ?, ?, 0)
+    ''', [(pool_id, code, next_position + i) for i, code in enumerate(codes)])
+    return _start_pool_sequence(c, pool_id, codes, seed)
+
+
+def draw_pool_members(c, pool_id, count=1):
+    """
+    按洗牌顺序取接下来的 count 个成员，抽取本身只是推进游标。
+    先用一条空 UPDATE 拿到写锁再读游标，并发抽取不会拿到同一个成员。返回 (codes, remain)。
+    有筛选条件时沿 slot 顺序取满足条件且未抽取的前 count 个（见 _draw_filtered_pool_members）。
+    """
+    c.execute('UPDATE random_pools SET draw_cursor = draw_cursor WHERE id = ?', (pool_id,))
+    cursor, total, _ = get_pool_draw_state(c, pool_id)
+    pool_filter = get_pool_filter(c, pool_id)
+    if pool_filter is not None:
+        return _draw_filtered_pool_members(c, pool_id, cursor, count, pool_filter)
+    end = min(cursor + count, total)
+    if end <= cursor:
+        return [], 0
+    c.execute('UPDATE random_pools SET draw_cursor = ? WHERE id = ?', (end, pool_id))
+    c.execute('''
+        SELECT code FROM pool_members
+        WHERE pool_id = ? AND slot >= ? AND slot < ?
+        ORDER BY slot
+    ''', (pool_id, cursor, end))
+    codes = [row[0] for row in c.fetchall()]
+    c.execute('''
+        UPDATE pool_members SET drawn_at = CURRENT_TIMESTAMP
+        WHERE pool_id = ? AND slot >= ? AND slot < ?
+    ''', (pool_id, cursor, end))
+    return codes, total - end
+
+
+def _draw_filtered_pool_members(c, pool_id, cursor, count, pool_filter):
+    """
+    只把取出的成员记为已抽取，中间暂不满足条件的成员不跳过，之后（如完成率变化）满足条件时仍可抽到。
+    游标推进到第一个未抽取的 slot，游标之后已抽取的成员靠 drawn_at 排除。
+    """
+    conditions, params = pool_filter
+    remain = pool_remaining(c, pool_id)
+    c.execute(f'''
+        SELECT m.code FROM pool_members m
+        JOIN scores s ON s.score_code = m.code
+        WHERE m.pool_id = ? AND m.slot >= ? AND m.drawn_at IS NULL AND {' AND '.join(conditions)}
+        ORDER BY m.slot
+        LIMIT ?
+    ''', [pool_id, cursor] + params + [count])
+    codes = [row[0] for row in c.fetchall()]
+    if not codes:
+        c.execute('UPDATE random_pools SET filter_remain = 0 WHERE id = ?', (pool_id,))
+        return [], 0
+    c.executemany('UPDATE pool_members SET drawn_at = CURRENT_TIMESTAMP WHERE pool_id = ? AND code = ?',
+                  [(pool_id, code) for code in codes])
+    remain = max(remain - len(codes), 0)
+    c.execute('''
+        UPDATE random_pools
+        SET draw_cursor = COALESCE((
+                SELECT MIN(slot) FROM pool_members
+                WHERE pool_id = ? AND slot >= ? AND drawn_at IS NULL
+            ), draw_total),
+            filter_remain = ?
+        WHERE id = ?
+    ''', (pool_id, cursor, remain, pool_id))
+    return codes, remain
+
+
+def reweight_pool_members(c, pool_id, weight):
+    """
+    换加权方式：只对剩余成员（slot >= 游标）按新权重重新排列，已抽取的不受影响。
+    设置了 seed 的池同时按新权重重算原始顺序，之后重置回放的是新加权方式下的顺序。
+    """
+    c.execute('UPDATE random_pools SET draw_weight = ? WHERE id = ?', (weight, pool_id))
+    cursor, _, seed = get_pool_draw_state(c, pool_id)
+    c.execute('SELECT code FROM pool_members WHERE pool_id = ? AND slot >= ? ORDER BY slot', (pool_id, cursor))
+    codes = [row[0] for row in c.fetchall()]
+    order = shuffled_order(codes, seed, get_pool_draw_weights(c, codes, weight))
+    c.executemany('UPDATE pool_members SET slot = ? WHERE pool_id = ? AND code = ?',
+                  [(cursor + i, pool_id, code) for i, code in enumerate(order)])
+    if seed is not None:
+        c.execute('SELECT code FROM pool_members WHERE pool_id = ? AND is_origin = 1 ORDER BY position', (pool_id,))
+        origin_codes = [row[0] for row in c.fetchall()]
+        origin_order = shuffled_order(origin_codes, seed, get_pool_draw_weights(c, origin_codes, weight))
+        c.executemany('UPDATE pool_members SET origin_slot = ? WHERE pool_id = ? AND code = ?',
+                      [(slot, pool_id, code) for slot, code in enumerate(origin_order)])
+
+
+def get_pool_codes(c, pool_id):
+    """当前可抽取的曲谱码（满足筛选条件的），按加入池的顺序（不暴露抽取顺序）"""
+    conditions, params = get_pool_filter(c, pool_id) or ([], [])
+    join_sql = 'JOIN scores s ON s.score_code = m.code' if conditions else ''
+    filter_sql = ''.join(' AND ' + condition for condition in conditions)
+    c.execute(f'''
+        SELECT m.code FROM pool_members m
+        JOIN random_pools p ON p.id = m.pool_id
+        {join_sql}
+        WHERE m.pool_id = ? AND m.slot >= p.draw_cursor AND m.drawn_at IS NULL{filter_sql}
+        ORDER BY m.position
+    ''', [pool_id] + params)
+    return [row[0] for row in c.fetchall()]
+
+
+def reset_pool_members(c, pool_id, seed=None, reseed=False, weight=None, reweight=False):
+    """
+    恢复为原始成员。
+      - 池设置了 seed（且未换 seed / 加权方式）：直接用保存的原始洗牌顺序，一条 UPDATE 完成，抽取顺序与上次相同；
+      - 未设置 seed，或 reseed=True 换了新 seed、reweight=True 换了加权方式：重新洗牌。
+    """
+    state = get_pool_draw_state(c, pool_id)
+    current_seed = state[2] if state else None
+    set_pool_filter(c, pool_id, None)
+    if reweight:
+        c.execute('UPDATE random_pools SET draw_weight = ? WHERE id = ?', (weight, pool_id))
+    if reseed:
+        c.execute('UPDATE random_pools SET draw_seed = ? WHERE id = ?', (seed, pool_id))
+        current_seed = seed
+    elif current_seed is not None and not reweight:
+        c.execute('''
+            UPDATE pool_members
+            SET slot = CASE WHEN is_origin = 1 THEN origin_slot END, drawn_at = NULL
+            WHERE pool_id = ?
+        ''', (pool_id,))
+        c.execute('''
+            UPDATE random_pools
+            SET draw_cursor = 0,
+                draw_total = (SELECT COUNT(*) FROM pool_members WHERE pool_id = ? AND is_origin = 1)
+            WHERE id = ?
+        ''', (pool_id, pool_id))
+        return
+
+    c.execute('UPDATE pool_members SET slot = NULL, drawn_at = NULL WHERE pool_id = ?', (pool_id,))
+    c.execute('SELECT code FROM pool_members WHERE pool_id = ? AND is_origin = 1 ORDER BY position', (pool_id,))
+    _start_pool_sequence(c, pool_id, [row[0] for row in c.fetchall()], current_seed, origin=True)
+
+
+def normalize_pool_seed(raw):
+    """seed 可以是数字或字符串，统一按字符串保存；空值表示不固定顺序"""
+    if raw is None or (isinstance(raw, str) and not raw.strip()):
+        return None
+    return str(raw).strip()
+
+
+def pool_exists(c, pool_id):
+    c.execute('SELECT 1 FROM random_pools WHERE id = ?', (pool_id,))
+    return c.fetchone() is not None
+
 
 @app.route('/api/random_pool/create', methods=['POST'])
 def create_random_pool():
@@ -1235,176 +3638,257 @@ def create_random_pool():
         name = data.get('name')
         filter_obj = data.get('filter')  # dict
         codes = data.get('codes')
+        seed = normalize_pool_seed(data.get('seed'))  # 可选：固定抽取顺序，重置后顺序不变
         if not name:
             return jsonify({'success': False, 'error': '池名不能为空'}), 400
+        # 可选：加权抽取 completion（完成率越低越容易抽到）/ unplayed（偏向未玩过的）/ quality（偏向高质量作品）
+        try:
+            weight = normalize_pool_weight(data.get('weight'))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         if filter_obj is None:
             filter_obj = {}
-        conn = sqlite3.connect('scores.db')
-        c = conn.cursor()
-        if codes is not None:
-            codes = [c_ for c_ in codes if isinstance(c_, str) and c_.isdigit() and len(c_) >= 5]
-        else:
-            min_completion = filter_obj.get('min_completion')
-            max_completion = filter_obj.get('max_completion')
-            favorite = filter_obj.get('favorite')
-            conditions = []
-            params = []
-            if min_completion is not None:
-                conditions.append('completion >= ?')
-                params.append(min_completion)
-            if max_completion is not None:
-                conditions.append('completion <= ?')
-                params.append(max_completion)
-            if favorite is not None:
-                if favorite == 1:
-                    conditions.append('is_favorite = 1')
-                elif favorite == 2:
-                    conditions.append('is_favorite = 0')
-            query = 'SELECT DISTINCT score_code FROM scores'
-            if conditions:
-                query += ' WHERE ' + ' AND '.join(conditions)
-            c.execute(query, params)
-            codes = [row[0] for row in c.fetchall()]
-        # 存入random_pools表，origin_codes_json也写入
-        c.execute('INSERT INTO random_pools (name, filter_json, codes_json, origin_codes_json) VALUES (?, ?, ?, ?)',
-                  (name, json.dumps(filter_obj, ensure_ascii=False), json.dumps(codes, ensure_ascii=False), json.dumps(codes, ensure_ascii=False)))
-        pool_id = c.lastrowid
-        conn.commit()
-        conn.close()
-        return jsonify({'success': True, 'id': pool_id, 'name': name, 'filter': filter_obj, 'codes': codes})
+        # 排序条件放在 filter 里：rank_by / rank_weights / top_n，例如“质量分最高的 50 个未完成”
+        try:
+            rank_by, rank_weights, top_n = parse_rank_options(filter_obj)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        with scores_db.connection() as conn:
+            c = conn.cursor()
+            if codes is not None:
+                codes = [c_ for c_ in codes if isinstance(c_, str) and c_.isdigit() and len(c_) >= 5]
+                if rank_by or top_n:
+                    rows = query_scores_by_codes(conn, codes, rank_by=rank_by, rank_weights=rank_weights, top_n=top_n)
+                    codes = [row[0] for row in rows]
+            else:
+                min_completion = filter_obj.get('min_completion')
+                max_completion = filter_obj.get('max_completion')
+                favorite = filter_obj.get('favorite')
+                conditions = []
+                params = []
+                if filter_obj.get('uncompleted'):
+                    conditions.append('s.completion IS NULL')
+                if min_completion is not None:
+                    conditions.append('s.completion >= ?')
+                    params.append(min_completion)
+                if max_completion is not None:
+                    conditions.append('s.completion <= ?')
+                    params.append(max_completion)
+                if favorite is not None:
+                    if favorite == 1:
+                        conditions.append('s.is_favorite = 1')
+                    elif favorite == 2:
+                        conditions.append('COALESCE(s.is_favorite, 0) = 0')
+                if filter_obj.get('scope') == 'works':
+                    # 从全部已知作品中挑选（包括还没录入过完成率的）
+                    query = 'SELECT wk.share_code FROM works wk LEFT JOIN scores s ON s.score_code = wk.share_code'
+                else:
+                    query = 'SELECT s.score_code FROM scores s LEFT JOIN works wk ON wk.share_code = s.score_code'
+                if conditions:
+                    query += ' WHERE ' + ' AND '.join(conditions)
+                if rank_by:
+                    rank_expr, rank_params = work_rank_sql(rank_by, rank_weights)
+                    # SQLite 中 NULL 最小，降序时自然排在最后
+                    query += f' ORDER BY {rank_expr} DESC'
+                    params.extend(rank_params)
+                if top_n:
+                    query += ' LIMIT ?'
+                    params.append(top_n)
+                c.execute(query, params)
+                codes = [row[0] for row in c.fetchall()]
+            # 成员写入 pool_members，codes_json 只为兼容旧表结构保留
+            c.execute('''
+                INSERT INTO random_pools (name, filter_json, codes_json, draw_seed, draw_weight)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (name, json.dumps(filter_obj, ensure_ascii=False), '[]', seed, weight))
+            pool_id = c.lastrowid
+            count = insert_pool_members(c, pool_id, codes, seed)
+        return jsonify({'success': True, 'id': pool_id, 'name': name, 'filter': filter_obj,
+                        'count': count, 'seed': seed, 'weight': weight or 'uniform'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/random_pool/list', methods=['GET'])
 def list_random_pools():
+    """
+    池列表只返回数量：total 原始成员数、remain 剩余可抽取数（有二次筛选时为满足条件的）、
+    drawn 本轮已抽取数，以及 seed、加权方式 weight 和当前的二次筛选条件 active_filter
+    """
     try:
-        conn = sqlite3.connect('scores.db')
-        c = conn.cursor()
-        c.execute('SELECT id, name, filter_json, codes_json, created_at FROM random_pools ORDER BY created_at DESC')
-        pools = [
-            {
-                'id': row[0],
-                'name': row[1],
-                'filter': json.loads(row[2]),
-                'codes': json.loads(row[3]),
-                'created_at': row[4]
-            } for row in c.fetchall()
-        ]
-        conn.close()
+        with scores_db.connection() as conn:
+            c = conn.cursor()
+            c.execute('''
+                SELECT p.id, p.name, p.filter_json, p.created_at,
+                       (SELECT COUNT(*) FROM pool_members m WHERE m.pool_id = p.id AND m.is_origin = 1),
+                       p.draw_total - p.draw_cursor,
+                       p.draw_cursor + (SELECT COUNT(*) FROM pool_members m
+                                        WHERE m.pool_id = p.id AND m.slot >= p.draw_cursor
+                                          AND m.drawn_at IS NOT NULL),
+                       p.draw_seed,
+                       p.active_filter_json, p.filter_remain, p.draw_weight
+                FROM random_pools p
+                ORDER BY p.created_at DESC
+            ''')
+            pools = [
+                {
+                    'id': row[0],
+                    'name': row[1],
+                    'filter': json.loads(row[2]),
+                    'created_at': row[3],
+                    'total': row[4],
+                    'remain': max(row[5], 0) if row[8] is None else row[9],
+                    'drawn': row[6],
+                    'seed': row[7],
+                    'active_filter': json.loads(row[8]) if row[8] else None,
+                    'weight': row[10] or 'uniform'
+                } for row in c.fetchall()
+            ]
+            # 筛选结果缓存失效的池重新统计一次（结果写回 filter_remain）
+            for pool in pools:
+                if pool['remain'] is None:
+                    pool['remain'] = pool_remaining(c, pool['id'])
         return jsonify({'success': True, 'pools': pools})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/random_pool/<int:pool_id>/members', methods=['GET'])
+def list_pool_members(pool_id):
+    """池中剩余可抽取的曲谱码及其完成率 / 收藏 / 评价状态（一条 SQL 查出）"""
+    try:
+        with scores_db.connection() as conn:
+            c = conn.cursor()
+            if not pool_exists(c, pool_id):
+                return jsonify({'success': False, 'error': '池不存在'}), 404
+            codes = get_pool_codes(c, pool_id)
+            rows = query_scores_by_codes(conn, codes) if codes else []
+        results = [{
+            'score_code': row[0],
+            'completion': row[1],
+            'is_favorite': bool(row[2]),
+            'remark': row[3] or '',
+            'has_review': bool(row[4]),
+            'title': row[5],
+            'author': row[6]
+        } for row in rows]
+        return jsonify({'success': True, 'results': results, 'remain': len(results)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+RANDOM_POOL_MAX_DRAW_COUNT = 50  # 一次最多预取的抽取数
+
+
 @app.route('/api/random_pool/<int:pool_id>/random', methods=['POST'])
 def random_from_pool(pool_id):
+    """
+    按池的洗牌顺序抽取。?count=k（或请求体 count）一次取接下来的 k 个，便于弱网下预取；
+    code / detail 为第一个，codes / details 为全部。
+    ?weight=（或请求体 weight）与池当前的加权方式不同时，先把剩余成员按新方式重新排列并记住，之后的抽取沿用。
+    """
     try:
-        conn = sqlite3.connect('scores.db')
-        c = conn.cursor()
-        c.execute('SELECT codes_json FROM random_pools WHERE id = ?', (pool_id,))
-        row = c.fetchone()
-        if not row:
-            conn.close()
-            return jsonify({'success': False, 'error': '池不存在'}), 404
-        codes = json.loads(row[0])
-        if not codes:
-            conn.close()
-            return jsonify({'success': False, 'error': '池已空'}), 400
-        import random
-        idx = random.randint(0, len(codes)-1)
-        code = codes.pop(idx)
-        # 只在这里更新codes_json
-        c.execute('UPDATE random_pools SET codes_json = ? WHERE id = ?', (json.dumps(codes, ensure_ascii=False), pool_id))
-        conn.commit()
-        conn.close()
-        return jsonify({'success': True, 'code': code, 'remain': len(codes)})
+        data = request.get_json(silent=True) or {}
+        count = request.args.get('count', type=int) or data.get('count') or 1
+        try:
+            count = max(1, min(int(count), RANDOM_POOL_MAX_DRAW_COUNT))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': '无效的 count'}), 400
+        raw_weight = request.args.get('weight', data.get('weight'))
+        try:
+            weight = normalize_pool_weight(raw_weight)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        with scores_db.connection() as conn:
+            c = conn.cursor()
+            if not pool_exists(c, pool_id):
+                return jsonify({'success': False, 'error': '池不存在'}), 404
+            if raw_weight is not None and weight != get_pool_weight(c, pool_id):
+                reweight_pool_members(c, pool_id, weight)
+            codes, remain = draw_pool_members(c, pool_id, count)
+            if not codes:
+                return jsonify({'success': False, 'error': '池已空'}), 400
+            # 顺带返回抽中曲谱码的详情，前端无需再查一次
+            states = resolve_code_states(codes)
+        details = [states[code] for code in codes]
+        return jsonify({'success': True, 'code': codes[0], 'detail': details[0],
+                        'codes': codes, 'details': details, 'remain': remain})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/random_pool/<int:pool_id>/delete', methods=['POST'])
 def delete_pool(pool_id):
     try:
-        conn = sqlite3.connect('scores.db')
-        c = conn.cursor()
-        c.execute('DELETE FROM random_pools WHERE id = ?', (pool_id,))
-        conn.commit()
-        conn.close()
+        with scores_db.connection() as conn:
+            conn.execute('DELETE FROM pool_members WHERE pool_id = ?', (pool_id,))
+            conn.execute('DELETE FROM random_pools WHERE id = ?', (pool_id,))
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/random_pool/<int:pool_id>/filter', methods=['POST'])
 def filter_pool(pool_id):
+    """
+    二次筛选。只有完成率 / 收藏条件时只保存条件，池恢复为原始成员，抽取和列表时再联表判断；
+    前端传 codes（如排除 / 查询）时可抽取集合直接换成这些码（同时满足条件的）。
+    """
     try:
         data = request.get_json()
         filter_obj = data.get('filter')
         codes_override = data.get('codes')
         if filter_obj is None:
             filter_obj = {}
-        conn = sqlite3.connect('scores.db')
-        c = conn.cursor()
-        c.execute('SELECT origin_codes_json FROM random_pools WHERE id = ?', (pool_id,))
-        row = c.fetchone()
-        if not row:
-            conn.close()
-            return jsonify({'success': False, 'error': '池不存在'}), 404
-        origin_codes = json.loads(row[0])
-        # 支持前端传codes（如排除/查询），否则用origin_codes
-        codes = codes_override if codes_override is not None else origin_codes
-        min_completion = filter_obj.get('min_completion')
-        max_completion = filter_obj.get('max_completion')
-        favorite = filter_obj.get('favorite')
-        if not codes:
-            c.execute('UPDATE random_pools SET codes_json = ? WHERE id = ?', (json.dumps([]), pool_id))
-            conn.commit()
-            conn.close()
-            return jsonify({'success': True, 'codes': []})
-        # 如果筛选条件全空，恢复为origin_codes
-        if not min_completion and not max_completion and not favorite and codes_override is None:
-            c.execute('UPDATE random_pools SET codes_json = ? WHERE id = ?', (json.dumps(origin_codes), pool_id))
-            conn.commit()
-            conn.close()
-            return jsonify({'success': True, 'codes': origin_codes})
-        placeholders = ','.join(['?']*len(codes))
-        query = f'SELECT score_code, completion, is_favorite FROM scores WHERE score_code IN ({placeholders})'
-        conditions = []
-        params = codes[:]
-        if min_completion is not None:
-            conditions.append('completion >= ?')
-            params.append(min_completion)
-        if max_completion is not None:
-            conditions.append('completion <= ?')
-            params.append(max_completion)
-        if favorite is not None:
-            if favorite == 1:
-                conditions.append('is_favorite = 1')
-            elif favorite == 2:
-                conditions.append('is_favorite = 0')
-        if conditions:
-            query += ' AND ' + ' AND '.join(conditions)
-        c.execute(query, params)
-        filtered = [row[0] for row in c.fetchall()]
-        c.execute('UPDATE random_pools SET codes_json = ? WHERE id = ?', (json.dumps(filtered, ensure_ascii=False), pool_id))
-        conn.commit()
-        conn.close()
-        return jsonify({'success': True, 'codes': filtered})
+        with scores_db.connection() as conn:
+            c = conn.cursor()
+            if not pool_exists(c, pool_id):
+                return jsonify({'success': False, 'error': '池不存在'}), 404
+            min_completion = filter_obj.get('min_completion')
+            max_completion = filter_obj.get('max_completion')
+            favorite = filter_obj.get('favorite')
+            # 如果筛选条件全空，恢复为原始成员
+            if not min_completion and not max_completion and not favorite and codes_override is None:
+                reset_pool_members(c, pool_id)
+                return jsonify({'success': True, 'remain': pool_remaining(c, pool_id)})
+            conditions, params = pool_filter_conditions(filter_obj)
+            if codes_override is None:
+                reset_pool_members(c, pool_id)
+                set_pool_filter(c, pool_id, {key: filter_obj.get(key) for key in
+                                             ('min_completion', 'max_completion', 'favorite')
+                                             if filter_obj.get(key) is not None})
+                return jsonify({'success': True, 'remain': pool_remaining(c, pool_id)})
+            # 有筛选条件时只保留已录入的谱子（与原来按 scores 表筛选一致）
+            join_sql = 'JOIN scores s ON s.score_code = src.value' if conditions else ''
+            where_sql = (' WHERE ' + ' AND '.join(conditions)) if conditions else ''
+            c.execute(f'''
+                SELECT src.value FROM json_each(?) src
+                {join_sql}
+                {where_sql}
+                ORDER BY src.key
+            ''', [json.dumps([code for code in codes_override if isinstance(code, str)])] + params)
+            filtered = [row[0] for row in c.fetchall()]
+            remain = assign_pool_slots(c, pool_id, filtered, get_pool_draw_state(c, pool_id)[2])
+        return jsonify({'success': True, 'remain': remain})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/random_pool/<int:pool_id>/reset', methods=['POST'])
 def reset_pool(pool_id):
+    """
+    重置为原始成员；请求体带 seed 时换成新的 seed（null 表示取消固定顺序）并重新洗牌，
+    带 weight 时换成新的加权方式
+    """
     try:
-        conn = sqlite3.connect('scores.db')
-        c = conn.cursor()
-        c.execute('SELECT origin_codes_json FROM random_pools WHERE id = ?', (pool_id,))
-        row = c.fetchone()
-        if not row:
-            conn.close()
-            return jsonify({'success': False, 'error': '池不存在'}), 404
-        origin_codes = row[0]
-        c.execute('UPDATE random_pools SET codes_json = ? WHERE id = ?', (origin_codes, pool_id))
-        conn.commit()
-        conn.close()
-        return jsonify({'success': True})
+        data = request.get_json(silent=True) or {}
+        try:
+            weight = normalize_pool_weight(data.get('weight'))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        with scores_db.connection() as conn:
+            c = conn.cursor()
+            if not pool_exists(c, pool_id):
+                return jsonify({'success': False, 'error': '池不存在'}), 404
+            reseed = 'seed' in data
+            reset_pool_members(c, pool_id, normalize_pool_seed(data.get('seed')), reseed=reseed,
+                               weight=weight, reweight='weight' in data)
+            remain = pool_remaining(c, pool_id)
+        return jsonify({'success': True, 'remain': remain})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -1412,6 +3896,295 @@ def reset_pool(pool_id):
 def random_pool():
     return render_template('random_pool.html')
 
+# ========== 视频上传（流式写入） ==========
+# 评价接口的视频文件不经过 Werkzeug 的临时文件：表单解析时直接把请求体分块写进上传目录下的
+# .upload_xxx.part，同时计算 sha256，保存时原子改名为正式文件名，整个文件只落盘一次。
+# 请求结束时还没改名的 .part（校验失败、客户端中断）会被删除。
+
+STREAMING_UPLOAD_ENDPOINTS = ('create_review', 'update_review')
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class PartialUploadFile:
+    """上传目录里的 .part 文件：写入时同步计算 sha256，commit() 原子改名为正式文件"""
+
+    def __init__(self, folder):
+        os.makedirs(folder, exist_ok=True)
+        self.path = os.path.join(folder, f".upload_{uuid.uuid4().hex}.part")
+        self.file = open(self.path, 'w+b')
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.committed = False
+
+    # Werkzeug 解析表单时需要的文件接口
+    def write(self, data):
+        self.hasher.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def read(self, *args):
+        return self.file.read(*args)
+
+    def readline(self, *args):
+        return self.file.readline(*args)
+
+    def seek(self, *args):
+        return self.file.seek(*args)
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    @property
+    def sha256(self):
+        return self.hasher.hexdigest()
+
+    def commit(self, dst_path):
+        self.file.close()
+        os.replace(self.path, dst_path)
+        self.path = dst_path
+        self.committed = True
+
+    def discard(self):
+        self.file.close()
+        if not self.committed and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class StreamingUploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint in STREAMING_UPLOAD_ENDPOINTS and filename and allowed_video(filename):
+            part = PartialUploadFile(app.config['UPLOAD_FOLDER'])
+            self.partial_uploads = getattr(self, 'partial_uploads', []) + [part]
+            return part
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+
+app.request_class = StreamingUploadRequest
+
+
+@app.teardown_request
+def discard_partial_uploads(exc):
+    for part in getattr(request, 'partial_uploads', ()):
+        part.discard()
+
+
+def cleanup_partial_uploads():
+    """启动时删除上次中断留下的 .part 文件（上传或转码中途退出）"""
+    folder = app.config['UPLOAD_FOLDER']
+    if not os.path.isdir(folder):
+        return
+    for name in os.listdir(folder):
+        if name.endswith('.part'):
+            try:
+                os.remove(os.path.join(folder, name))
+            except OSError as e:
+                print(f"删除残留的临时上传文件失败: {e}")
+
+
+def save_review_upload(video, score_code, log_prefix=''):
+    """
+    把上传的视频保存到上传目录，返回 (文件名, 转码目标文件名, sha256)；
+    未超过压缩阈值时转码目标为 None，否则调用方需要在入库后登记转码任务。
+    """
+    safe_name = secure_filename(video.filename)
+    # 防重名：前缀曲谱码与时间戳
+    final_name = f"{score_code}_{int(time.time())}_{safe_name}"
+    dst_path = os.path.join(app.config['UPLOAD_FOLDER'], final_name)
+
+    part = video.stream
+    if not isinstance(part, PartialUploadFile):
+        # 流式解析没有接管这个文件时按块复制到 .part，同样改名落盘
+        part = PartialUploadFile(app.config['UPLOAD_FOLDER'])
+        try:
+            for chunk in iter(lambda: video.stream.read(UPLOAD_CHUNK_SIZE), b''):
+                part.write(chunk)
+        except Exception:
+            part.discard()
+            raise
+    part.commit(dst_path)
+    print(f"{log_prefix}视频文件已保存到: {dst_path}（{part.size / (1024*1024):.2f} MB，sha256 {part.sha256}）")
+
+    if part.size <= VIDEO_COMPRESS_THRESHOLD:
+        return final_name, None, part.sha256
+    print(f"{log_prefix}文件超过压缩阈值，加入后台转码队列")
+    return final_name, os.path.splitext(final_name)[0] + '_compressed.mp4', part.sha256
+
+# ========== 视频转码任务队列 ==========
+# 超过压缩阈值的上传视频不再在请求里同步压缩：原始文件先入库（video_status = processing），
+# 由后台转码任务压缩完成后替换 video_path 并推送 video_transcode_done。
+# 任务记录在 reviews.db 的 transcode_jobs 表中，服务重启后未完成的任务会继续执行。
+
+TRANSCODE_WORKERS = max(1, int(os.environ.get('QINYIN_TRANSCODE_WORKERS', '1')))  # 同时运行的 ffmpeg 进程数
+TRANSCODE_POLL_INTERVAL = 30  # 没有唤醒信号时检查一次队列的间隔（秒）
+
+transcode_wakeup = threading.Event()
+
+
+def enqueue_transcode_job(c, review_id, source_name, target_name):
+    """在调用方的事务里登记转码任务，提交后调用 wake_transcode_workers()"""
+    c.execute('''
+        INSERT INTO transcode_jobs (review_id, source_name, target_name)
+        VALUES (?, ?, ?)
+    ''', (review_id, source_name, target_name))
+    return c.lastrowid
+
+
+def wake_transcode_workers():
+    transcode_wakeup.set()
+
+
+def claim_transcode_job():
+    """取出最早排队的任务并标记为 running，没有任务时返回 None"""
+    with reviews_db.connection() as conn:
+        c = conn.cursor()
+        c.execute('''
+            UPDATE transcode_jobs
+            SET status = 'running', started_at = CURRENT_TIMESTAMP, attempts = attempts + 1
+            WHERE id = (SELECT id FROM transcode_jobs WHERE status = 'queued' ORDER BY id LIMIT 1)
+            RETURNING id, review_id, source_name, target_name
+        ''')
+        return c.fetchone()
+
+
+def run_transcode_job(job):
+    """
+    压缩到 目标文件.part，完成后改名为目标文件；只有评价仍指向原始文件时才替换 video_path，
+    否则（评价已删除或换了视频）丢弃压缩结果。压缩失败时保留原始文件。
+    """
+    job_id, review_id, source_name, target_name = job
+    folder = app.config['UPLOAD_FOLDER']
+    source_path = os.path.join(folder, source_name)
+    target_path = os.path.join(folder, target_name)
+    partial_path = target_path + '.part'
+    source_url = f"/uploads/videos/{source_name}"
+    target_url = f"/uploads/videos/{target_name}"
+
+    print(f"转码任务 {job_id} 开始: 评价 {review_id}，{source_name}")
+    start = time.perf_counter()
+    error = None
+    if not os.path.exists(source_path):
+        error = '原始视频文件不存在'
+    elif compress_video(source_path, partial_path, VIDEO_COMPRESS_TARGET_SIZE / (1024*1024)):
+        os.replace(partial_path, target_path)
+    else:
+        error = '视频压缩失败，保留原始文件'
+    if error and os.path.exists(partial_path):
+        os.remove(partial_path)
+
+    with reviews_db.connection() as conn:
+        c = conn.cursor()
+        c.execute('''
+            UPDATE reviews SET video_path = ?, video_status = NULL
+            WHERE id = ? AND video_path = ?
+        ''', (source_url if error else target_url, review_id, source_url))
+        still_current = c.rowcount > 0
+        c.execute('''
+            UPDATE transcode_jobs SET status = ?, error = ?, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', ('failed' if error else 'done', error, job_id))
+        c.execute('SELECT score_code FROM reviews WHERE id = ?', (review_id,))
+        row = c.fetchone()
+
+    if not error:
+        # 替换成功删除原始文件；评价已变化时原始文件由编辑 / 删除逻辑处理，这里只丢弃压缩结果
+        os.remove(source_path if still_current else target_path)
+    print(f"转码任务 {job_id} {'失败: ' + error if error else '完成'}，用时 {time.perf_counter() - start:.1f}s")
+
+    if still_current:
+        broadcast_bus.emit_now('video_transcode_done', {
+            'job_id': job_id,
+            'review_id': review_id,
+            'score_code': row[0] if row else None,
+            'success': error is None,
+            'error': error,
+            'video_url': source_url if error else target_url,
+        })
+
+
+def transcode_worker():
+    while True:
+        job = None
+        try:
+            job = claim_transcode_job()
+            if job is None:
+                transcode_wakeup.wait(TRANSCODE_POLL_INTERVAL)
+                transcode_wakeup.clear()
+                continue
+            run_transcode_job(job)
+        except Exception as e:
+            print(f"转码任务出错: {e}")
+            import traceback
+            traceback.print_exc()
+            if job is not None:
+                try:
+                    with reviews_db.connection() as conn:
+                        c = conn.cursor()
+                        c.execute('''
+                            UPDATE transcode_jobs SET status = 'failed', error = ?, finished_at = CURRENT_TIMESTAMP
+                            WHERE id = ?
+                        ''', (str(e), job[0]))
+                        c.execute('''
+                            UPDATE reviews SET video_status = NULL WHERE id = ? AND video_path = ?
+                        ''', (job[1], f"/uploads/videos/{job[2]}"))
+                except Exception as mark_error:
+                    print(f"记录转码失败状态出错: {mark_error}")
+            socketio.sleep(1)
+
+
+def transcode_job_dict(row):
+    job = dict(row)
+    job['source_url'] = f"/uploads/videos/{job.pop('source_name')}"
+    job['target_url'] = f"/uploads/videos/{job.pop('target_name')}"
+    return job
+
+
+@app.route('/api/transcode/jobs', methods=['GET'])
+def list_transcode_jobs():
+    """转码任务列表（最新在前），?status=queued/running/done/failed 过滤，?limit= 默认 50"""
+    try:
+        status = (request.args.get('status') or '').strip()
+        limit = max(1, min(500, request.args.get('limit', default=50, type=int)))
+        with reviews_db.connection() as conn:
+            c = conn.cursor()
+            c.row_factory = sqlite3.Row
+            if status:
+                c.execute('SELECT * FROM transcode_jobs WHERE status = ? ORDER BY id DESC LIMIT ?', (status, limit))
+            else:
+                c.execute('SELECT * FROM transcode_jobs ORDER BY id DESC LIMIT ?', (limit,))
+            jobs = [transcode_job_dict(row) for row in c.fetchall()]
+            c.execute('SELECT status, COUNT(*) FROM transcode_jobs GROUP BY status')
+            counts = {row[0]: row[1] for row in c.fetchall()}
+        return jsonify({'success': True, 'jobs': jobs, 'counts': counts, 'workers': TRANSCODE_WORKERS})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/transcode/jobs/<int:job_id>', methods=['GET'])
+def get_transcode_job(job_id):
+    try:
+        with reviews_db.connection() as conn:
+            c = conn.cursor()
+            c.row_factory = sqlite3.Row
+            c.execute('SELECT * FROM transcode_jobs WHERE id = ?', (job_id,))
+            row = c.fetchone()
+        if not row:
+            return jsonify({'success': False, 'error': '任务不存在'}), 404
+        return jsonify({'success': True, 'job': transcode_job_dict(row)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+cleanup_partial_uploads()
+for _ in range(TRANSCODE_WORKERS):
+    socketio.start_background_task(transcode_worker)
+
 @app.route('/api/reviews', methods=['POST'])
 def create_review():
     try:
@@ -1446,6 +4219,8 @@ def create_review():
 
         saved_rel_url = None
         video_type = 'file'
+        transcode_target = None
+        video_sha256 = None
 
         if video_source == 'external':
             clean_value, video_type, error_msg = sanitize_external_video_reference(external_video_value)
@@ -1459,53 +4234,9 @@ def create_review():
 
             if not allowed_video(video.filename):
                 return jsonify({'success': False, 'error': '不支持的视频格式'}), 400
-            safe_name = secure_filename(video.filename)
-            # 防重名：前缀曲谱码与时间戳
-            final_name = f"{score_code}_{int(time.time())}_{safe_name}"
-            dst_path = os.path.join(app.config['UPLOAD_FOLDER'], final_name)
-
-            # 确保上传目录存在
-            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
-            # 保存原始视频文件到临时位置
-            temp_path = None
             try:
-                # 创建临时文件保存上传的视频
-                temp_fd, temp_path = tempfile.mkstemp(suffix=os.path.splitext(safe_name)[1])
-                os.close(temp_fd)
-                video.save(temp_path)
-                print(f"视频文件已保存到临时位置: {temp_path}")
-
-                # 检查文件大小是否需要压缩
-                file_size = os.path.getsize(temp_path)
-                print(f"上传的视频文件大小: {file_size / (1024*1024):.2f} MB")
-
-                if file_size > VIDEO_COMPRESS_THRESHOLD:
-                    print("文件超过压缩阈值，开始压缩...")
-                    # 压缩视频
-                    compressed_path = dst_path.replace(os.path.splitext(dst_path)[1], '_compressed.mp4')
-                    if compress_video(temp_path, compressed_path, VIDEO_COMPRESS_TARGET_SIZE / (1024*1024)):
-                        # 压缩成功，使用压缩后的文件
-                        dst_path = compressed_path
-                        final_name = os.path.basename(compressed_path)
-                        print(f"视频压缩完成，保存到: {dst_path}")
-                    else:
-                        # 压缩失败，直接保存原始文件
-                        print("视频压缩失败，保存原始文件")
-                        shutil.move(temp_path, dst_path)
-                else:
-                    # 文件大小未超过阈值，直接移动文件
-                    shutil.move(temp_path, dst_path)
-                    print(f"视频文件已保存到: {dst_path}")
-
-                # 清理临时文件
-                if temp_path and os.path.exists(temp_path):
-                    os.remove(temp_path)
-
+                final_name, transcode_target, video_sha256 = save_review_upload(video, score_code)
             except Exception as save_error:
-                # 清理临时文件
-                if temp_path and os.path.exists(temp_path):
-                    os.remove(temp_path)
                 print(f"保存视频文件时出错: {str(save_error)}")
                 import traceback
                 traceback.print_exc()
@@ -1514,16 +4245,18 @@ def create_review():
             # 前端可直接访问的相对 URL
             saved_rel_url = f"/uploads/videos/{final_name}"
 
-        # 入库
-        conn = sqlite3.connect('reviews.db')
-        c = conn.cursor()
-        c.execute('''
-            INSERT INTO reviews (score_code, rating, comment, video_path, is_top)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (score_code, rating, comment, saved_rel_url, 1 if is_top else 0))
-        conn.commit()
-        new_id = c.lastrowid
-        conn.close()
+        # 入库；大文件先用原始文件入库并标记 processing，转码完成后由任务替换
+        video_status = 'processing' if transcode_target else None
+        with reviews_db.connection() as conn:
+            c = conn.cursor()
+            c.execute('''
+                INSERT INTO reviews (score_code, rating, comment, video_path, is_top, video_status)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (score_code, rating, comment, saved_rel_url, 1 if is_top else 0, video_status))
+            new_id = c.lastrowid
+            transcode_job_id = enqueue_transcode_job(c, new_id, final_name, transcode_target) if transcode_target else None
+        if transcode_job_id:
+            wake_transcode_workers()
 
         return jsonify({
             'success': True,
@@ -1533,6 +4266,9 @@ def create_review():
             'comment': comment,
             'video_url': saved_rel_url,
             'video_type': video_type,
+            'video_status': video_status,
+            'video_sha256': video_sha256,
+            'transcode_job_id': transcode_job_id,
             'is_top': is_top
         })
     except Exception as e:
@@ -1546,130 +4282,106 @@ def create_review():
 
 @app.route('/api/reviews/<int:review_id>', methods=['PUT'])
 def update_review(review_id):
-    conn = sqlite3.connect('reviews.db')
     try:
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        c.execute('SELECT * FROM reviews WHERE id = ?', (review_id,))
-        row = c.fetchone()
-        if not row:
-            return jsonify({'success': False, 'error': '评价不存在'}), 404
-
-        score_code = row['score_code']
-        existing_video_path = row['video_path'] or ''
-
-        rating_raw = (request.form.get('rating') or '').strip()
-        comment = (request.form.get('comment') or '').strip()
-        video_source = (request.form.get('video_source') or 'keep').strip().lower()
-        video = request.files.get('video')
-        external_video_value = (request.form.get('video_url') or '').strip()
-
-        if not comment:
-            return jsonify({'success': False, 'error': '评语不能为空'}), 400
-
-        try:
-            rating = int(rating_raw)
-            if rating < 1 or rating > 5:
-                raise ValueError()
-        except Exception:
-            return jsonify({'success': False, 'error': '评分必须是 1-5 的整数'}), 400
-
-        if video_source not in ('keep', 'upload', 'external'):
-            return jsonify({'success': False, 'error': '视频来源无效'}), 400
-
-        saved_rel_url = existing_video_path
-        video_type = detect_video_type(existing_video_path)
+        with reviews_db.connection() as conn:
+            c = conn.cursor()
+            c.row_factory = sqlite3.Row
+            c.execute('SELECT * FROM reviews WHERE id = ?', (review_id,))
+            row = c.fetchone()
+            if not row:
+                return jsonify({'success': False, 'error': '评价不存在'}), 404
 
-        if video_source == 'external':
-            clean_value, video_type, error_msg = sanitize_external_video_reference(external_video_value)
-            if error_msg:
-                return jsonify({'success': False, 'error': error_msg}), 400
-            if clean_value != existing_video_path:
-                delete_uploaded_video_file(existing_video_path)
-            saved_rel_url = clean_value
-        elif video_source == 'upload':
-            if not video or not video.filename:
-                return jsonify({'success': False, 'error': '请上传视频文件'}), 400
-            if not allowed_video(video.filename):
-                return jsonify({'success': False, 'error': '不支持的视频格式'}), 400
+            score_code = row['score_code']
+            existing_video_path = row['video_path'] or ''
 
-            safe_name = secure_filename(video.filename)
-            final_name = f"{score_code}_{int(time.time())}_{safe_name}"
-            dst_path = os.path.join(app.config['UPLOAD_FOLDER'], final_name)
+            rating_raw = (request.form.get('rating') or '').strip()
+            comment = (request.form.get('comment') or '').strip()
+            video_source = (request.form.get('video_source') or 'keep').strip().lower()
+            video = request.files.get('video')
+            external_video_value = (request.form.get('video_url') or '').strip()
 
-            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+            if not comment:
+                return jsonify({'success': False, 'error': '评语不能为空'}), 400
 
-            temp_path = None
             try:
-                temp_fd, temp_path = tempfile.mkstemp(suffix=os.path.splitext(safe_name)[1])
-                os.close(temp_fd)
-                video.save(temp_path)
-                print(f"编辑评价：视频文件已保存到临时位置: {temp_path}")
-
-                file_size = os.path.getsize(temp_path)
-                print(f"编辑评价：上传的视频文件大小: {file_size / (1024*1024):.2f} MB")
-
-                if file_size > VIDEO_COMPRESS_THRESHOLD:
-                    print("编辑评价：文件超过压缩阈值，开始压缩...")
-                    compressed_path = dst_path.replace(os.path.splitext(dst_path)[1], '_compressed.mp4')
-                    if compress_video(temp_path, compressed_path, VIDEO_COMPRESS_TARGET_SIZE / (1024*1024)):
-                        dst_path = compressed_path
-                        final_name = os.path.basename(compressed_path)
-                        print(f"编辑评价：视频压缩完成，保存到: {dst_path}")
-                    else:
-                        print("编辑评价：视频压缩失败，保存原始文件")
-                        shutil.move(temp_path, dst_path)
-                else:
-                    shutil.move(temp_path, dst_path)
-                    print(f"编辑评价：视频文件已保存到: {dst_path}")
-
-                if temp_path and os.path.exists(temp_path):
-                    os.remove(temp_path)
-
-                delete_uploaded_video_file(existing_video_path)
-            except Exception as save_error:
-                if temp_path and os.path.exists(temp_path):
-                    os.remove(temp_path)
-                print(f"编辑评价：保存视频文件时出错: {str(save_error)}")
-                import traceback
-                traceback.print_exc()
-                return jsonify({'success': False, 'error': f'保存视频文件失败: {str(save_error)}'}), 500
+                rating = int(rating_raw)
+                if rating < 1 or rating > 5:
+                    raise ValueError()
+            except Exception:
+                return jsonify({'success': False, 'error': '评分必须是 1-5 的整数'}), 400
+
+            if video_source not in ('keep', 'upload', 'external'):
+                return jsonify({'success': False, 'error': '视频来源无效'}), 400
+
+            saved_rel_url = existing_video_path
+            video_type = detect_video_type(existing_video_path)
+            video_status = row['video_status']
+            transcode_target = None
+            video_sha256 = None
+
+            if video_source == 'external':
+                clean_value, video_type, error_msg = sanitize_external_video_reference(external_video_value)
+                if error_msg:
+                    return jsonify({'success': False, 'error': error_msg}), 400
+                if clean_value != existing_video_path:
+                    delete_uploaded_video_file(existing_video_path)
+                saved_rel_url = clean_value
+            elif video_source == 'upload':
+                if not video or not video.filename:
+                    return jsonify({'success': False, 'error': '请上传视频文件'}), 400
+                if not allowed_video(video.filename):
+                    return jsonify({'success': False, 'error': '不支持的视频格式'}), 400
 
-            saved_rel_url = f"/uploads/videos/{final_name}"
-            video_type = 'file'
-
-        # 更新数据库
-        c.execute('''
-            UPDATE reviews
-            SET rating = ?, comment = ?, video_path = ?, created_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (rating, comment, saved_rel_url, review_id))
-        conn.commit()
+                try:
+                    final_name, transcode_target, video_sha256 = save_review_upload(video, score_code, '编辑评价：')
+                    delete_uploaded_video_file(existing_video_path)
+                except Exception as save_error:
+                    print(f"编辑评价：保存视频文件时出错: {str(save_error)}")
+                    import traceback
+                    traceback.print_exc()
+                    return jsonify({'success': False, 'error': f'保存视频文件失败: {str(save_error)}'}), 500
+
+                saved_rel_url = f"/uploads/videos/{final_name}"
+                video_type = 'file'
+            if video_source != 'keep':
+                video_status = 'processing' if transcode_target else None
+
+            # 更新数据库
+            c.execute('''
+                UPDATE reviews
+                SET rating = ?, comment = ?, video_path = ?, video_status = ?, created_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (rating, comment, saved_rel_url, video_status, review_id))
+            transcode_job_id = enqueue_transcode_job(c, review_id, final_name, transcode_target) if transcode_target else None
+            conn.commit()
+            if transcode_job_id:
+                wake_transcode_workers()
 
-        c.execute('''
-            SELECT rating, comment, video_path, created_at
-            FROM reviews
-            WHERE id = ?
-        ''', (review_id,))
-        updated = c.fetchone()
-        return jsonify({
-            'success': True,
-            'id': review_id,
-            'score_code': score_code,
-            'rating': updated[0],
-            'comment': updated[1] or '',
-            'video_url': updated[2],
-            'video_type': detect_video_type(updated[2]),
-            'created_at': updated[3],
-        })
+            c.execute('''
+                SELECT rating, comment, video_path, created_at
+                FROM reviews
+                WHERE id = ?
+            ''', (review_id,))
+            updated = c.fetchone()
+            return jsonify({
+                'success': True,
+                'id': review_id,
+                'score_code': score_code,
+                'rating': updated[0],
+                'comment': updated[1] or '',
+                'video_url': updated[2],
+                'video_type': detect_video_type(updated[2]),
+                'video_status': video_status,
+                'video_sha256': video_sha256,
+                'transcode_job_id': transcode_job_id,
+                'created_at': updated[3],
+            })
     except Exception as e:
         import traceback
         error_info = traceback.format_exc()
         print(f"更新评价时出错: {str(e)}")
         print(f"详细错误信息:\n{error_info}")
         return jsonify({'success': False, 'error': str(e)}), 500
-    finally:
-        conn.close()
 
 
 @app.route('/api/reviews/status')
@@ -1677,11 +4389,10 @@ def review_status():
     score_code = (request.args.get('score_code') or '').strip()
     if not is_valid_score_code(score_code):
         return jsonify({'success': False, 'error': '无效的曲谱码'}), 400
-    conn = sqlite3.connect('reviews.db')
-    c = conn.cursor()
-    c.execute('SELECT 1 FROM reviews WHERE score_code = ? LIMIT 1', (score_code,))
-    has = c.fetchone() is not None
-    conn.close()
+    with reviews_db.connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT 1 FROM reviews WHERE score_code = ? LIMIT 1', (score_code,))
+        has = c.fetchone() is not None
     return jsonify({'success': True, 'has_review': has})
 
 
@@ -1689,17 +4400,16 @@ def review_status():
 def get_review(score_code):
     if not is_valid_score_code(score_code):
         return jsonify({'success': False, 'error': '无效的曲谱码'}), 400
-    conn = sqlite3.connect('reviews.db')
-    c = conn.cursor()
-    c.execute('''
-        SELECT id, rating, comment, video_path, created_at
-        FROM reviews
-        WHERE score_code = ?
-        ORDER BY created_at DESC
-        LIMIT 1
-    ''', (score_code,))
-    row = c.fetchone()
-    conn.close()
+    with reviews_db.connection() as conn:
+        c = conn.cursor()
+        c.execute('''
+            SELECT id, rating, comment, video_path, created_at, video_status
+            FROM reviews
+            WHERE score_code = ?
+            ORDER BY created_at DESC
+            LIMIT 1
+        ''', (score_code,))
+        row = c.fetchone()
     if not row:
         return jsonify({'success': True, 'has_review': False})
     return jsonify({
@@ -1711,6 +4421,7 @@ def get_review(score_code):
         'comment': row[2] or '',
         'video_url': row[3],
         'video_type': detect_video_type(row[3]),
+        'video_status': row[5],
         'created_at': row[4],
     })
 
@@ -1741,10 +4452,7 @@ def list_liked_reviews():
         limit = request.args.get('limit', default=100, type=int)
         offset = request.args.get('offset', default=0, type=int)
 
-        # 1) 取每个 score_code 最新的一条 review
-        conn_r = sqlite3.connect('reviews.db')
-        cr = conn_r.cursor()
-
+        # 筛选条件
         where = []
         params = []
 
@@ -1756,8 +4464,11 @@ def list_liked_reviews():
             where.append('r.video_path IS NOT NULL AND r.video_path <> ""')
 
         if q:
-            where.append('(r.score_code LIKE ? OR r.comment LIKE ?)')
-            params.extend([f'%{q}%', f'%{q}%'])
+            # 走 reviews_fts 全文索引，再精确校验曲谱码 / 评价内容是否包含 q
+            cond, cond_params = fts_match_conditions(
+                'r.id', 'reviews_fts', ['r.score_code', 'r.comment'], q, FTS_READY['reviews'])
+            where.append(cond)
+            params.extend(cond_params)
 
         where_sql = (' WHERE ' + ' AND '.join(where)) if where else ''
 
@@ -1767,51 +4478,31 @@ def list_liked_reviews():
         elif sort == 'rating_asc':
             order_sql = 'ORDER BY r.rating ASC, r.created_at DESC'
 
+        # 每个 score_code 取最新一条评价，同一条 SQL 里带上完成率 / 收藏 / 备注（sc.scores）与作品标题、作者（sc.works）
         sql = f'''
-            SELECT r.id, r.score_code, r.rating, r.comment, r.video_path, r.created_at
+            SELECT r.id, r.score_code, r.rating, r.comment, r.video_path, r.created_at, r.video_status,
+                   s.completion, s.is_favorite, s.remark, w.title, w.nickname
             FROM reviews r
             JOIN (
                 SELECT score_code, MAX(created_at) AS latest_time
                 FROM reviews
                 GROUP BY score_code
             ) lr ON r.score_code = lr.score_code AND r.created_at = lr.latest_time
+            LEFT JOIN sc.scores s ON s.score_code = r.score_code
+            LEFT JOIN sc.works w ON w.share_code = r.score_code
             {where_sql}
             {order_sql}
             LIMIT ? OFFSET ?
         '''
         params_ext = params + [limit, offset]
-        cr.execute(sql, params_ext)
-        rows = cr.fetchall()
-        conn_r.close()
-
-        # 2) 取这些谱子的最新完成率 & 收藏态（scores.db）
-        codes = [r[1] for r in rows]  # r[1] 是 score_code
-        completion_map = {}
-        favorite_map = {}
-        remark_map = {}
-        if codes:
-            conn_s = sqlite3.connect('scores.db')
-            cs = conn_s.cursor()
-            ph = ','.join(['?'] * len(codes))
-            cs.execute(f'''
-                SELECT s.score_code, s.completion, s.is_favorite, s.remark
-                FROM scores s
-                JOIN (
-                    SELECT score_code, MAX(created_at) AS latest_time
-                    FROM scores
-                    GROUP BY score_code
-                ) ls ON s.score_code = ls.score_code AND s.created_at = ls.latest_time
-                WHERE s.score_code IN ({ph})
-            ''', codes)
-            for code, comp, fav, remark in cs.fetchall():
-                completion_map[code] = comp
-                favorite_map[code] = bool(fav)
-                remark_map[code] = remark or ''
-            conn_s.close()
-
-        # 3) 拼装返回
+        with reviews_db.connection() as conn_r:
+            cr = conn_r.cursor()
+            cr.execute(sql, params_ext)
+            rows = cr.fetchall()
+
         data = []
-        for review_id, code, rating, comment, video_path, created_at in rows:
+        for (review_id, code, rating, comment, video_path, created_at, video_status,
+             completion, is_favorite, remark, title, author) in rows:
             data.append({
                 'review_id': review_id,
                 'score_code': code,
@@ -1819,10 +4510,13 @@ def list_liked_reviews():
                 'comment': comment or '',
                 'video_url': video_path,
                 'video_type': detect_video_type(video_path),
+                'video_status': video_status,
                 'created_at': created_at,
-                'completion': completion_map.get(code),
-                'is_favorite': favorite_map.get(code, False),
-                'remark': remark_map.get(code, '')
+                'completion': completion,
+                'is_favorite': bool(is_favorite),
+                'remark': remark or '',
+                'title': title,
+                'author': author
             })
 
         return jsonify({'success': True, 'results': data})
@@ -1834,7 +4528,7 @@ def list_liked_reviews():
 def handle_file_too_large(e):
     return jsonify({
         'success': False,
-        'error': f'文件太大了！请上传小于500MB的文件，或使用视频压缩功能。'
+        'error': f"文件太大了！请上传小于{app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)}MB的文件，或使用视频压缩功能。"
     }), 413
 
 if __name__ == '__main__':
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+/api/scores/batch 批量查询性能测试脚本
+
+在临时目录中生成 scores.db / reviews.db，分别提交 10k / 50k / 100k 个曲谱码
+（附带约 10% 的排除列表与筛选条件），统计接口耗时。
+用法: python benchmark_batch_query.py [--sizes 10000,50000,100000] [--repeat 3]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+# 将项目目录添加到Python路径中
+project_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, project_root)
+
+
+def load_app(workdir):
+    """切换到临时目录后再导入 app，避免触碰真实数据库"""
+    os.chdir(workdir)
+    import app as app_module
+    return app_module
+
+
+def seed_database(app_module, total_codes, review_ratio=0.05):
+    """写入 total_codes 条谱子记录，并给其中一部分添加评价"""
+    codes = [str(10000000 + i) for i in range(total_codes)]
+    rows = [
+        (code, random.randint(0, 100), 1 if random.random() < 0.1 else 0, '测试备注' if random.random() < 0.2 else None)
+        for code in codes
+    ]
+    with app_module.scores_db.connection() as conn:
+        conn.executemany('''
+            INSERT INTO scores (score_code, completion, difficulty, region, is_favorite, remark, created_at)
+            VALUES (?, ?, 0, 'CN', ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(score_code) DO NOTHING
+        ''', rows)
+    reviewed = random.sample(codes, int(total_codes * review_ratio))
+    with app_module.reviews_db.connection() as conn:
+        conn.executemany(
+            'INSERT INTO reviews (score_code, rating, comment) VALUES (?, 5, ?)',
+            [(code, '基准测试') for code in reviewed]
+        )
+    return codes
+
+
+def run_case(client, codes, size, repeat):
+    # 一半来自数据库，一半是库中不存在的曲谱码
+    requested = random.sample(codes, min(size // 2, len(codes)))
+    requested += [str(90000000 + i) for i in range(size - len(requested))]
+    random.shuffle(requested)
+    exclude = random.sample(requested, size // 10)
+    payloads = {
+        '无筛选': {'score_codes': requested, 'exclude_codes': exclude},
+        '完成率+收藏': {'score_codes': requested, 'exclude_codes': exclude,
+                     'min_completion': 30, 'max_completion': 90, 'favorite': 2},
+        '仅有评价': {'score_codes': requested, 'exclude_codes': exclude, 'has_review': 1},
+    }
+    for label, payload in payloads.items():
+        timings = []
+        found = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            resp = client.post('/api/scores/batch', json=payload)
+            timings.append((time.perf_counter() - start) * 1000)
+            body = resp.get_json()
+            if not body.get('success'):
+                print(f"  [ERROR] {label}: {body.get('error')}")
+                return False
+            found = body['found']
+        print(f"  {size:>7} 个曲谱码 | {label:<8} | 命中 {found:>7} | "
+              f"中位 {statistics.median(timings):8.1f} ms | 最慢 {max(timings):8.1f} ms")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量查询接口性能测试')
+    parser.add_argument('--sizes', default='10000,50000,100000', help='逗号分隔的请求规模')
+    parser.add_argument('--repeat', type=int, default=3, help='每种请求的重复次数')
+    parser.add_argument('--seed', type=int, default=42, help='随机种子')
+    args = parser.parse_args()
+
+    sizes = [int(item) for item in args.sizes.split(',') if item.strip()]
+    random.seed(args.seed)
+
+    print("批量查询性能测试")
+    print("================")
+
+    # 连接池中的连接在进程结束前不会关闭，Windows 下清理临时目录可能失败，忽略即可
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as workdir:
+        app_module = load_app(workdir)
+        start = time.perf_counter()
+        codes = seed_database(app_module, max(sizes))
+        print(f"已写入 {len(codes)} 条测试数据，用时 {time.perf_counter() - start:.1f}s")
+
+        client = app_module.app.test_client()
+        ok = all(run_case(client, codes, size, args.repeat) for size in sizes)
+        os.chdir(project_root)
+
+    return ok
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
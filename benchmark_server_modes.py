@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+服务器模式压测脚本：threading / eventlet / gevent
+
+每种模式在临时目录中用子进程启动一次服务（QINYIN_SERVER_MODE=模式），写入测试数据后：
+  1. HTTP：concurrency 个线程在 duration 秒内循环请求 /api/scores 与 /api/scores/batch，统计吞吐与延迟；
+  2. Socket.IO：同时连接 clients 个客户端并订阅主页房间，保存一次完成率，统计连接成功数和
+     score_updates 送达全部客户端的耗时。
+未安装对应依赖（eventlet / gevent）的模式会跳过。
+用法: python benchmark_server_modes.py [--modes threading,eventlet,gevent] [--concurrency 50] [--clients 100]
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+import socketio
+
+project_root = os.path.dirname(os.path.abspath(__file__))
+
+SERVER_SCRIPT = (
+    "import sys; sys.path.insert(0, {root!r}); import app; "
+    "app.socketio.run(app.app, host='127.0.0.1', port={port}, allow_unsafe_werkzeug=True)"
+)
+
+
+def find_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# 未安装 websocket-client 时 Socket.IO 客户端只能用长轮询，显式指定以免每次连接都打印警告
+SOCKET_TRANSPORTS = ['websocket', 'polling'] if importlib.util.find_spec('websocket') else ['polling']
+
+
+def mode_available(mode):
+    return mode == 'threading' or importlib.util.find_spec(mode) is not None
+
+
+def start_server(mode, workdir):
+    """在 workdir 中启动服务（数据库建在 workdir），等待 /api/db/stats 可访问，返回 (进程, 基础 URL)"""
+    port = find_free_port()
+    env = dict(os.environ, QINYIN_SERVER_MODE=mode, QINYIN_CLIPBOARD_SOURCE='stub')
+    process = subprocess.Popen(
+        [sys.executable, '-c', SERVER_SCRIPT.format(root=project_root, port=port)],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.perf_counter() + 60
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{mode} 模式服务启动失败（返回码 {process.returncode}）')
+        try:
+            body = requests.get(f'{base_url}/api/db/stats', timeout=1).json()
+            if body.get('server_mode') != mode:
+                raise RuntimeError(f"服务实际运行在 {body.get('server_mode')} 模式")
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{mode} 模式服务启动超时')
+
+
+def seed_data(base_url, total):
+    codes = [str(10000000 + i) for i in range(total)]
+    session = requests.Session()
+    for code in codes:
+        session.post(f'{base_url}/api/scores/save', json={'score_code': code, 'completion': random.randint(0, 100)})
+    return codes
+
+
+def run_http_load(base_url, codes, concurrency, duration):
+    timings = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def worker():
+        session = requests.Session()
+        local_timings = []
+        local_errors = 0
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            try:
+                if random.random() < 0.5:
+                    resp = session.get(f'{base_url}/api/scores', params={'limit': 50}, timeout=30)
+                else:
+                    resp = session.post(f'{base_url}/api/scores/batch',
+                                        json={'score_codes': random.sample(codes, min(200, len(codes)))}, timeout=30)
+                if resp.status_code != 200:
+                    local_errors += 1
+            except requests.RequestException:
+                local_errors += 1
+            local_timings.append((time.perf_counter() - start) * 1000)
+        with lock:
+            timings.extend(local_timings)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95) - 1] if timings else 0
+    print(f"  HTTP    | 并发 {concurrency:>4} | {len(timings) / duration:8.1f} 请求/秒 | "
+          f"中位 {statistics.median(timings) if timings else 0:7.1f} ms | P95 {p95:7.1f} ms | 失败 {errors[0]}")
+
+
+def run_socket_fanout(base_url, client_count):
+    clients = []
+    received = []
+    lock = threading.Lock()
+    all_received = threading.Event()
+
+    def make_client():
+        client = socketio.Client(reconnection=False)
+
+        @client.on('score_updates')
+        def on_updates(data):
+            with lock:
+                received.append(time.perf_counter())
+                if len(received) >= len(clients):
+                    all_received.set()
+
+        client.connect(base_url, transports=SOCKET_TRANSPORTS, wait_timeout=10)
+        client.call('subscribe', {'page': 'index'}, timeout=10)
+        return client
+
+    start = time.perf_counter()
+    failed = 0
+    for _ in range(client_count):
+        try:
+            clients.append(make_client())
+        except Exception:
+            failed += 1
+    connect_time = time.perf_counter() - start
+
+    sent_at = time.perf_counter()
+    requests.post(f'{base_url}/api/scores/save', json={'score_code': '99999999', 'completion': 50}, timeout=30)
+    all_received.wait(timeout=30)
+    fanout_ms = (max(received) - sent_at) * 1000 if received else float('nan')
+    transport = clients[0].transport() if clients else '-'
+    print(f"  Socket  | 连接 {len(clients):>4}/{client_count} 个（{transport}，{connect_time:.1f}s）| "
+          f"送达 {len(received):>4} 个 | 全部送达 {fanout_ms:7.1f} ms | 连接失败 {failed}")
+    for client in clients:
+        try:
+            client.disconnect()
+        except Exception:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='服务器模式压测')
+    parser.add_argument('--modes', default='threading,eventlet,gevent', help='逗号分隔的服务器模式')
+    parser.add_argument('--concurrency', type=int, default=50, help='HTTP 并发线程数')
+    parser.add_argument('--duration', type=float, default=10, help='每种模式 HTTP 压测秒数')
+    parser.add_argument('--clients', type=int, default=100, help='Socket.IO 客户端数')
+    parser.add_argument('--codes', type=int, default=2000, help='写入的测试曲谱码数量')
+    parser.add_argument('--seed', type=int, default=42, help='随机种子')
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    print("服务器模式压测")
+    print("==============")
+    ok = True
+    for mode in [item.strip() for item in args.modes.split(',') if item.strip()]:
+        print(f"\n[{mode}]")
+        if not mode_available(mode):
+            print(f"  未安装 {mode}，跳过")
+            continue
+        with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as workdir:
+            try:
+                process, base_url = start_server(mode, workdir)
+            except RuntimeError as e:
+                print(f"  [ERROR] {e}")
+                ok = False
+                continue
+            try:
+                start = time.perf_counter()
+                codes = seed_data(base_url, args.codes)
+                print(f"  已写入 {len(codes)} 条测试数据，用时 {time.perf_counter() - start:.1f}s")
+                run_http_load(base_url, codes, args.concurrency, args.duration)
+                run_socket_fanout(base_url, args.clients)
+            finally:
+                process.terminate()
+                process.wait(timeout=10)
+    return ok
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
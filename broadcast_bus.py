@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Socket.IO 广播总线
+
+  - publish(score_code, **fields)：谱子状态变化（完成率 / 收藏 / 备注）先放进待发送表，
+    同一曲谱码在窗口期内的多次变化合并为一条（后写的字段覆盖先写的）；
+  - 第一条变化到达后等待 window 秒，把待发送表一次性作为一个 score_updates 事件发出：
+    {'updates': [{'score_code': ..., 'completion': ..., 'is_favorite': ..., 'remark': ...}, ...]}，
+    每条只带实际变化过的字段；
+  - emit_now(event, data)：不需要合并的事件（当前曲谱码、爬取进度等）立即发送；
+  - 所有经过总线的事件按事件名统计发送次数与负载字节数，metrics() 返回快照；
+  - 传入 targets（如 SubscriptionRegistry.targets）时，score_updates 按订阅拆分：
+    订阅全部的客户端在一个房间里收整批，只订阅部分曲谱码的客户端单独收与自己相关的那部分。
+
+start_task / sleep 传入 socketio.start_background_task / socketio.sleep，
+这样无论 threading 还是 eventlet / gevent 模式，延迟发送都跑在对应的并发模型里。
+"""
+
+import json
+import threading
+import time
+
+
+class BroadcastBus:
+    def __init__(self, emit, event='score_updates', window=0.2, start_task=None, sleep=None, targets=None):
+        self.emit = emit
+        self.event = event
+        self.targets = targets
+        self.window = window
+        self.start_task = start_task or (lambda target: threading.Thread(target=target, daemon=True).start())
+        self.sleep = sleep or time.sleep
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.scheduled = False
+        self.stats = {'published': 0, 'merged': 0, 'flushes': 0}
+        self.event_stats = {}
+
+    def publish(self, score_code, **fields):
+        """登记一个曲谱码的字段变化，窗口结束后与其他变化一起发出"""
+        with self.lock:
+            entry = self.pending.get(score_code)
+            if entry is None:
+                self.pending[score_code] = {'score_code': score_code, **fields}
+            else:
+                entry.update(fields)
+                self.stats['merged'] += 1
+            self.stats['published'] += 1
+            if self.scheduled:
+                return
+            self.scheduled = True
+        self.start_task(self._flush_later)
+
+    def publish_many(self, updates):
+        """批量登记：updates 为 [{'score_code': ..., 字段...}, ...]"""
+        for item in updates:
+            fields = dict(item)
+            self.publish(fields.pop('score_code'), **fields)
+
+    def _flush_later(self):
+        self.sleep(self.window)
+        self.flush()
+
+    def flush(self):
+        """立即发出待发送表中的全部变化，返回发出的条数"""
+        with self.lock:
+            updates = list(self.pending.values())
+            self.pending = {}
+            self.scheduled = False
+            if updates:
+                self.stats['flushes'] += 1
+        if not updates:
+            return 0
+        if self.targets is None:
+            self.emit_now(self.event, {'updates': updates})
+        else:
+            for to, subset in self.targets(updates):
+                self.emit_now(self.event, {'updates': subset}, to=to)
+        return len(updates)
+
+    def emit_now(self, event, data, to=None):
+        """立即发送；to 为房间名或客户端 sid，None 表示发给所有客户端"""
+        self._record(event, data)
+        if to is None:
+            self.emit(event, data)
+        else:
+            self.emit(event, data, to=to)
+
+    def _record(self, event, data):
+        size = len(json.dumps(data, ensure_ascii=False, default=str).encode('utf-8'))
+        with self.lock:
+            stats = self.event_stats.setdefault(event, {'emits': 0, 'bytes': 0, 'max_bytes': 0, 'last_bytes': 0})
+            stats['emits'] += 1
+            stats['bytes'] += size
+            stats['max_bytes'] = max(stats['max_bytes'], size)
+            stats['last_bytes'] = size
+
+    def metrics(self):
+        with self.lock:
+            events = {
+                event: {**stats, 'avg_bytes': round(stats['bytes'] / stats['emits'], 1) if stats['emits'] else 0}
+                for event, stats in self.event_stats.items()
+            }
+            return {**self.stats, 'pending': len(self.pending), 'window': self.window, 'events': events}
+
+
+class SubscriptionRegistry:
+    """
+    记录每个客户端订阅的曲谱码。codes 为 None（或超过 max_codes 个）表示订阅全部，
+    这些客户端加入 all_room，由调用方负责 join / leave 房间；空列表表示不接收谱子状态更新。
+    """
+
+    def __init__(self, all_room='scores:all', max_codes=2000):
+        self.all_room = all_room
+        self.max_codes = max_codes
+        self.lock = threading.Lock()
+        self.codes_by_sid = {}
+        self.sids_by_code = {}
+
+    def subscribe(self, sid, codes=None):
+        """替换 sid 的订阅，返回是否为订阅全部"""
+        subscribe_all = codes is None or len(codes) > self.max_codes
+        with self.lock:
+            self._remove(sid)
+            if not subscribe_all:
+                code_set = set(codes)
+                self.codes_by_sid[sid] = code_set
+                for code in code_set:
+                    self.sids_by_code.setdefault(code, set()).add(sid)
+        return subscribe_all
+
+    def unsubscribe(self, sid):
+        with self.lock:
+            self._remove(sid)
+
+    def _remove(self, sid):
+        for code in self.codes_by_sid.pop(sid, ()):
+            sids = self.sids_by_code.get(code)
+            if sids is not None:
+                sids.discard(sid)
+                if not sids:
+                    del self.sids_by_code[code]
+
+    def targets(self, updates):
+        """[(all_room, 全部变化), (sid, 该客户端订阅的那部分), ...]，没有相关变化的客户端不发送"""
+        per_sid = {}
+        with self.lock:
+            for update in updates:
+                for sid in self.sids_by_code.get(update['score_code'], ()):
+                    per_sid.setdefault(sid, []).append(update)
+        return [(self.all_room, updates)] + list(per_sid.items())
+
+    def stats(self):
+        with self.lock:
+            return {'code_subscribers': len(self.codes_by_sid), 'subscribed_codes': len(self.sids_by_code)}
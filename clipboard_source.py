@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+剪贴板变化来源
+
+  - WaylandClipboardSource：wl-paste --watch，剪贴板变化时由合成器通知，不需要轮询；
+  - X11ClipboardSource：XFixes SetSelectionOwnerNotify 事件（需要 python-xlib），收到通知后才读取一次剪贴板；
+  - PollingClipboardSource：其他平台的兜底方案，剪贴板长时间不变时逐步拉长轮询间隔，变化后恢复最短间隔；
+  - StubClipboardSource：测试用，push() 的内容直接当作剪贴板变化。
+
+所有来源都提供阻塞的 run(on_change, stop_event)，只对与上一次不同的非空文本回调 on_change(text)。
+create_clipboard_source('auto') 按平台挑选可用的事件驱动来源，都不可用时退回轮询。
+"""
+
+import os
+import queue
+import select
+import shutil
+import subprocess
+import sys
+import threading
+
+
+class ClipboardSource:
+    """剪贴板来源基类：子类实现 _watch，产生的文本经 _emit 去重后交给 on_change"""
+
+    name = 'base'
+
+    def __init__(self):
+        self.last_text = None
+        self.stats = {'events': 0, 'changes': 0}
+
+    def run(self, on_change, stop_event=None):
+        stop_event = stop_event or threading.Event()
+        self._watch(lambda text: self._emit(text, on_change), stop_event)
+
+    def _emit(self, text, on_change):
+        self.stats['events'] += 1
+        if not text or text == self.last_text:
+            return False
+        self.last_text = text
+        self.stats['changes'] += 1
+        on_change(text)
+        return True
+
+    def _watch(self, emit, stop_event):
+        raise NotImplementedError
+
+
+class PollingClipboardSource(ClipboardSource):
+    """
+    自适应轮询：每次没读到变化就把间隔乘以 backoff，最长 max_interval；读到变化立即恢复 min_interval。
+    读取失败按原来的规则重试：连续失败 max_retries 次后多等一会儿。
+    """
+
+    name = 'poll'
+
+    def __init__(self, paste, min_interval=0.25, max_interval=2.0, backoff=1.5,
+                 max_retries=3, retry_delay=1.0):
+        super().__init__()
+        self.paste = paste
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.interval = min_interval
+
+    def _watch(self, emit, stop_event):
+        retry_count = 0
+        while not stop_event.is_set():
+            try:
+                changed = emit(self.paste())
+                retry_count = 0
+            except Exception as e:
+                retry_count += 1
+                if retry_count >= self.max_retries:
+                    print(f"剪贴板监控错误: {e}，已达到最大重试次数")
+                    retry_count = 0
+                    stop_event.wait(self.retry_delay * 2)
+                else:
+                    print(f"剪贴板监控错误: {e}，正在重试 ({retry_count}/{self.max_retries})")
+                    stop_event.wait(self.retry_delay)
+                continue
+            if changed:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval * self.backoff, self.max_interval)
+            stop_event.wait(self.interval)
+
+
+class WaylandClipboardSource(ClipboardSource):
+    """
+    wl-paste --watch 在每次剪贴板变化时执行一次给定命令并把内容写到它的标准输入。
+    这里让命令原样输出内容再跟一个 NUL 作为分隔，一个常驻子进程即可收到全部变化。
+    """
+
+    name = 'wayland'
+    WATCH_COMMAND = ['wl-paste', '--type', 'text', '--watch', 'sh', '-c', 'cat; printf "\\0"']
+
+    def __init__(self, poll_interval=0.2):
+        super().__init__()
+        self.poll_interval = poll_interval
+
+    @staticmethod
+    def available():
+        return bool(os.environ.get('WAYLAND_DISPLAY')) and shutil.which('wl-paste') is not None
+
+    def _watch(self, emit, stop_event):
+        process = subprocess.Popen(self.WATCH_COMMAND, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        fd = process.stdout.fileno()
+        buffer = b''
+        try:
+            while not stop_event.is_set():
+                # 剪贴板不变时管道里没有数据，读取会一直阻塞；先等管道可读（最多 poll_interval 秒），保证能及时响应 stop_event
+                readable, _, _ = select.select([fd], [], [], self.poll_interval)
+                if not readable:
+                    continue
+                # 直接读文件描述符，避免数据留在 BufferedReader 的缓冲区里而 select 看不到
+                chunk = os.read(fd, 4096)
+                if not chunk:
+                    raise RuntimeError(f'wl-paste 已退出（返回码 {process.poll()}）')
+                buffer += chunk
+                *items, buffer = buffer.split(b'\0')
+                for item in items:
+                    emit(item.decode('utf-8', errors='replace'))
+        finally:
+            process.kill()
+            process.wait()
+
+
+class X11ClipboardSource(ClipboardSource):
+    """XFixes 的 SetSelectionOwnerNotify：CLIPBOARD 归属变化时才调用 paste 读取一次内容"""
+
+    name = 'x11'
+
+    def __init__(self, paste, poll_interval=0.2):
+        super().__init__()
+        self.paste = paste
+        self.poll_interval = poll_interval
+
+    @staticmethod
+    def available():
+        if not os.environ.get('DISPLAY'):
+            return False
+        try:
+            import Xlib.display  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def _watch(self, emit, stop_event):
+        from Xlib import display
+        from Xlib.ext import xfixes
+
+        disp = display.Display()
+        try:
+            if not disp.has_extension('XFIXES') or disp.query_extension('XFIXES') is None:
+                raise RuntimeError('X 服务器不支持 XFIXES 扩展')
+            disp.xfixes_query_version()
+            root = disp.screen().root
+            disp.xfixes_select_selection_input(root, disp.get_atom('CLIPBOARD'),
+                                               xfixes.XFixesSetSelectionOwnerNotifyMask)
+            emit(self.paste())
+            while not stop_event.is_set():
+                # next_event() 没有事件时会一直阻塞，先等连接可读（最多 poll_interval 秒）再取，保证能及时响应 stop_event
+                if not disp.pending_events():
+                    select.select([disp.fileno()], [], [], self.poll_interval)
+                    continue
+                event = disp.next_event()
+                # XFixes 的子事件以 (type, sub_code) 登记在 extension_event 上
+                if (event.type, getattr(event, 'sub_code', None)) == disp.extension_event.SetSelectionOwnerNotify:
+                    emit(self.paste())
+        finally:
+            disp.close()
+
+
+class StubClipboardSource(ClipboardSource):
+    """测试用：push(text) 模拟一次复制"""
+
+    name = 'stub'
+
+    def __init__(self):
+        super().__init__()
+        self.pending = queue.Queue()
+
+    def push(self, text):
+        self.pending.put(text)
+
+    def _watch(self, emit, stop_event):
+        while not stop_event.is_set():
+            try:
+                text = self.pending.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            emit(text)
+
+
+def create_clipboard_source(kind='auto', paste=None):
+    """
+    kind: auto / wayland / x11 / poll / stub。
+    auto 在 Linux 上依次尝试 Wayland、X11 的事件驱动来源，都不可用（或在其他平台）时使用自适应轮询。
+    """
+    if kind == 'stub':
+        return StubClipboardSource()
+    if kind == 'wayland':
+        return WaylandClipboardSource()
+    if kind == 'x11':
+        return X11ClipboardSource(paste)
+    if kind == 'auto' and sys.platform.startswith('linux'):
+        if WaylandClipboardSource.available():
+            return WaylandClipboardSource()
+        if X11ClipboardSource.available():
+            return X11ClipboardSource(paste)
+    if kind not in ('auto', 'poll'):
+        raise ValueError(f'未知的剪贴板来源: {kind}')
+    return PollingClipboardSource(paste)
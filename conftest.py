@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+pytest 公共夹具
+
+app 在导入时会在当前目录建库（scores.db / reviews.db）并启动后台任务，
+这里先切换到临时目录再导入，测试不会改动项目目录下的数据库和上传文件。
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+# 将项目目录添加到Python路径中
+project_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, project_root)
+
+TEST_WORKDIR = tempfile.mkdtemp(prefix='qinyin_test_')
+os.environ.setdefault('QINYIN_CLIPBOARD_SOURCE', 'stub')
+os.chdir(TEST_WORKDIR)
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    import app
+    app.app.config['TESTING'] = True
+    app.app.config['UPLOAD_FOLDER'] = os.path.join(TEST_WORKDIR, 'uploads', 'videos')
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
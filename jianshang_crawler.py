@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+"""
+鉴赏 API（musicugc second_page）并发爬虫引擎
+
+  - 线程池并发抓取，concurrency 控制同时在途的请求数；
+  - 令牌桶限速：平均每秒 rate 次，允许 burst 次突发；
+  - 429 / 5xx / 网络错误按指数退避（带抖动）重试，优先遵循 Retry-After；
+  - 收到不足 page_size 的短页后不再调度后续页，已在途的更靠后页面直接丢弃；
+  - 所有请求复用同一个带连接池的 requests.Session；
+  - base_url 可以指向本地 StubSecondPageServer，用录制的响应离线测试。
+
+命令行：
+  python jianshang_crawler.py --record recorded_pages      抓取真实接口并把每页响应录制到目录
+  python jianshang_crawler.py --serve recorded_pages       用录制的响应启动本地桩服务
+"""
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_API_URL = "https://act-hk4e-api.miyoushe.com/event/musicugc/v1/second_page"
+
+DEFAULT_API_PARAMS = {
+    "key": "Button_Jianshang",
+    "is_from_button": "true",
+    "page": 1,
+    "page_size": 30,
+    "lang": "zh-cn",
+    "game_biz": "hk4e_cn",
+    "is_mobile": "false",
+}
+
+DEFAULT_CONCURRENCY = 4     # 同时在途的请求数
+DEFAULT_RATE = 5.0          # 令牌桶：平均每秒请求数
+DEFAULT_MAX_RETRIES = 4     # 单页最多重试次数
+DEFAULT_BACKOFF_BASE = 0.5  # 退避基准（秒），第 n 次重试约等待 base * 2^n
+DEFAULT_BACKOFF_MAX = 8.0   # 单次退避上限（秒）
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class CrawlError(RuntimeError):
+    """单页在重试耗尽后仍失败，或接口返回了非 0 retcode"""
+
+
+class TokenBucket:
+    """线程安全的令牌桶，acquire() 阻塞到拿到令牌为止，返回等待的秒数"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+def create_pooled_session(pool_size=DEFAULT_CONCURRENCY):
+    """连接池大小与并发数一致的 Session，可在多次爬取之间复用"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max(1, int(pool_size)))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def extract_work_list(payload):
+    """second_page 响应中的作品列表：data.slide.work_list"""
+    data = (payload or {}).get("data") or {}
+    slide = data.get("slide") or {}
+    work_list = slide.get("work_list")
+    return work_list if isinstance(work_list, list) else []
+
+
+def make_second_page_payload(work_list):
+    """构造与真实接口结构一致的响应，供桩服务与测试使用"""
+    return {"retcode": 0, "message": "OK", "data": {"slide": {"work_list": list(work_list)}}}
+
+
+def project_work_fields(item):
+    """
+    把原始作品 JSON 中常用的字段挑出来（与 musicugc_all.csv 的列一致），
+    供导出 CSV 与写入 works 表使用。
+    """
+    user = item.get("user") or {}
+    game = item.get("game_data") or {}
+    interact = item.get("interact_data") or {}
+    return {
+        "work_id": item.get("work_id"),
+        "share_code": item.get("share_code"),
+        "title": item.get("title"),
+        "desc": item.get("describe"),
+        "cover_url": item.get("cover_url"),
+        "region": item.get("region"),
+        "music_id": item.get("music_id") or game.get("music_id"),
+        "note_count": item.get("node_count") or game.get("note_count"),
+        "nickname": user.get("nickname"),
+        "uid": user.get("uid"),
+        "like_cnt": interact.get("like_cnt"),
+        "save_cnt": interact.get("save_cnt"),
+        "game_like_cnt": interact.get("game_like_cnt"),
+        "publish_time": game.get("publish_time"),
+        "hot_score": item.get("hot_score"),
+        "quality_score": item.get("quality_score"),
+        "video_json": item.get("video_media_info"),  # 原始字符串，里面有多清晰度播放地址
+    }
+
+
+def parse_video_media_info(raw):
+    """
+    解析 video_media_info（字符串或已解析的字典），只保留界面需要的字段：
+    返回 (duration_ms, [{height, width, url, size, bitrate}, ...])，每个高度只保留码率最高的一条，按高度升序。
+    无法解析时返回 (None, None)，没有任何清晰度时返回 (duration_ms, [])。
+    """
+    if not raw:
+        return None, None
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except ValueError:
+            return None, None
+    if not isinstance(raw, dict):
+        return None, None
+
+    best = {}
+    for res in raw.get("resolutions") or []:
+        if not isinstance(res, dict):
+            continue
+        url = res.get("url") or res.get("origin_url")
+        height = res.get("height")
+        if not url or not isinstance(height, int):
+            continue
+        current = best.get(height)
+        if current is None or (res.get("bitrate") or 0) > (current["bitrate"] or 0):
+            best[height] = {
+                "height": height,
+                "width": res.get("width"),
+                "url": url,
+                "size": res.get("size"),
+                "bitrate": res.get("bitrate"),
+            }
+    duration = raw.get("duration")
+    return (duration if isinstance(duration, int) else None), [best[h] for h in sorted(best)]
+
+
+class JianshangCrawler:
+    """
+    并发爬取鉴赏列表。crawl() 按页码顺序返回 [(page, work_list), ...]，
+    on_page(page, work_list) 会按页码顺序回调，返回 True 表示到此为止。
+    """
+
+    def __init__(self, base_url=DEFAULT_API_URL, params=None, headers=None,
+                 concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_RATE, burst=None,
+                 max_retries=DEFAULT_MAX_RETRIES, backoff_base=DEFAULT_BACKOFF_BASE,
+                 backoff_max=DEFAULT_BACKOFF_MAX, timeout=12, proxies=None,
+                 session=None, extract=extract_work_list, record_dir=None):
+        self.base_url = base_url
+        self.params = dict(DEFAULT_API_PARAMS if params is None else params)
+        self.headers = dict(headers or {})
+        self.concurrency = max(1, int(concurrency))
+        self.bucket = TokenBucket(rate, burst if burst is not None else self.concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.proxies = proxies
+        self.session = session or create_pooled_session(self.concurrency)
+        self.extract = extract
+        self.record_dir = record_dir
+        self.last_error = None
+        self._stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'retries': 0, 'pages': 0, 'throttle_wait': 0.0}
+
+    @property
+    def page_size(self):
+        return int(self.params.get("page_size") or DEFAULT_API_PARAMS["page_size"])
+
+    def _count(self, key, value=1):
+        with self._stats_lock:
+            self.stats[key] += value
+
+    def _backoff_delay(self, attempt, resp=None):
+        retry_after = resp.headers.get('Retry-After') if resp is not None else None
+        if retry_after:
+            try:
+                return min(self.backoff_max, max(0.0, float(retry_after)))
+            except ValueError:
+                pass
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * (0.5 + random.random() / 2)
+
+    def _record(self, page, payload):
+        if not self.record_dir:
+            return
+        os.makedirs(self.record_dir, exist_ok=True)
+        path = os.path.join(self.record_dir, f'page_{page:04d}.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False)
+
+    def fetch_page(self, page):
+        """获取单页响应；429/5xx/网络错误重试，其余错误直接抛出"""
+        params = dict(self.params, page=page)
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            self._count('throttle_wait', self.bucket.acquire())
+            self._count('requests')
+            resp = None
+            try:
+                resp = self.session.get(
+                    self.base_url,
+                    params=params,
+                    headers=self.headers,
+                    timeout=self.timeout,
+                    proxies=self.proxies,
+                )
+                if resp.status_code in RETRY_STATUS_CODES:
+                    last_error = CrawlError(f"HTTP {resp.status_code}")
+                else:
+                    resp.raise_for_status()
+                    data = resp.json()
+                    if data.get("retcode") != 0:
+                        raise CrawlError(f"API返回错误: retcode={data.get('retcode')}, message={data.get('message')}")
+                    self._record(page, data)
+                    self._count('pages')
+                    return data
+            except (requests.ConnectionError, requests.Timeout) as e:
+                last_error = e
+            if attempt >= self.max_retries:
+                break
+            delay = self._backoff_delay(attempt, resp)
+            print(f"第{page}页请求失败（{last_error}），{delay:.1f}s 后重试 ({attempt + 1}/{self.max_retries})")
+            self._count('retries')
+            time.sleep(delay)
+        raise CrawlError(f"获取第{page}页失败: {last_error}")
+
+    def crawl(self, max_pages=50, start_page=1, on_page=None):
+        """
+        从 start_page 起最多抓取 max_pages 页。
+        遇到短页、失败页或 on_page 要求停止时，只保留该页（失败页不含）之前的连续页面。
+        """
+        self.last_error = None
+        last_page = start_page + max_pages - 1
+        stop_at = last_page
+        next_page = start_page
+        next_emit = start_page
+        ready = {}
+        collected = []
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='JianshangCrawler') as pool:
+            in_flight = {}
+
+            def schedule():
+                nonlocal next_page
+                while len(in_flight) < self.concurrency and next_page <= stop_at:
+                    in_flight[pool.submit(self.fetch_page, next_page)] = next_page
+                    next_page += 1
+
+            schedule()
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    page = in_flight.pop(future)
+                    if page > stop_at:
+                        continue
+                    try:
+                        work_list = self.extract(future.result())
+                    except Exception as e:
+                        print(f"获取第{page}页失败，停止爬取: {e}")
+                        self.last_error = e
+                        stop_at = min(stop_at, page - 1)
+                        continue
+                    ready[page] = work_list
+                    if len(work_list) < self.page_size:
+                        print(f"第{page}页数据不足，停止爬取")
+                        stop_at = min(stop_at, page)
+
+                # 按页码顺序交付，保证回调与结果有序
+                while next_emit in ready and next_emit <= stop_at:
+                    work_list = ready.pop(next_emit)
+                    collected.append((next_emit, work_list))
+                    if on_page and on_page(next_emit, work_list):
+                        stop_at = min(stop_at, next_emit)
+                    next_emit += 1
+
+                # 超出停止页的在途请求不再等待结果
+                for future, page in list(in_flight.items()):
+                    if page > stop_at and future.cancel():
+                        in_flight.pop(future)
+                schedule()
+
+        return collected
+
+
+# ========== 本地桩服务 ==========
+
+class StubSecondPageServer:
+    """
+    本地 second_page 桩服务，按 page 参数返回录制的响应。
+      - pages: {页码: 响应 dict}，未录制的页码返回空 work_list；
+      - fail_plan: {页码: [状态码, ...]}，该页前几次请求依次返回这些状态码，之后正常返回；
+      - delay: 每次响应前的人为延迟（秒），用于观察并发效果。
+    request_log 记录收到的页码，max_in_flight 记录观察到的最大并发数。
+    """
+
+    def __init__(self, pages, host='127.0.0.1', port=0, fail_plan=None, delay=0.0):
+        self.pages = dict(pages)
+        self.fail_plan = {page: list(codes) for page, codes in (fail_plan or {}).items()}
+        self.delay = delay
+        self.request_log = []
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @classmethod
+    def from_directory(cls, record_dir, **kwargs):
+        """读取 --record 录制的 page_XXXX.json"""
+        pages = {}
+        for name in sorted(os.listdir(record_dir)):
+            if name.startswith('page_') and name.endswith('.json'):
+                with open(os.path.join(record_dir, name), 'r', encoding='utf-8') as f:
+                    pages[int(name[5:-5])] = json.load(f)
+        return cls(pages, **kwargs)
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/event/musicugc/v1/second_page"
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                try:
+                    page = int((query.get('page') or ['1'])[0])
+                except ValueError:
+                    page = 1
+                with server._lock:
+                    server.request_log.append(page)
+                    server._in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server._in_flight)
+                    planned = server.fail_plan.get(page)
+                    status = planned.pop(0) if planned else 200
+                try:
+                    if server.delay:
+                        time.sleep(server.delay)
+                    if status != 200:
+                        body = json.dumps({'retcode': -1, 'message': f'stub {status}'}).encode('utf-8')
+                    else:
+                        payload = server.pages.get(page) or make_second_page_payload([])
+                        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    if status == 429:
+                        self.send_header('Retry-After', '0')
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with server._lock:
+                        server._in_flight -= 1
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True, name="StubSecondPage")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='鉴赏 API 并发爬虫 / 本地桩服务')
+    parser.add_argument('--record', metavar='DIR', help='抓取真实接口并把每页响应录制到 DIR')
+    parser.add_argument('--serve', metavar='DIR', help='用 DIR 中录制的响应启动本地桩服务')
+    parser.add_argument('--port', type=int, default=8765, help='桩服务端口')
+    parser.add_argument('--max-pages', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE)
+    args = parser.parse_args()
+
+    if args.serve:
+        server = StubSecondPageServer.from_directory(args.serve, port=args.port).start()
+        print(f"桩服务已启动: {server.url}（共 {len(server.pages)} 页），Ctrl+C 退出")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            server.stop()
+        return
+
+    crawler = JianshangCrawler(concurrency=args.concurrency, rate=args.rate, record_dir=args.record)
+    start = time.perf_counter()
+    pages = crawler.crawl(max_pages=args.max_pages)
+    total = sum(len(work_list) for _, work_list in pages)
+    print(f"共 {len(pages)} 页 {total} 条，用时 {time.perf_counter() - start:.1f}s，统计: {crawler.stats}")
+
+
+if __name__ == '__main__':
+    main()
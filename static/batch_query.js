@@ -15,7 +15,10 @@ document.addEventListener('DOMContentLoaded', () => {
     const scoreCodesTextarea = document.getElementById('scoreCodes');
     const resultsBody = document.getElementById('resultsBody');
     const showIncompleteOnlyCheckbox = document.getElementById('showIncompleteOnly');
+    const rankBySelect = document.getElementById('rankBySelect');
+    const rankTopNInput = document.getElementById('rankTopN');
     const fetchJianshangBtn = document.getElementById('fetchJianshangBtn');
+    const fullCrawlCheckbox = document.getElementById('fullCrawlCheckbox');
     console.log('获取到按钮元素:', fetchJianshangBtn);
     if (fetchJianshangBtn) {
         console.log('按钮当前文本:', fetchJianshangBtn.textContent);
@@ -92,7 +95,9 @@ document.addEventListener('DOMContentLoaded', () => {
             scoreCodesTextarea.value.trim() ||
             excludeCodesTextarea.value.trim() ||
             (includeRemarkInput && includeRemarkInput.value.trim()) ||
-            (excludeRemarkInput && excludeRemarkInput.value.trim())
+            (excludeRemarkInput && excludeRemarkInput.value.trim()) ||
+            (rankBySelect && rankBySelect.value) ||
+            (rankTopNInput && rankTopNInput.value)
         );
     }
 
@@ -113,8 +118,10 @@ document.addEventListener('DOMContentLoaded', () => {
         const includeRemarkRaw = includeRemarkInput ? includeRemarkInput.value.trim() : '';
         const excludeRemarkRaw = excludeRemarkInput ? excludeRemarkInput.value.trim() : '';
         const hasRemarkFilter = includeRemarkRaw.length > 0 || excludeRemarkRaw.length > 0;
-        // 只要有曲谱码、排除或备注筛选，就使用批量接口
-        if (codes.length > 0 || excludeCodes.length > 0 || hasRemarkFilter) {
+        const rankBy = rankBySelect ? rankBySelect.value : '';
+        const topN = rankTopNInput && rankTopNInput.value ? parseInt(rankTopNInput.value, 10) : null;
+        // 只要有曲谱码、排除、备注筛选或排序，就使用批量接口（排序和前 N 个由后端完成）
+        if (codes.length > 0 || excludeCodes.length > 0 || hasRemarkFilter || rankBy || topN) {
             fetch('/api/scores/batch', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
@@ -125,7 +132,11 @@ document.addEventListener('DOMContentLoaded', () => {
                     max_completion: currentFilters.maxCompletion,
                     favorite: currentFilters.favorite,
                     include_remark: includeRemarkRaw,
-                    exclude_remark: excludeRemarkRaw
+                    exclude_remark: excludeRemarkRaw,
+                    // 排序时“仅显示未完成”交给后端，保证前 N 个都是未完成的
+                    uncompleted: rankBy && showIncompleteOnlyCheckbox.checked ? 1 : 0,
+                    rank_by: rankBy || null,
+                    top_n: topN
                 })
             })
             .then(response => response.json())
@@ -264,8 +275,22 @@ document.addEventListener('DOMContentLoaded', () => {
             });
     }
 
+    // 订阅谱子状态更新：按曲谱码查询时只订阅这些码，否则（全部列表、仅按备注等筛选）接收全部变化
+    const SUBSCRIBE_MAX_CODES = 2000;
+    function subscribeVisibleCodes() {
+        const rawScoreCodes = scoreCodesTextarea.value.trim();
+        const codes = hasCustomQuery() && rawScoreCodes ? extractScoreCodes(rawScoreCodes) : [];
+        const payload = { page: 'batch' };
+        if (codes.length > 0 && codes.length <= SUBSCRIBE_MAX_CODES) {
+            payload.codes = codes;
+        }
+        socket.emit('subscribe', payload);
+    }
+    socket.on('connect', subscribeVisibleCodes);
+
     // 显示结果
     function displayResults(results) {
+        subscribeVisibleCodes();
         const safeResults = Array.isArray(results) ? results : [];
         currentResults = safeResults.map(item => ({
             ...item,
@@ -507,6 +532,9 @@ document.addEventListener('DOMContentLoaded', () => {
 
             const codeCell = document.createElement('td');
             codeCell.textContent = result.score_code;
+            if (result.title) {
+                codeCell.title = result.author ? `${result.title} · ${result.author}` : result.title;
+            }
             row.appendChild(codeCell);
 
             if (!hideCompletionCheckbox.checked) {
@@ -646,28 +674,28 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // 添加复选框变化事件监听
     showIncompleteOnlyCheckbox.addEventListener('change', filterAndDisplayResults);
+    rankBySelect?.addEventListener('change', loadData);
     hideCompletionCheckbox.addEventListener('change', filterAndDisplayResults);
     hideFavoriteCheckbox.addEventListener('change', filterAndDisplayResults);
     showAllRemarksCheckbox?.addEventListener('change', filterAndDisplayResults);
 
-    // 剪贴板更新（来自主页的完成率保存）
-    socket.on('clipboard_update', function(data) {
-        // 只有当类型是 'completion' 并且有 score_code 时才触发更新
-        if (data.type === 'completion' && data.score_code) {
+    // 谱子状态批量更新：备注直接改本地结果；完成率 / 收藏会影响筛选和排序，整批只重新查询一次
+    socket.on('score_updates', function(data) {
+        const updates = (data && Array.isArray(data.updates)) ? data.updates : [];
+        let needReload = false;
+        let remarkChanged = false;
+        updates.forEach(update => {
+            if (!update || !update.score_code) return;
+            if ('completion' in update || 'is_favorite' in update) {
+                needReload = true;
+            }
+            if ('remark' in update && updateRemarkInResults(update.score_code, update.remark || '')) {
+                remarkChanged = true;
+            }
+        });
+        if (needReload) {
             loadData();
-        }
-    });
-
-    // 收藏状态更新
-    socket.on('favorite_update', function(data) {
-        // 重新查询以反映收藏状态的变化
-        loadData();
-    });
-
-    socket.on('remark_update', function(data) {
-        if (!data || !data.score_code) return;
-        const changed = updateRemarkInResults(data.score_code, data.remark || '');
-        if (changed) {
+        } else if (remarkChanged) {
             filterAndDisplayResults();
         }
     });
@@ -871,29 +899,82 @@ document.addEventListener('DOMContentLoaded', () => {
         try {
             fetchJianshangBtn.disabled = true; // 临时禁用，防止重复点击
             fetchJianshangBtn.textContent = '正在获取...';
-            
-            const response = await fetch('/api/fetch_jianshang');
+
+            // 启动（或复用）后台爬取任务，结果通过 socket 逐页推送；默认增量，勾选“全量”时从头爬
+            const response = await fetch('/api/fetch_jianshang/jobs', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ full: Boolean(fullCrawlCheckbox && fullCrawlCheckbox.checked) })
+            });
             const data = await response.json();
-            
-            if (data.success) {
-                displayResults(data.results);
-                // 更新输入框
-                scoreCodesTextarea.value = data.results.map(r => r.score_code).join('\n');
-                // 将按钮文本更改为"新鉴赏码"
-                fetchJianshangBtn.textContent = '新鉴赏码';
-                console.log('按钮文本已更改为: 新鉴赏码');
-                const filename = data.filename || '未知文件';
-                const extractedCount = data.extracted_count || 0;
-                showToast(`成功获取 ${extractedCount} 个曲谱码。文件：${filename}`);
-            } else {
+            if (!data.success) {
                 showToast('获取鉴赏谱失败：' + data.error);
+                fetchJianshangBtn.disabled = false;
+                fetchJianshangBtn.textContent = '获取鉴赏谱';
+                return;
+            }
+            jianshangJobId = data.job_id;
+            jianshangJobResults = [];
+            displayResults([]);
+            // 补齐拿到 job_id 之前已推送的页面（复用任务时尤其常见）
+            const statusResp = await fetch(`/api/fetch_jianshang/jobs/${data.job_id}`);
+            const statusData = await statusResp.json();
+            if (statusData.success) {
+                appendJianshangResults(statusData.job.results);
+                if (statusData.job.status !== 'running') {
+                    finishJianshangJob(statusData.job);
+                }
             }
         } catch (error) {
             showToast('获取鉴赏谱时发生错误：' + error.message);
-        } finally {
-            // 恢复按钮可点击状态
             fetchJianshangBtn.disabled = false;
+            fetchJianshangBtn.textContent = '获取鉴赏谱';
+        }
+    });
+
+    // —— 鉴赏码爬取进度（后台任务逐页推送） ——
+    let jianshangJobId = null;
+    let jianshangJobResults = [];
+
+    function appendJianshangResults(results) {
+        const known = new Set(jianshangJobResults.map(item => item.score_code));
+        (results || []).forEach(item => {
+            if (item && !known.has(item.score_code)) {
+                known.add(item.score_code);
+                jianshangJobResults.push(item);
+            }
+        });
+        displayResults(jianshangJobResults);
+        scoreCodesTextarea.value = jianshangJobResults.map(r => r.score_code).join('\n');
+    }
+
+    function finishJianshangJob(job) {
+        if (!jianshangJobId || job.job_id !== jianshangJobId) return;
+        jianshangJobId = null;
+        fetchJianshangBtn.disabled = false;
+        if (job.status === 'done') {
+            // 将按钮文本更改为"新鉴赏码"
+            fetchJianshangBtn.textContent = '新鉴赏码';
+            console.log('按钮文本已更改为: 新鉴赏码');
+            const filename = job.filename || '未知文件';
+            const extractedCount = job.extracted_count || 0;
+            const newCount = job.new_count || 0;
+            showToast(`成功获取 ${extractedCount} 个曲谱码（新作品 ${newCount} 个）。文件：${filename}`);
+        } else {
+            fetchJianshangBtn.textContent = '获取鉴赏谱';
+            showToast('获取鉴赏谱失败：' + (job.error || '未知错误'));
         }
+    }
+
+    socket.on('jianshang_crawl_page', function(data) {
+        if (!data || data.job_id !== jianshangJobId) return;
+        appendJianshangResults(data.results);
+        fetchJianshangBtn.textContent = `正在获取...（第${data.page}页，${data.total}个）`;
+    });
+
+    socket.on('jianshang_crawl_done', function(data) {
+        if (!data) return;
+        finishJianshangJob(data);
     });
 
     // Chrome初始化状态监听已移除（不再需要浏览器初始化）
@@ -198,8 +198,13 @@
 
       this.createReviewFn(fd)
         .then((data) => {
-          this.setMessage('保存成功！');
-          this.toast('评价已保存');
+          if (data && data.video_status === 'processing') {
+            this.setMessage('保存成功！视频较大，正在后台压缩');
+            this.toast('评价已保存，视频压缩完成后会自动替换');
+          } else {
+            this.setMessage('保存成功！');
+            this.toast('评价已保存');
+          }
           if (typeof this.onSaved === 'function') {
             try {
               this.onSaved(data);
@@ -244,7 +249,9 @@
 
     renderViewMode(data) {
       this.mode = 'view';
-      if (this.reviewTitle) this.reviewTitle.textContent = '查看评价';
+      if (this.reviewTitle) {
+        this.reviewTitle.textContent = data.video_status === 'processing' ? '查看评价（视频处理中）' : '查看评价';
+      }
       this.reviewVideoSourceField && (this.reviewVideoSourceField.style.display = 'none');
       this.reviewFileRow && (this.reviewFileRow.style.display = 'none');
       this.reviewUrlRow && (this.reviewUrlRow.style.display = 'none');
@@ -6,6 +6,8 @@ document.addEventListener('DOMContentLoaded', () => {
     }
     
     const socket = io();
+    // 订阅主页房间：当前曲谱码，以及全部谱子状态更新（历史记录里可能出现任意曲谱码）
+    socket.on('connect', () => socket.emit('subscribe', { page: 'index' }));
     const sanitizeTooltip = (text) => (text || '').toString().replace(/\s+/g, ' ').trim();
     const escapeHtml = (str = '') => str
         .toString()
@@ -36,12 +38,14 @@ document.addEventListener('DOMContentLoaded', () => {
     let showFavoritesOnly = false;  // 显示收藏的标志
     let showScoreCodeOnly = false;  // 仅显示曲谱码的标志
     const HISTORY_CHUNK_SIZE = 40;
-    const HISTORY_RENDER_LIMIT = 400;
+    const HISTORY_PAGE_SIZE = 100;  // 每次向后端请求的历史记录条数
     let historyDataCache = [];
-    let historyRenderLimit = HISTORY_RENDER_LIMIT;
+    let historyNextCursor = null;
+    let historyLoadingMore = false;
     let historyRenderToken = 0;
     let historyRenderRaf = null;
     let historyFetchController = null;
+    let historySentinelObserver = null;
     
     // 创建统计信息显示元素
     const statsDiv = document.createElement('div');
@@ -61,15 +65,14 @@ document.addEventListener('DOMContentLoaded', () => {
     document.getElementById('filterBtn').addEventListener('click', function() {
         showFavoritesOnly = !showFavoritesOnly;
         this.textContent = showFavoritesOnly ? '显示所有' : '仅显示收藏';
-        historyRenderLimit = HISTORY_RENDER_LIMIT;
-        renderHistoryFromCache({ preserveScroll: true });
+        // 收藏筛选交给后端，分页游标随之重置
+        refreshHistory();
     });
 
     // 曲谱码过滤按钮点击事件
     document.getElementById('scoreCodeFilterBtn').addEventListener('click', function() {
         showScoreCodeOnly = !showScoreCodeOnly;
         this.textContent = showScoreCodeOnly ? '显示完整信息' : '仅显示曲谱码';
-        historyRenderLimit = HISTORY_RENDER_LIMIT;
         renderHistoryFromCache({ preserveScroll: true });
     });
 
@@ -250,15 +253,6 @@ document.addEventListener('DOMContentLoaded', () => {
                 statusBox.className = 'status-box not-exists';
                 favoriteBtn.textContent = '☆';  // 新曲谱码时重置为未收藏状态
             }
-        } else if (data.type === 'completion') {
-            document.getElementById('currentStatus').textContent = '已完成';
-            document.getElementById('currentCompletion').textContent = data.completion + '%';
-            completionInput.value = data.completion;
-            messageDisplay.textContent = data.message;
-            saveBtn.disabled = true;
-            ensureRecordAtTop(data.score_code, { completion: data.completion });
-            renderHistoryFromCache();
-            updateStats();
         }
     });
 
@@ -330,28 +324,56 @@ document.addEventListener('DOMContentLoaded', () => {
         autoSave();
     });
 
-    // 更新收藏状态
-    socket.on('favorite_update', function(data) {
-        if (data.score_code === currentScoreCode) {
-            favoriteBtn.textContent = data.is_favorite ? '★' : '☆';
-        }
-        // 更新历史记录中的收藏状态
-        updateHistoryFavorite(data.score_code, data.is_favorite);
-        updateStats();
-    });
-
-    socket.on('remark_update', function(data) {
-        if (!data || !data.score_code) return;
-        if (data.score_code === currentScoreCode) {
-            currentRemark = data.remark || '';
-            if (remarkTextarea && remarkModal && remarkModal.classList.contains('is-open')) {
-                remarkTextarea.value = currentRemark;
+    // 谱子状态批量更新：服务端把短时间内的完成率 / 收藏 / 备注变化合并成一个事件，
+    // 每条只带变化过的字段，全部应用后再统一重绘一次
+    socket.on('score_updates', function(data) {
+        const updates = (data && Array.isArray(data.updates)) ? data.updates : [];
+        let completionChanged = false;
+        let favoriteChanged = false;
+        let missingRemark = false;
+        updates.forEach(update => {
+            if (!update || !update.score_code) return;
+            const isCurrent = update.score_code === currentScoreCode;
+            if ('completion' in update) {
+                if (isCurrent) {
+                    document.getElementById('currentStatus').textContent = '已完成';
+                    document.getElementById('currentCompletion').textContent = update.completion + '%';
+                    completionInput.value = update.completion;
+                    messageDisplay.textContent = '保存成功';
+                    saveBtn.disabled = true;
+                }
+                ensureRecordAtTop(update.score_code, { completion: update.completion });
+                completionChanged = true;
             }
-            updateRemarkButtonState();
-            renderCurrentRemark(currentRemark);
+            if ('is_favorite' in update) {
+                if (isCurrent) {
+                    favoriteBtn.textContent = update.is_favorite ? '★' : '☆';
+                }
+                // 更新历史记录中的收藏状态
+                updateHistoryFavorite(update.score_code, update.is_favorite);
+                favoriteChanged = true;
+            }
+            if ('remark' in update) {
+                if (isCurrent) {
+                    currentRemark = update.remark || '';
+                    if (remarkTextarea && remarkModal && remarkModal.classList.contains('is-open')) {
+                        remarkTextarea.value = currentRemark;
+                    }
+                    updateRemarkButtonState();
+                    renderCurrentRemark(currentRemark);
+                }
+                if (!updateHistoryRemark(update.score_code, update.remark || '')) {
+                    missingRemark = true;
+                }
+            }
+        });
+        if (completionChanged) {
+            renderHistoryFromCache();
         }
-        const updated = updateHistoryRemark(data.score_code, data.remark || '');
-        if (!updated) {
+        if (completionChanged || favoriteChanged) {
+            updateStats();
+        }
+        if (missingRemark) {
             refreshHistory();
         }
     });
@@ -454,6 +476,9 @@ document.addEventListener('DOMContentLoaded', () => {
         const remarkSection = score.remark
             ? `<div class="history-remark">${escapeHtml(score.remark)}</div>`
             : '';
+        const titleSection = score.title
+            ? `<div class="history-title">${escapeHtml(score.title)}${score.author ? ` · ${escapeHtml(score.author)}` : ''}</div>`
+            : '';
         const completionText = (typeof score.completion === 'number' && !Number.isNaN(score.completion))
             ? `${score.completion}%`
             : '-';
@@ -462,6 +487,7 @@ document.addEventListener('DOMContentLoaded', () => {
         item.innerHTML = `
             <div class="history-content">
                 <div>曲谱码：<span class="score-code">${score.score_code}</span></div>
+                ${titleSection}
                 <div>完成率：<span class="completion">${completionText}</span></div>
                 ${remarkSection}
                 <div class="timestamp">${dateText}</div>
@@ -481,17 +507,18 @@ document.addEventListener('DOMContentLoaded', () => {
         const previousScrollTop = preserveScroll ? historyList.scrollTop : 0;
         const filtered = historyDataCache.filter(score => !showFavoritesOnly || score.is_favorite);
         historyList.setAttribute('aria-busy', 'true');
+        disconnectHistorySentinel();
 
         if (!filtered.length) {
             historyList.innerHTML = '<div class="history-empty">暂无记录</div>';
             historyList.removeAttribute('aria-busy');
+            if (historyNextCursor) {
+                appendHistorySentinel();
+            }
             return;
         }
 
-        const finiteLimit = Number.isFinite(historyRenderLimit) ? historyRenderLimit : filtered.length;
-        const limited = filtered.slice(0, finiteLimit);
-        const hasMore = Number.isFinite(historyRenderLimit) && filtered.length > historyRenderLimit;
-
+        const limited = filtered;
         const token = ++historyRenderToken;
         let index = 0;
         historyList.innerHTML = '';
@@ -513,8 +540,8 @@ document.addEventListener('DOMContentLoaded', () => {
                 if (preserveScroll) {
                     historyList.scrollTop = previousScrollTop;
                 }
-                if (hasMore) {
-                    appendHistoryOverflow(filtered.length);
+                if (historyNextCursor) {
+                    appendHistorySentinel();
                 }
                 historyList.removeAttribute('aria-busy');
             }
@@ -523,19 +550,32 @@ document.addEventListener('DOMContentLoaded', () => {
         historyRenderRaf = requestAnimationFrame(renderChunk);
     }
 
+    function buildHistoryPageUrl(cursor) {
+        const params = new URLSearchParams();
+        params.append('limit', HISTORY_PAGE_SIZE);
+        if (showFavoritesOnly) {
+            params.append('favorite', 1);
+        }
+        if (cursor) {
+            params.append('cursor', cursor);
+        }
+        return `/api/scores?${params.toString()}`;
+    }
+
     async function refreshHistory() {
         if (!historyList) return;
         if (historyFetchController) {
             historyFetchController.abort();
         }
         historyFetchController = new AbortController();
+        historyLoadingMore = false;
         const { signal } = historyFetchController;
         try {
-            const response = await fetch('/api/scores', { signal });
-            const scores = await response.json();
+            const response = await fetch(buildHistoryPageUrl(null), { signal });
+            const page = await response.json();
             if (signal.aborted) return;
-            historyDataCache = Array.isArray(scores) ? scores : [];
-            historyRenderLimit = HISTORY_RENDER_LIMIT;
+            historyDataCache = Array.isArray(page.results) ? page.results : [];
+            historyNextCursor = page.next_cursor || null;
             renderHistoryFromCache();
         } catch (error) {
             if (error.name === 'AbortError') {
@@ -547,24 +587,78 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    function appendHistoryOverflow(total) {
+    // 滚动到底部时按游标加载下一页，只追加新节点
+    async function loadMoreHistory() {
+        if (!historyList || !historyNextCursor || historyLoadingMore) return;
+        historyLoadingMore = true;
+        const controller = historyFetchController;
+        const signal = controller ? controller.signal : undefined;
+        try {
+            const response = await fetch(buildHistoryPageUrl(historyNextCursor), { signal });
+            const page = await response.json();
+            if ((signal && signal.aborted) || controller !== historyFetchController) return;
+            const known = new Set(historyDataCache.map(item => item.score_code));
+            const fresh = (Array.isArray(page.results) ? page.results : [])
+                .filter(item => !known.has(item.score_code));
+            historyDataCache = historyDataCache.concat(fresh);
+            historyNextCursor = page.next_cursor || null;
+            disconnectHistorySentinel();
+            const emptyNode = historyList.querySelector('.history-empty');
+            if (emptyNode && fresh.length) {
+                emptyNode.remove();
+            }
+            const fragment = document.createDocumentFragment();
+            fresh
+                .filter(score => !showFavoritesOnly || score.is_favorite)
+                .forEach(score => fragment.appendChild(buildHistoryItem(score)));
+            historyList.appendChild(fragment);
+            if (historyNextCursor) {
+                appendHistorySentinel();
+            }
+        } catch (error) {
+            if (error.name !== 'AbortError') {
+                console.error('加载更多历史记录失败:', error);
+            }
+        } finally {
+            if (controller === historyFetchController) {
+                historyLoadingMore = false;
+            }
+        }
+    }
+
+    function disconnectHistorySentinel() {
+        if (historySentinelObserver) {
+            historySentinelObserver.disconnect();
+            historySentinelObserver = null;
+        }
+        const existing = historyList ? historyList.querySelector('.history-load-more') : null;
+        if (existing) {
+            existing.remove();
+        }
+    }
+
+    function appendHistorySentinel() {
         const container = document.createElement('div');
         container.className = 'history-load-more';
         const info = document.createElement('div');
         info.className = 'history-load-more__info';
-        const limitText = Number.isFinite(historyRenderLimit) ? historyRenderLimit : total;
-        info.textContent = `已显示最新 ${limitText} 条 / 共 ${total} 条`;
+        info.textContent = `已加载 ${historyDataCache.length} 条，继续下滑加载更多`;
         const btn = document.createElement('button');
         btn.type = 'button';
         btn.className = 'history-load-more__btn';
-        btn.textContent = '加载全部';
-        btn.addEventListener('click', () => {
-            historyRenderLimit = Infinity;
-            renderHistoryFromCache();
-        }, { once: true });
+        btn.textContent = '加载更多';
+        btn.addEventListener('click', loadMoreHistory);
         container.appendChild(info);
         container.appendChild(btn);
         historyList.appendChild(container);
+        if ('IntersectionObserver' in window) {
+            historySentinelObserver = new IntersectionObserver((entries) => {
+                if (entries.some(entry => entry.isIntersecting)) {
+                    loadMoreHistory();
+                }
+            }, { rootMargin: '300px 0px' });
+            historySentinelObserver.observe(container);
+        }
     }
 
     function updateHistoryFavorite(scoreCode, isFavorite) {
@@ -671,6 +765,8 @@ function initReviewModal() {
 
   const socket = window.io?.();
   if (socket) {
+    // 这个连接只关心当前曲谱码，不接收谱子状态更新
+    socket.on('connect', () => socket.emit('subscribe', { page: 'index', codes: [] }));
     socket.on('clipboard_update', (data) => {
       if (data?.type === 'score_code' && data?.score_code) {
         currentScoreCode = data.score_code;
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+广播总线测试脚本（不启动 Socket.IO，记录 emit 调用）
+"""
+
+import os
+import sys
+import time
+
+# 将项目目录添加到Python路径中
+project_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, project_root)
+
+from broadcast_bus import BroadcastBus
+
+
+def make_bus(window=0.05):
+    sent = []
+    bus = BroadcastBus(lambda event, data: sent.append((event, data)), window=window)
+    return bus, sent
+
+
+def test_coalesce():
+    print("\n窗口内合并")
+    bus, sent = make_bus()
+    bus.publish_many([{'score_code': str(10000 + i), 'remark': '练习'} for i in range(1000)])
+    bus.publish('10001', completion=80)
+    bus.publish('10001', completion=90)
+    bus.publish('10002', is_favorite=True)
+    time.sleep(0.2)
+    assert len(sent) == 1, f"1000 个曲谱码只发出 1 个事件（实际 {len(sent)}）"
+    updates = {item['score_code']: item for item in sent[0][1]['updates']}
+    assert len(updates) == 1000, f"共 1000 条变化（实际 {len(updates)}）"
+    assert updates['10001'] == {'score_code': '10001', 'remark': '练习', 'completion': 90}, \
+        f"同一曲谱码的字段合并、后写覆盖（{updates['10001']}）"
+    assert updates['10003'] == {'score_code': '10003', 'remark': '练习'}, "只带变化过的字段"
+
+
+def test_next_window():
+    print("\n窗口结束后重新计时")
+    bus, sent = make_bus()
+    bus.publish('20000', completion=10)
+    time.sleep(0.15)
+    bus.publish('20000', completion=20)
+    time.sleep(0.15)
+    completions = [data['updates'][0]['completion'] for _, data in sent]
+    assert completions == [10, 20], f"两个窗口各发一次（实际 {completions}）"
+
+
+def test_metrics():
+    print("\n统计")
+    bus, sent = make_bus(window=10)
+    bus.publish('30000', remark='a')
+    bus.publish('30000', remark='b')
+    flushed = bus.flush()
+    bus.emit_now('clipboard_update', {'type': 'score_code', 'score_code': '30000'})
+    metrics = bus.metrics()
+    assert flushed == 1 and len(sent) == 2, "flush 立即发出"
+    assert metrics['published'] == 2 and metrics['merged'] == 1, f"合并次数 {metrics['merged']}"
+    events = metrics['events']
+    assert events['score_updates']['emits'] == 1 and events['clipboard_update']['emits'] == 1, "按事件统计发送次数"
+    assert events['score_updates']['last_bytes'] > 0, f"记录负载字节数（{events['score_updates']['last_bytes']}）"
+
+
+def main():
+    print("广播总线测试")
+    print("============")
+    tests = [
+        test_coalesce,
+        test_next_window,
+        test_metrics,
+    ]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"[ERROR] {e}")
+        else:
+            print("[OK]")
+            passed += 1
+    print(f"\n通过 {passed}/{len(tests)}")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
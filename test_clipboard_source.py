@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+剪贴板来源测试脚本（不访问真实剪贴板）
+"""
+
+import os
+import socket
+import sys
+import threading
+import time
+import types
+
+# 将项目目录添加到Python路径中
+project_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, project_root)
+
+from clipboard_source import (
+    PollingClipboardSource,
+    StubClipboardSource,
+    WaylandClipboardSource,
+    X11ClipboardSource,
+    create_clipboard_source,
+)
+
+
+def run_in_background(source, received):
+    stop_event = threading.Event()
+    thread = threading.Thread(target=source.run, args=(received.append, stop_event), daemon=True)
+    thread.start()
+    return stop_event, thread
+
+
+def wait_for(condition, timeout=3.0):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_stub_dedupe():
+    print("\n桩来源去重")
+    source = StubClipboardSource()
+    received = []
+    stop_event, thread = run_in_background(source, received)
+    for text in ['12345', '12345', '', '67890', '12345']:
+        source.push(text)
+    wait_for(lambda: source.stats['events'] == 5)
+    stop_event.set()
+    thread.join(timeout=1)
+    assert received == ['12345', '67890', '12345'], f"只回调内容变化（实际 {received}）"
+
+
+def test_polling_backoff():
+    print("\n自适应轮询")
+    clipboard = {'text': 'a'}
+    polls = []
+
+    def paste():
+        polls.append(time.perf_counter())
+        return clipboard['text']
+
+    source = PollingClipboardSource(paste, min_interval=0.01, max_interval=0.16, backoff=2)
+    received = []
+    stop_event, thread = run_in_background(source, received)
+    time.sleep(0.6)
+    try:
+        assert source.interval == 0.16, f"空闲后间隔增长到上限（当前 {source.interval:.2f}s）"
+        idle_polls = len(polls)
+        assert idle_polls < 12, f"空闲 0.6s 轮询了 {idle_polls} 次"
+        clipboard['text'] = 'b'
+        assert wait_for(lambda: received == ['a', 'b']), f"变化后收到新内容（实际 {received}）"
+        assert source.interval < 0.16, f"变化后恢复最短间隔（当前 {source.interval:.2f}s）"
+    finally:
+        stop_event.set()
+        thread.join(timeout=1)
+
+
+def test_polling_retry():
+    print("\n轮询读取失败重试")
+    calls = {'n': 0}
+
+    def paste():
+        calls['n'] += 1
+        if calls['n'] <= 2:
+            raise RuntimeError('模拟读取失败')
+        return '54321'
+
+    source = PollingClipboardSource(paste, min_interval=0.01, retry_delay=0.01)
+    received = []
+    stop_event, thread = run_in_background(source, received)
+    try:
+        assert wait_for(lambda: received == ['54321']), f"失败两次后读到内容（实际 {received}）"
+    finally:
+        stop_event.set()
+        thread.join(timeout=1)
+
+
+def test_wayland_stream():
+    print("\nwl-paste --watch 输出解析")
+    source = WaylandClipboardSource()
+    # 用 Python 子进程模拟 wl-paste --watch：三次变化，每次内容后跟一个 NUL
+    script = "import sys, time\nfor t in ['11111', '多行\\n内容', '22222']:\n" \
+             "    sys.stdout.buffer.write(t.encode() + b'\\0'); sys.stdout.flush(); time.sleep(0.05)\n" \
+             "time.sleep(5)\n"
+    source.WATCH_COMMAND = [sys.executable, '-c', script]
+    received = []
+    stop_event, thread = run_in_background(source, received)
+    wait_for(lambda: len(received) == 3)
+    stop_event.set()
+    thread.join(timeout=1)
+    assert received == ['11111', '多行\n内容', '22222'], f"按 NUL 切分出三次变化（实际 {received}）"
+
+
+def test_wayland_stops_while_idle():
+    print("\nwl-paste 没有输出时也能停止")
+    source = WaylandClipboardSource(poll_interval=0.05)
+    # 模拟剪贴板一直不变：子进程只输出一次内容，之后不再写入
+    script = "import sys, time\nsys.stdout.buffer.write(b'33333\\0'); sys.stdout.flush()\ntime.sleep(30)\n"
+    source.WATCH_COMMAND = [sys.executable, '-c', script]
+    received = []
+    stop_event, thread = run_in_background(source, received)
+    assert wait_for(lambda: received == ['33333']), f"收到第一次内容（实际 {received}）"
+    stop_event.set()
+    thread.join(timeout=1)
+    assert not thread.is_alive(), "stop_event 置位后监听线程应当退出"
+
+
+# 与 python-xlib 一致：XFixes 的事件共用一个事件号，按 sub_code 区分
+XFIXES_EVENT_TYPE = 87
+XFIXES_SET_SELECTION_OWNER = (XFIXES_EVENT_TYPE, 0)
+XFIXES_SELECTION_WINDOW_DESTROY = (XFIXES_EVENT_TYPE, 1)
+
+
+class FakeDisplay:
+    """模拟 Xlib 的 Display：deliver() 投递事件并唤醒连接，队列为空时 next_event() 会一直阻塞"""
+
+    instances = []
+
+    def __init__(self):
+        self.sock, self.peer = socket.socketpair()
+        self.sock.setblocking(False)
+        self.events = []
+        self.extension_event = types.SimpleNamespace(SetSelectionOwnerNotify=XFIXES_SET_SELECTION_OWNER)
+        FakeDisplay.instances.append(self)
+
+    def deliver(self, event_type, sub_code):
+        self.events.append(types.SimpleNamespace(type=event_type, sub_code=sub_code))
+        self.peer.send(b'\0')
+
+    def has_extension(self, name):
+        return True
+
+    def query_extension(self, name):
+        return object()
+
+    def xfixes_query_version(self):
+        pass
+
+    def screen(self):
+        return types.SimpleNamespace(root=types.SimpleNamespace())
+
+    def get_atom(self, name):
+        return 0
+
+    def xfixes_select_selection_input(self, window, selection, mask):
+        pass
+
+    def pending_events(self):
+        try:
+            self.sock.recv(4096)
+        except BlockingIOError:
+            pass
+        return len(self.events)
+
+    def next_event(self):
+        if not self.events:
+            threading.Event().wait()
+        return self.events.pop(0)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+        self.peer.close()
+
+
+def run_with_fake_xlib(test):
+    """把假的 Xlib 模块放进 sys.modules 后执行 test，结束后还原"""
+    xlib = types.ModuleType('Xlib')
+    xlib.display = types.SimpleNamespace(Display=FakeDisplay)
+    xlib.ext = types.ModuleType('Xlib.ext')
+    xlib.ext.xfixes = types.SimpleNamespace(XFixesSetSelectionOwnerNotifyMask=1)
+    fake_modules = {'Xlib': xlib, 'Xlib.display': xlib.display, 'Xlib.ext': xlib.ext, 'Xlib.ext.xfixes': xlib.ext.xfixes}
+    saved = {name: sys.modules.get(name) for name in fake_modules}
+    sys.modules.update(fake_modules)
+    FakeDisplay.instances.clear()
+    try:
+        test()
+    finally:
+        for name, module in saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+
+
+def test_x11_stops_without_events():
+    print("\nX11 来源在没有事件时也能停止")
+
+    def test():
+        source = X11ClipboardSource(lambda: '12345', poll_interval=0.05)
+        received = []
+        stop_event, thread = run_in_background(source, received)
+        assert wait_for(lambda: received == ['12345']), f"启动时读取一次剪贴板（实际 {received}）"
+        stop_event.set()
+        thread.join(timeout=1)
+        assert not thread.is_alive(), "stop_event 置位后监听线程应当退出"
+
+    run_with_fake_xlib(test)
+
+
+def test_x11_owner_change_reads_clipboard():
+    print("\nX11 归属变化事件")
+
+    def test():
+        clipboard = {'text': '11111'}
+        pastes = []
+
+        def paste():
+            pastes.append(clipboard['text'])
+            return clipboard['text']
+
+        source = X11ClipboardSource(paste, poll_interval=0.05)
+        received = []
+        stop_event, thread = run_in_background(source, received)
+        try:
+            assert wait_for(lambda: received == ['11111']), f"启动时读取一次剪贴板（实际 {received}）"
+            disp = FakeDisplay.instances[-1]
+            # 其他 XFixes 子事件不读取剪贴板
+            disp.deliver(*XFIXES_SELECTION_WINDOW_DESTROY)
+            assert wait_for(lambda: not disp.events), "事件应当被取走"
+            assert len(pastes) == 1, f"非归属变化事件不应读取剪贴板（读取 {len(pastes)} 次）"
+            clipboard['text'] = '22222'
+            disp.deliver(*XFIXES_SET_SELECTION_OWNER)
+            assert wait_for(lambda: received == ['11111', '22222']), f"归属变化后读取新内容（实际 {received}）"
+            assert thread.is_alive(), "监听线程不应因事件而退出"
+        finally:
+            stop_event.set()
+            thread.join(timeout=1)
+
+    run_with_fake_xlib(test)
+
+
+def test_factory():
+    print("\n来源选择")
+    assert create_clipboard_source('stub').name == 'stub'
+    assert create_clipboard_source('poll', paste=lambda: '').name == 'poll'
+    try:
+        create_clipboard_source('unknown')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("未知来源应当报错")
+
+
+def main():
+    print("剪贴板来源测试")
+    print("==============")
+    tests = [
+        test_stub_dedupe,
+        test_polling_backoff,
+        test_polling_retry,
+        test_wayland_stream,
+        test_wayland_stops_while_idle,
+        test_x11_stops_without_events,
+        test_x11_owner_change_reads_clipboard,
+        test_factory,
+    ]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"[ERROR] {e}")
+        else:
+            print("[OK]")
+            passed += 1
+    print(f"\n通过 {passed}/{len(tests)}")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
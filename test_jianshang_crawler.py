@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+并发爬虫测试脚本（基于本地桩服务，不访问真实接口）
+"""
+
+import os
+import sys
+import time
+
+# 将项目目录添加到Python路径中
+project_root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, project_root)
+
+from jianshang_crawler import (
+    JianshangCrawler,
+    StubSecondPageServer,
+    TokenBucket,
+    make_second_page_payload,
+)
+
+PAGE_SIZE = 30
+
+
+def build_pages(full_pages, last_page_size):
+    """生成 full_pages 个整页 + 1 个短页的录制数据"""
+    pages = {}
+    code = 10000000
+    for page in range(1, full_pages + 2):
+        size = PAGE_SIZE if page <= full_pages else last_page_size
+        work_list = []
+        for _ in range(size):
+            work_list.append({'work_id': code, 'share_code': str(code), 'title': f'作品{code}'})
+            code += 1
+        pages[page] = make_second_page_payload(work_list)
+    return pages
+
+
+def make_crawler(server, **kwargs):
+    options = dict(concurrency=4, rate=100, backoff_base=0.01, backoff_max=0.05)
+    options.update(kwargs)
+    return JianshangCrawler(base_url=server.url, **options)
+
+
+def test_short_page_stop():
+    print("\n短页停止与顺序")
+    pages = build_pages(full_pages=9, last_page_size=7)
+    with StubSecondPageServer(pages, delay=0.05) as server:
+        crawler = make_crawler(server)
+        start = time.perf_counter()
+        result = crawler.crawl(max_pages=50)
+        elapsed = time.perf_counter() - start
+    codes = [work['share_code'] for _, work_list in result for work in work_list]
+    print(f"  用时 {elapsed:.2f}s，统计: {crawler.stats}")
+    assert [page for page, _ in result] == list(range(1, 11)), "返回 10 页，页码有序"
+    assert len(codes) == 277 and len(set(codes)) == 277, "共 277 个曲谱码且无重复"
+    assert server.max_in_flight > 1, f"并发生效（最大并发 {server.max_in_flight}）"
+    assert len(server.request_log) <= 10 + crawler.concurrency, \
+        f"短页后最多多请求 {crawler.concurrency} 页（实际请求 {len(server.request_log)} 次）"
+
+
+def test_retry_on_429_and_5xx():
+    print("\n429/5xx 重试")
+    pages = build_pages(full_pages=4, last_page_size=3)
+    fail_plan = {2: [429], 3: [503, 502]}
+    with StubSecondPageServer(pages, fail_plan=fail_plan) as server:
+        crawler = make_crawler(server)
+        result = crawler.crawl(max_pages=50)
+    assert [page for page, _ in result] == [1, 2, 3, 4, 5], "重试后拿到全部 5 页"
+    assert crawler.stats['retries'] == 3, f"共重试 3 次（实际 {crawler.stats['retries']}）"
+
+
+def test_failed_page_truncates():
+    print("\n重试耗尽后截断")
+    pages = build_pages(full_pages=6, last_page_size=1)
+    with StubSecondPageServer(pages, fail_plan={4: [500] * 10}) as server:
+        crawler = make_crawler(server, max_retries=2)
+        result = crawler.crawl(max_pages=50)
+    assert [page for page, _ in result] == [1, 2, 3], "只保留失败页之前的 3 页"
+    assert crawler.last_error is not None, "记录了最后一次错误"
+
+
+def test_on_page_stop():
+    print("\n回调提前停止")
+    pages = build_pages(full_pages=8, last_page_size=2)
+    with StubSecondPageServer(pages) as server:
+        crawler = make_crawler(server)
+        result = crawler.crawl(max_pages=50, on_page=lambda page, work_list: page == 3)
+    assert [page for page, _ in result] == [1, 2, 3], "回调返回 True 后停在第 3 页"
+
+
+def test_token_bucket():
+    print("\n令牌桶限速")
+    bucket = TokenBucket(rate=20, burst=1)
+    start = time.perf_counter()
+    for _ in range(11):
+        bucket.acquire()
+    elapsed = time.perf_counter() - start
+    assert 0.4 <= elapsed <= 0.9, f"20 次/秒下取 11 个令牌约 0.5s（实际 {elapsed:.2f}s）"
+
+
+def main():
+    print("并发爬虫测试")
+    print("============")
+    tests = [
+        test_short_page_stop,
+        test_retry_on_429_and_5xx,
+        test_failed_page_truncates,
+        test_on_page_stop,
+        test_token_bucket,
+    ]
+    passed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"[ERROR] {e}")
+        else:
+            print("[OK]")
+            passed += 1
+    print(f"\n通过 {passed}/{len(tests)}")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
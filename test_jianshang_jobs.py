@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鉴赏码爬取任务测试：爬虫指向本地 second_page 桩服务（jianshang_crawler.StubSecondPageServer），
+通过 test_client 启动任务，Socket.IO 测试客户端接收逐页推送
+"""
+
+import time
+
+import pytest
+
+from jianshang_crawler import StubSecondPageServer, make_second_page_payload
+
+PAGE_SIZE = 30
+
+
+@pytest.fixture
+def crawl(app_module, monkeypatch):
+    """清空爬取相关的表；crawl(pages, **options) 启动桩服务并让任务使用它，返回桩服务"""
+    with app_module.scores_db.connection() as conn:
+        for table in ('jianshang_snapshot_codes', 'jianshang_snapshots', 'jianshang_code_presence',
+                      'jianshang_snapshot_diffs', 'jianshang_seen_works', 'jianshang_crawl_state'):
+            conn.execute(f'DELETE FROM {table}')
+    servers = []
+    original = app_module.create_jianshang_crawler
+
+    def serve(pages, **options):
+        server = StubSecondPageServer(pages, **options).start()
+        servers.append(server)
+        monkeypatch.setattr(app_module, 'create_jianshang_crawler', lambda: original(
+            base_url=server.url, rate=1000, max_retries=1, backoff_base=0.01, backoff_max=0.02))
+        return server
+
+    yield serve
+    for server in servers:
+        server.stop()
+
+
+def work(work_id):
+    """work_id 越大发布越晚，曲谱码取 work_id 本身（需为 5 位以上数字）"""
+    return {'work_id': work_id, 'share_code': str(work_id), 'game_data': {'publish_time': work_id}}
+
+
+def feed(*pages):
+    """pages 为每页的 work_id 列表，返回桩服务用的 {页码: 响应}"""
+    return {page: make_second_page_payload([work(work_id) for work_id in ids])
+            for page, ids in enumerate(pages, start=1)}
+
+
+def run_job(client, full=False):
+    body = client.post('/api/fetch_jianshang/jobs', json={'full': full}).get_json()
+    assert body['success']
+    deadline = time.perf_counter() + 10
+    while time.perf_counter() < deadline:
+        job = client.get(f"/api/fetch_jianshang/jobs/{body['job_id']}").get_json()['job']
+        if job['status'] != 'running':
+            return job
+        time.sleep(0.02)
+    raise AssertionError('爬取任务超时未结束')
+
+
+def socket_events(socket_client):
+    """收取推送直到 jianshang_crawl_done 到达（任务状态先于该事件更新），返回 {事件名: [数据, ...]}"""
+    events = {}
+    deadline = time.perf_counter() + 5
+    while 'jianshang_crawl_done' not in events and time.perf_counter() < deadline:
+        for event in socket_client.get_received():
+            events.setdefault(event['name'], []).append(event['args'][0])
+        time.sleep(0.02)
+    return events
+
+
+def test_job_streams_pages_and_reports_done(app_module, client, crawl):
+    first = list(range(70000, 70000 + PAGE_SIZE))
+    second = list(range(70100, 70100 + PAGE_SIZE))
+    crawl(feed(first, second, [70200, 70201]), delay=0.05)
+    # 连接时加入全部页面房间，爬取进度发往 page:batch
+    socket_client = app_module.socketio.test_client(app_module.app)
+    socket_client.get_received()
+
+    started = client.post('/api/fetch_jianshang/jobs', json={'full': True}).get_json()
+    # 任务运行中再次请求时复用同一个任务
+    again = client.post('/api/fetch_jianshang/jobs').get_json()
+    assert again['reused'] and again['job_id'] == started['job_id']
+    job = run_job(client)
+    assert job['job_id'] == started['job_id']
+
+    all_codes = [str(work_id) for work_id in first + second + [70200, 70201]]
+    assert job['status'] == 'done' and job['mode'] == 'full'
+    assert job['pages'] == 3 and job['total'] == len(all_codes)
+    assert [item['score_code'] for item in job['results']] == all_codes
+    assert job['snapshot_id'] is not None
+
+    events = socket_events(socket_client)
+    pages = events['jianshang_crawl_page']
+    assert [event['page'] for event in pages] == [1, 2, 3]
+    assert [code for event in pages for code in event['codes']] == all_codes
+    assert all(event['job_id'] == job['job_id'] for event in pages)
+    done = events['jianshang_crawl_done']
+    assert len(done) == 1 and done[0]['success'] and done[0]['snapshot_id'] == job['snapshot_id']
+    socket_client.disconnect()
+
+    # 兼容旧接口：等待任务结束后一次性返回
+    body = client.get('/api/fetch_jianshang?full=1').get_json()
+    assert body['success'] and body['total'] == len(all_codes)
+
+
+def test_job_reports_error(app_module, client, crawl):
+    crawl(feed(list(range(70000, 70000 + PAGE_SIZE))), fail_plan={1: [500] * 10})
+    socket_client = app_module.socketio.test_client(app_module.app)
+    job = run_job(client, full=True)
+    assert job['status'] == 'error' and job['error']
+    assert job['snapshot_id'] is None
+    events = socket_events(socket_client)
+    assert 'jianshang_crawl_page' not in events
+    done = events['jianshang_crawl_done']
+    assert len(done) == 1 and not done[0]['success'] and done[0]['status'] == 'error'
+    socket_client.disconnect()
+
+    resp = client.get('/api/fetch_jianshang?full=1')
+    assert resp.status_code == 404 and not resp.get_json()['success']
+
+
+def chunked(ids):
+    """按每页 PAGE_SIZE 个切成桩服务的分页，最后一页不足一页时爬虫在此停止"""
+    return feed(*(ids[start:start + PAGE_SIZE] for start in range(0, len(ids), PAGE_SIZE)))
+
+
+def test_incremental_crawl_stops_at_checkpoint(app_module, client, crawl):
+    known = list(range(71000, 71000 + PAGE_SIZE * 9 + 5))
+    # 列表按发布时间从新到旧排列
+    crawl(chunked(known[::-1]))
+    job = run_job(client, full=True)
+    assert job['status'] == 'done' and not job['stopped_by_checkpoint']
+    checkpoint = client.get('/api/fetch_jianshang/checkpoint').get_json()['checkpoint']
+    assert checkpoint['seen_works'] == len(known)
+    assert checkpoint['max_publish_time'] == known[-1]
+    assert checkpoint['last_mode'] == 'full' and checkpoint['last_full_crawl_at']
+
+    fresh = [71900, 71901, 71902]
+    server = crawl(chunked((known + fresh)[::-1]))
+    job = run_job(client)
+    assert job['status'] == 'done' and job['mode'] == 'incremental'
+    assert job['stopped_by_checkpoint']
+    assert job['new_count'] == len(fresh)
+    assert sorted(item['score_code'] for item in job['results'] if item['is_new']) == \
+        [str(work_id) for work_id in fresh]
+    # 第 1 页有新作品，第 2、3 页全是已见过的作品即停止；最多再多取并发数那么多页，不会爬到第 10 页
+    assert max(server.request_log) <= 3 + app_module.JIANSHANG_CRAWL_CONCURRENCY < 10
+
+    checkpoint = client.get('/api/fetch_jianshang/checkpoint').get_json()['checkpoint']
+    assert checkpoint['seen_works'] == len(known) + len(fresh)
+    assert checkpoint['max_publish_time'] == fresh[-1]
+    assert checkpoint['last_mode'] == 'incremental'
+
+
+def observed_flags(app_module, snapshot_id):
+    with app_module.scores_db.connection() as conn:
+        return dict(conn.execute('''
+            SELECT score_code, observed FROM jianshang_snapshot_codes WHERE snapshot_id = ? ORDER BY position
+        ''', (snapshot_id,)).fetchall())
+
+
+def test_crawl_snapshots_record_observed_codes(app_module, client, crawl):
+    known = list(range(72000, 72000 + PAGE_SIZE * 9 + 5))
+    crawl(chunked(known[::-1]))
+    full = run_job(client, full=True)
+    fresh = [72900, 72901]
+    crawl(chunked((known + fresh)[::-1]))
+    incremental = run_job(client)
+    assert incremental['stopped_by_checkpoint']
+
+    snapshots = client.get('/api/jianshang_snapshots').get_json()['snapshots']
+    assert [(s['snapshot_id'], s['mode']) for s in snapshots] == [
+        (incremental['snapshot_id'], 'incremental'), (full['snapshot_id'], 'full')]
+    assert [s['code_count'] for s in snapshots] == [len(known) + len(fresh), len(known)]
+
+    # 全量快照全部是实际爬到的；增量快照只有爬到的几页记为 observed，其余沿用全量快照
+    assert set(observed_flags(app_module, full['snapshot_id']).values()) == {1}
+    flags = observed_flags(app_module, incremental['snapshot_id'])
+    crawled = [item['score_code'] for item in incremental['results']]
+    assert list(flags)[:len(crawled)] == crawled
+    assert all(flags[code] == 1 for code in crawled)
+    carried = list(flags)[len(crawled):]
+    assert carried and all(flags[code] == 0 for code in carried)
+    assert set(flags) == {str(work_id) for work_id in known + fresh}
+
+    export = client.get(f"/api/jianshang_snapshots/{incremental['snapshot_id']}/export")
+    assert export.get_data(as_text=True).split() == list(flags)
+    body = client.get(f"/api/jianshang_snapshots/{incremental['snapshot_id']}/new_codes").get_json()
+    assert body['since'] == full['snapshot_id']
+    assert sorted(body['codes']) == [str(work_id) for work_id in fresh]
+    body = client.get('/api/latest_jianshang_codes').get_json()
+    assert body['snapshot_id'] == incremental['snapshot_id'] and body['codes'] == list(flags)
+
+    # 沿用的曲谱码不算作在增量快照中出现
+    history = client.get(f'/api/jianshang_codes/{carried[0]}/history?snapshots=1').get_json()['history']
+    assert [s['snapshot_id'] for s in history['snapshots']] == [full['snapshot_id']]
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+鉴赏码快照测试：增量快照沿用的曲谱码不参与对比与留存统计
+"""
+
+import pytest
+
+
+@pytest.fixture
+def snapshots(app_module):
+    with app_module.scores_db.connection() as conn:
+        for table in ('jianshang_snapshot_codes', 'jianshang_snapshots', 'jianshang_code_presence',
+                      'jianshang_snapshot_diffs', 'jianshang_seen_works', 'jianshang_crawl_state'):
+            conn.execute(f'DELETE FROM {table}')
+    return app_module
+
+
+def observed_flags(app_module, snapshot_id):
+    with app_module.scores_db.connection() as conn:
+        rows = conn.execute('''
+            SELECT score_code, observed FROM jianshang_snapshot_codes WHERE snapshot_id = ? ORDER BY position
+        ''', (snapshot_id,)).fetchall()
+    return dict(rows)
+
+
+def test_diff_and_presence_use_full_snapshots(snapshots, client):
+    app = snapshots
+    first = app.save_jianshang_snapshot(['10001', '10002', '10003'], mode='full', taken_at='2025-01-01 00:00:00')
+    partial = app.save_jianshang_snapshot(['10004'], mode='incremental', taken_at='2025-01-02 00:00:00',
+                                          carried_codes=['10001', '10002', '10003', '10004'])
+    latest = app.save_jianshang_snapshot(['10001', '10004'], mode='full', taken_at='2025-01-03 00:00:00')
+
+    assert observed_flags(app, partial['snapshot_id']) == {'10004': 1, '10001': 0, '10002': 0, '10003': 0}
+
+    # 默认对比最新的两份完整快照，跳过中间的增量快照
+    body = client.get('/api/jianshang_snapshots/diff').get_json()
+    assert body['from']['snapshot_id'] == first['snapshot_id']
+    assert body['to']['snapshot_id'] == latest['snapshot_id']
+    assert body['entered'] == ['10004']
+    assert sorted(body['left']) == ['10002', '10003']
+
+    resp = client.get(f"/api/jianshang_snapshots/diff?from={first['snapshot_id']}&to={partial['snapshot_id']}")
+    assert resp.status_code == 400
+
+    # 增量快照的“新增”只算实际爬到的曲谱码
+    body = client.get(f"/api/jianshang_snapshots/{partial['snapshot_id']}/new_codes"
+                      f"?since={first['snapshot_id']}").get_json()
+    assert body['codes'] == ['10004']
+
+    # 连续上榜按相邻的完整快照计算，增量快照沿用的曲谱码不算出现
+    churn = {item['score_code']: item for item in client.get('/api/jianshang_codes/churn').get_json()['results']}
+    assert churn['10001']['appearances'] == 2 and churn['10001']['current_streak'] == 2
+    assert churn['10002']['appearances'] == 1 and not churn['10002']['is_current']
+    assert churn['10004']['appearances'] == 1 and churn['10004']['first_seen_at'] == '2025-01-03 00:00:00'
+
+    history = client.get('/api/jianshang_codes/10002/history?snapshots=1').get_json()['history']
+    assert [item['snapshot_id'] for item in history['snapshots']] == [first['snapshot_id']]
+
+
+class FakeCrawler:
+    """按页回调预先准备的作品列表，on_page 返回 True 时停止"""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.stats = {}
+        self.last_error = None
+
+    def crawl(self, max_pages, on_page):
+        for page, works in enumerate(self.pages, start=1):
+            if on_page(page, works):
+                break
+
+
+def works(*codes):
+    return [{'work_id': int(code), 'share_code': code, 'publish_time': int(code)} for code in codes]
+
+
+def test_incremental_crawl_carries_latest_full_snapshot(snapshots, monkeypatch):
+    app = snapshots
+    app.record_seen_works(works('20001', '20002', '20003', '20004'))
+    app.update_crawl_checkpoint('full')
+    full = app.save_jianshang_snapshot(['20001', '20002', '20003', '20004'], mode='full',
+                                       taken_at='2025-02-01 00:00:00')
+    # 上一份增量快照里沿用了已下榜的 29999，不应再被带进新的快照
+    app.save_jianshang_snapshot(['20001'], mode='incremental', taken_at='2025-02-02 00:00:00',
+                                carried_codes=['29999', '20002', '20003', '20004'])
+
+    pages = [works('20005', '20001'), works('20002'), works('20003')]
+    monkeypatch.setattr(app, 'create_jianshang_crawler', lambda: FakeCrawler(pages))
+    job, _ = app.start_jianshang_crawl_job(mode='incremental')
+    assert job['done_event'].wait(10)
+    assert job['status'] == 'done' and job['stopped_by_checkpoint']
+
+    snapshot = app.get_jianshang_snapshot(job['snapshot_id'])
+    assert snapshot['mode'] == 'incremental'
+    flags = observed_flags(app, job['snapshot_id'])
+    assert flags == {'20005': 1, '20001': 1, '20002': 1, '20003': 1, '20004': 0}
+    assert app.find_latest_jianshang_snapshot(False, full_only=True)['snapshot_id'] == full['snapshot_id']
+
+
+def test_crawl_refreshes_work_ranks_once(snapshots, monkeypatch):
+    app = snapshots
+    calls = []
+    monkeypatch.setattr(app, 'refresh_work_ranks', lambda: calls.append(1))
+    pages = [works('21001', '21002'), works('21003'), works('21004')]
+    monkeypatch.setattr(app, 'create_jianshang_crawler', lambda: FakeCrawler(pages))
+    job, _ = app.start_jianshang_crawl_job(mode='full')
+    assert job['done_event'].wait(10)
+    assert job['status'] == 'done'
+    # 每页都写入作品数据，但排序列只在爬取结束后重算一次
+    assert calls == [1]
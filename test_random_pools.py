@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+随机池测试（临时 scores.db，通过 test_client 调用接口）
+"""
+
+import pytest
+
+
+@pytest.fixture
+def pools(app_module):
+    with app_module.scores_db.connection() as conn:
+        conn.execute('DELETE FROM pool_members')
+        conn.execute('DELETE FROM random_pools')
+    return app_module
+
+
+def save_scores(client, completions):
+    for code, completion in completions.items():
+        resp = client.post('/api/scores/save', json={'score_code': code, 'completion': completion})
+        assert resp.get_json()['success']
+
+
+def create_pool(client, codes, **options):
+    body = client.post('/api/random_pool/create', json={'name': 'test', 'codes': codes, **options}).get_json()
+    assert body['success']
+    return body['id']
+
+
+def draw(client, pool_id, count=1, **params):
+    query = '&'.join([f'count={count}'] + [f'{key}={value}' for key, value in params.items()])
+    return client.post(f'/api/random_pool/{pool_id}/random?{query}').get_json()
+
+
+def test_reweight_then_reset_replays_new_weight(pools, client):
+    codes = [str(40000 + i) for i in range(20)]
+    # 一半有完成率、一半未玩过，两种加权方式的顺序明显不同
+    save_scores(client, {code: i * 5 for i, code in enumerate(codes[:10])})
+
+    unplayed_order = draw(client, create_pool(client, codes, seed='s1', weight='unplayed'), count=20)['codes']
+    completion_order = draw(client, create_pool(client, codes, seed='s1', weight='completion'), count=20)['codes']
+    assert unplayed_order != completion_order
+
+    pool_id = create_pool(client, codes, seed='s1', weight='completion')
+    draw(client, pool_id, count=1, weight='unplayed')
+    assert client.post(f'/api/random_pool/{pool_id}/reset', json={}).get_json()['success']
+    assert draw(client, pool_id, count=20)['codes'] == unplayed_order
+
+
+def pool_info(client, pool_id):
+    pools = client.get('/api/random_pool/list').get_json()['pools']
+    return next(pool for pool in pools if pool['id'] == pool_id)
+
+
+def test_draw_each_member_once_then_reset(pools, client):
+    codes = [str(41000 + i) for i in range(10)]
+    pool_id = create_pool(client, codes)
+
+    drawn = [draw(client, pool_id)['code'] for _ in range(4)]
+    members = client.get(f'/api/random_pool/{pool_id}/members').get_json()
+    assert sorted(item['score_code'] for item in members['results']) == sorted(set(codes) - set(drawn))
+    info = pool_info(client, pool_id)
+    assert (info['total'], info['remain'], info['drawn']) == (10, 6, 4)
+
+    drawn += [draw(client, pool_id)['code'] for _ in range(6)]
+    assert sorted(drawn) == codes
+    resp = client.post(f'/api/random_pool/{pool_id}/random')
+    assert resp.status_code == 400 and resp.get_json()['error'] == '池已空'
+
+    assert client.post(f'/api/random_pool/{pool_id}/reset', json={}).get_json()['remain'] == 10
+    assert sorted(draw(client, pool_id, count=10)['codes']) == codes
+
+
+def test_seeded_order_prefetch_and_replay(pools, client):
+    codes = [str(42000 + i) for i in range(20)]
+    order = draw(client, create_pool(client, codes, seed='s1'), count=20)['codes']
+    assert sorted(order) == codes
+
+    # 同一 seed 的池顺序相同；count=k 一次取接下来的 k 个
+    pool_id = create_pool(client, codes, seed='s1')
+    first = draw(client, pool_id, count=3)
+    assert first['codes'] == order[:3] and first['code'] == order[0] and first['remain'] == 17
+    assert len(first['details']) == 3
+    assert draw(client, pool_id, count=5)['codes'] == order[3:8]
+
+    # 重置后按原顺序重放；换 seed 后重新洗牌
+    client.post(f'/api/random_pool/{pool_id}/reset', json={})
+    assert draw(client, pool_id, count=20)['codes'] == order
+    client.post(f'/api/random_pool/{pool_id}/reset', json={'seed': 's2'})
+    reshuffled = draw(client, pool_id, count=20)['codes']
+    assert sorted(reshuffled) == codes and reshuffled != order
+
+
+def test_filter_draws_matching_and_tracks_score_changes(pools, client):
+    codes = [str(43000 + i) for i in range(12)]
+    # 43010、43011 没有记录
+    save_scores(client, {code: i * 10 for i, code in enumerate(codes[:10])})
+    pool_id = create_pool(client, codes, seed='s1')
+
+    resp = client.post(f'/api/random_pool/{pool_id}/filter', json={'filter': {'min_completion': 50}}).get_json()
+    assert resp['success'] and resp['remain'] == 5
+    assert pool_info(client, pool_id)['remain'] == 5
+    members = client.get(f'/api/random_pool/{pool_id}/members').get_json()
+    assert sorted(item['score_code'] for item in members['results']) == codes[5:10]
+
+    def cached_remain():
+        with pools.scores_db.connection() as conn:
+            return conn.execute('SELECT filter_remain FROM random_pools WHERE id = ?', (pool_id,)).fetchone()[0]
+
+    # 池外曲谱码的变化不影响缓存；池内曲谱码的完成率变化使缓存失效
+    save_scores(client, {'49999': 100})
+    assert cached_remain() == 5
+    save_scores(client, {codes[0]: 100})
+    assert cached_remain() is None
+    assert pool_info(client, pool_id)['remain'] == 6
+
+    drawn = draw(client, pool_id, count=50)['codes']
+    assert sorted(drawn) == [codes[0]] + codes[5:10]
+    assert client.post(f'/api/random_pool/{pool_id}/random').status_code == 400
+
+    # 重置清除筛选条件
+    client.post(f'/api/random_pool/{pool_id}/reset', json={})
+    info = pool_info(client, pool_id)
+    assert info['active_filter'] is None and info['remain'] == 12
+
+
+def test_filter_keeps_skipped_members_drawable(pools, client):
+    codes = [str(44000 + i) for i in range(10)]
+    save_scores(client, {code: 90 if i % 2 else 10 for i, code in enumerate(codes)})
+    pool_id = create_pool(client, codes, seed='s1')
+    client.post(f'/api/random_pool/{pool_id}/filter', json={'filter': {'min_completion': 50}})
+
+    first = draw(client, pool_id, count=2)['codes']
+    rest = draw(client, pool_id, count=50)['codes']
+    assert sorted(first + rest) == codes[1::2]
+    assert client.post(f'/api/random_pool/{pool_id}/random').status_code == 400
+    assert pool_info(client, pool_id)['drawn'] == 5
+
+    # 抽取时被跳过的成员之后满足条件，本轮仍可抽到；已抽取的不会再出现
+    save_scores(client, {codes[0]: 95, codes[2]: 60, codes[1]: 95})
+    assert pool_info(client, pool_id)['remain'] == 2
+    members = client.get(f'/api/random_pool/{pool_id}/members').get_json()
+    assert sorted(item['score_code'] for item in members['results']) == [codes[0], codes[2]]
+    assert sorted(draw(client, pool_id, count=50)['codes']) == [codes[0], codes[2]]
+    assert pool_info(client, pool_id)['drawn'] == 7
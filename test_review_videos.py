@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+评价视频测试：流式上传的 .part 文件处理；上传后进入后台转码队列，完成后替换 video_path（compress_video 用假实现代替 ffmpeg）
+"""
+
+import hashlib
+import io
+import os
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def transcode(app_module, monkeypatch):
+    """压缩阈值调到 100 字节；fake.release 控制压缩何时完成"""
+    fake = {'calls': [], 'release': threading.Event(), 'fail': False}
+    fake['release'].set()
+
+    def fake_compress(input_path, output_path, target_size_mb=450):
+        fake['calls'].append((input_path, output_path))
+        fake['release'].wait(10)
+        if fake['fail']:
+            return False
+        with open(output_path, 'wb') as f:
+            f.write(b'compressed')
+        return True
+
+    monkeypatch.setattr(app_module, 'VIDEO_COMPRESS_THRESHOLD', 100)
+    monkeypatch.setattr(app_module, 'compress_video', fake_compress)
+    return fake
+
+
+def upload_review(client, score_code, payload, filename='clip.mp4'):
+    return client.post('/api/reviews', data={
+        'score_code': score_code, 'rating': '5', 'comment': '测试', 'video_source': 'upload',
+        'video': (io.BytesIO(payload), filename),
+    }, content_type='multipart/form-data').get_json()
+
+
+def wait_for_job(client, job_id, timeout=10):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        job = client.get(f'/api/transcode/jobs/{job_id}').get_json()['job']
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f'转码任务 {job_id} 超时未结束')
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+def upload_path(app_module, video_url):
+    return os.path.join(app_module.app.config['UPLOAD_FOLDER'], os.path.basename(video_url))
+
+
+def test_upload_limit_allows_queued_transcode(app_module):
+    assert app_module.app.config['MAX_CONTENT_LENGTH'] > app_module.VIDEO_COMPRESS_THRESHOLD
+
+
+def test_large_upload_is_queued_and_swapped(app_module, client, transcode):
+    body = upload_review(client, '50001', b'v' * 500)
+    assert body['success'] and body['video_status'] == 'processing' and body['transcode_job_id']
+    original = body['video_url']
+
+    job = wait_for_job(client, body['transcode_job_id'])
+    assert job['status'] == 'done' and job['attempts'] == 1
+
+    review = client.get('/api/reviews/50001').get_json()
+    assert review['video_status'] is None
+    assert review['video_url'] == job['target_url'] != original
+    assert open(upload_path(app_module, review['video_url']), 'rb').read() == b'compressed'
+    # 任务先标记完成再删除原始文件
+    assert wait_until(lambda: not os.path.exists(upload_path(app_module, original)))
+
+
+def test_small_upload_is_not_queued(client, transcode):
+    body = upload_review(client, '50002', b'v' * 50)
+    assert body['success'] and body['video_status'] is None and body['transcode_job_id'] is None
+    assert transcode['calls'] == []
+
+
+def test_failed_transcode_keeps_original(app_module, client, transcode):
+    transcode['fail'] = True
+    body = upload_review(client, '50003', b'v' * 500)
+    job = wait_for_job(client, body['transcode_job_id'])
+    assert job['status'] == 'failed'
+    review = client.get('/api/reviews/50003').get_json()
+    assert review['video_url'] == body['video_url'] and review['video_status'] is None
+    assert os.path.exists(upload_path(app_module, body['video_url']))
+
+
+def test_stale_review_discards_output(app_module, client, transcode):
+    transcode['release'].clear()
+    body = upload_review(client, '50004', b'v' * 500)
+    assert wait_until(lambda: transcode['calls'], timeout=10), '转码任务没有被领取'
+
+    # 转码进行中评价换成了外链视频
+    resp = client.put(f"/api/reviews/{body['id']}", data={
+        'rating': '4', 'comment': '换视频', 'video_source': 'external', 'video_url': 'https://example.com/v.mp4',
+    }, content_type='multipart/form-data').get_json()
+    assert resp['success']
+    transcode['release'].set()
+
+    job = wait_for_job(client, body['transcode_job_id'])
+    assert job['status'] == 'done'
+    review = client.get('/api/reviews/50004').get_json()
+    assert review['video_url'] == 'https://example.com/v.mp4'
+    assert wait_until(lambda: not os.path.exists(upload_path(app_module, job['target_url'])))
+
+
+# ---------- 流式上传的 .part 文件 ----------
+
+def partial_files(app_module):
+    folder = app_module.app.config['UPLOAD_FOLDER']
+    return [name for name in os.listdir(folder) if name.endswith('.part')] if os.path.isdir(folder) else []
+
+
+@pytest.fixture
+def created_parts(app_module, monkeypatch):
+    """记录请求中创建的 PartialUploadFile"""
+    created = []
+
+    class RecordingPartialUploadFile(app_module.PartialUploadFile):
+        def __init__(self, folder):
+            super().__init__(folder)
+            created.append(self)
+
+    monkeypatch.setattr(app_module, 'PartialUploadFile', RecordingPartialUploadFile)
+    return created
+
+
+def multipart_body(fields, filename, payload):
+    boundary = 'testboundary'
+    lines = []
+    for key, value in fields.items():
+        lines.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'.encode())
+    lines.append(f'--{boundary}\r\nContent-Disposition: form-data; name="video"; filename="{filename}"\r\n'
+                 f'Content-Type: video/mp4\r\n\r\n'.encode() + payload + b'\r\n')
+    lines.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(lines), f'multipart/form-data; boundary={boundary}'
+
+
+def test_upload_is_streamed_to_part_and_renamed(app_module, client, monkeypatch):
+    renames = []
+    real_replace = os.replace
+
+    def spy_replace(src, dst):
+        renames.append((src, dst))
+        return real_replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', spy_replace)
+    payload = os.urandom(64 * 1024)
+    body = upload_review(client, '50010', payload)
+    assert body['success']
+    assert body['video_sha256'] == hashlib.sha256(payload).hexdigest()
+
+    # 表单解析时直接写进上传目录的 .part，保存时原子改名为正式文件，不再复制
+    target = upload_path(app_module, body['video_url'])
+    assert len(renames) == 1
+    src, dst = renames[0]
+    assert os.path.basename(src).startswith('.upload_') and src.endswith('.part')
+    assert os.path.dirname(src) == os.path.dirname(target) and dst == target
+    assert open(target, 'rb').read() == payload
+    assert partial_files(app_module) == []
+
+
+def test_rejected_upload_removes_part(app_module, client, created_parts):
+    before = set(os.listdir(app_module.app.config['UPLOAD_FOLDER']))
+    resp = client.post('/api/reviews', data={
+        'score_code': '50011', 'rating': '9', 'comment': '评分无效', 'video_source': 'upload',
+        'video': (io.BytesIO(b'v' * 1000), 'clip.mp4'),
+    }, content_type='multipart/form-data')
+    assert resp.status_code == 400
+    assert len(created_parts) == 1 and created_parts[0].size == 1000
+    assert not os.path.exists(created_parts[0].path)
+    assert partial_files(app_module) == []
+    assert set(os.listdir(app_module.app.config['UPLOAD_FOLDER'])) == before
+
+
+def test_aborted_upload_removes_part(app_module, client, created_parts):
+    folder = app_module.app.config['UPLOAD_FOLDER']
+    before = set(os.listdir(folder))
+    body, content_type = multipart_body(
+        {'score_code': '50012', 'rating': '5', 'comment': '中断', 'video_source': 'upload'},
+        'clip.mp4', b'v' * 200000)
+    # 声明完整长度但只发送一半，模拟客户端中途断开
+    resp = client.post('/api/reviews', input_stream=io.BytesIO(body[:len(body) // 2]),
+                       content_type=content_type, content_length=len(body))
+    assert resp.status_code >= 400
+    # 断开前已经开始写 .part，请求结束时被删除
+    assert len(created_parts) == 1 and created_parts[0].size > 0
+    assert not os.path.exists(created_parts[0].path)
+    assert partial_files(app_module) == []
+    assert set(os.listdir(folder)) == before
+    assert client.get('/api/reviews/50012').get_json()['has_review'] is False
+
+
+def test_partial_upload_commit_and_discard(app_module, tmp_path):
+    part = app_module.PartialUploadFile(str(tmp_path))
+    part_path = part.path
+    part.write(b'abc')
+    part.write(b'def')
+    assert part.size == 6 and part.sha256 == hashlib.sha256(b'abcdef').hexdigest()
+    part.commit(str(tmp_path / 'final.mp4'))
+    assert not os.path.exists(part_path)
+    assert (tmp_path / 'final.mp4').read_bytes() == b'abcdef'
+    # 已提交的文件不会被 discard 删除
+    part.discard()
+    assert (tmp_path / 'final.mp4').exists()
+
+    other = app_module.PartialUploadFile(str(tmp_path))
+    other.write(b'xyz')
+    other.discard()
+    assert not os.path.exists(other.path)
+
+
+def test_startup_cleanup_removes_stale_parts(app_module):
+    folder = app_module.app.config['UPLOAD_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    stale = [os.path.join(folder, name) for name in ('.upload_stale.part', '50013_clip_compressed.mp4.part')]
+    keep = os.path.join(folder, '50013_clip.mp4')
+    for path in stale + [keep]:
+        with open(path, 'wb') as f:
+            f.write(b'x')
+    app_module.cleanup_partial_uploads()
+    assert not any(os.path.exists(path) for path in stale)
+    assert os.path.exists(keep)
+    os.remove(keep)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+曲谱记录接口测试（临时 scores.db / reviews.db，通过 test_client 调用接口）
+"""
+
+import pytest
+
+
+@pytest.fixture
+def scores(app_module):
+    with app_module.scores_db.connection() as conn:
+        conn.execute('DELETE FROM scores')
+    with app_module.reviews_db.connection() as conn:
+        conn.execute("DELETE FROM reviews WHERE score_code LIKE '6%'")
+    return app_module
+
+
+def add_review(client, code, comment):
+    resp = client.post('/api/reviews', data={
+        'score_code': code, 'rating': '5', 'comment': comment,
+        'video_source': 'external', 'video_url': 'https://example.com/v.mp4',
+    }, content_type='multipart/form-data')
+    assert resp.get_json()['success']
+
+
+def insert_scores(app_module, rows):
+    """rows: [(score_code, completion, created_at), ...]"""
+    with app_module.scores_db.connection() as conn:
+        conn.executemany('''
+            INSERT INTO scores (score_code, completion, difficulty, region, created_at)
+            VALUES (?, ?, 0, 'CN', ?)
+        ''', rows)
+
+
+def set_remark(client, code, remark):
+    assert client.post(f'/api/scores/{code}/remark', json={'remark': remark}).get_json()['success']
+
+
+def batch(client, **body):
+    resp = client.post('/api/scores/batch', json=body)
+    assert resp.status_code == 200
+    return resp.get_json()
+
+
+def test_history_keyset_pagination(scores, client):
+    # 三条记录时间相同，翻页时靠 score_code 区分先后
+    insert_scores(scores, [
+        ('60001', 10, '2025-01-01 00:00:00'),
+        ('60002', 20, '2025-01-02 00:00:00'),
+        ('60003', 30, '2025-01-02 00:00:00'),
+        ('60004', 40, '2025-01-02 00:00:00'),
+        ('60005', 50, '2025-01-03 00:00:00'),
+        ('60006', 60, '2025-01-04 00:00:00'),
+        ('60007', 70, '2025-01-05 00:00:00'),
+    ])
+    # 不带 limit / cursor 时仍返回完整数组
+    full = [item['score_code'] for item in client.get('/api/scores').get_json()]
+    assert full == ['60007', '60006', '60005', '60004', '60003', '60002', '60001']
+
+    pages = []
+    cursor = None
+    while True:
+        url = '/api/scores?limit=3' + (f'&cursor={cursor}' if cursor else '')
+        body = client.get(url).get_json()
+        assert body['success']
+        pages.append([item['score_code'] for item in body['results']])
+        if not body['has_more']:
+            assert body['next_cursor'] is None
+            break
+        cursor = body['next_cursor']
+    assert pages == [full[0:3], full[3:6], full[6:]]
+
+    # 游标与筛选条件一起使用
+    body = client.get('/api/scores?limit=2&min_completion=30').get_json()
+    body = client.get(f"/api/scores?limit=2&min_completion=30&cursor={body['next_cursor']}").get_json()
+    assert [item['score_code'] for item in body['results']] == ['60005', '60004']
+
+    assert client.get('/api/scores?cursor=not-a-cursor').status_code == 400
+
+
+def test_batch_keeps_input_order_duplicates_and_missing(scores, client):
+    insert_scores(scores, [
+        ('61001', 80, '2025-01-01 00:00:00'),
+        ('61002', 100, '2025-01-01 00:00:00'),
+        ('61003', 20, '2025-01-01 00:00:00'),
+    ])
+    body = batch(client, score_codes=['61003', '69999', '61001', '61003', '61002'], exclude_codes=['61002'])
+    assert [(item['score_code'], item['completion']) for item in body['results']] == [
+        ('61003', 20), ('69999', None), ('61001', 80), ('61003', 20)]
+    assert body['total'] == 5 and body['found'] == 4
+
+    # 完成率筛选会去掉没有记录的曲谱码；uncompleted 只保留没有完成率的
+    body = batch(client, score_codes=['61003', '69999', '61001'], min_completion=50)
+    assert [item['score_code'] for item in body['results']] == ['61001']
+    body = batch(client, score_codes=['61003', '69999', '61002'], uncompleted=1)
+    assert [item['score_code'] for item in body['results']] == ['69999']
+
+    resp = client.post('/api/scores/batch', json={'score_codes': ['61001', 'abc']})
+    assert resp.status_code == 400
+
+
+def test_batch_has_review_filter(scores, client):
+    insert_scores(scores, [('62001', 50, '2025-01-01 00:00:00'), ('62002', 50, '2025-01-01 00:00:00')])
+    add_review(client, '62001', '好听')
+    codes = ['62001', '62002', '62003']
+    assert [item['score_code'] for item in batch(client, score_codes=codes, has_review=1)['results']] == ['62001']
+    assert [item['score_code'] for item in batch(client, score_codes=codes, has_review=2)['results']] == \
+        ['62002', '62003']
+
+
+def test_remark_keyword_search(scores, client):
+    set_remark(client, '63001', '左手练习 Hard')
+    set_remark(client, '63002', '已经练熟')
+    set_remark(client, '63003', 'hardcore 曲目')
+    set_remark(client, '63004', '')
+    codes = ['63001', '63002', '63003', '63004']
+
+    def matching(**filters):
+        return [item['score_code'] for item in batch(client, score_codes=codes, **filters)['results']]
+
+    # 单字、双字、多字关键字都按子串匹配，英文不区分大小写
+    assert matching(include_remark='练') == ['63001', '63002']
+    assert matching(include_remark='练习') == ['63001']
+    assert matching(include_remark='左手练习') == ['63001']
+    assert matching(include_remark='HARD') == ['63001', '63003']
+    assert matching(include_remark='练习,曲目') == []
+    assert matching(exclude_remark='hard') == ['63002', '63004']
+
+    # 修改 / 清空备注后索引同步更新
+    set_remark(client, '63002', 'HARD 模式')
+    set_remark(client, '63003', '')
+    assert matching(include_remark='hard') == ['63001', '63002']
+    assert matching(include_remark='练熟') == []
+
+
+def test_liked_reviews_search(scores, client):
+    for code, comment in (('64001', '旋律很好听'), ('64002', '节奏太快'), ('64003', '和弦好听')):
+        add_review(client, code, comment)
+
+    def search(q):
+        body = client.get('/api/reviews/liked', query_string={'q': q}).get_json()
+        return sorted(item['score_code'] for item in body['results'])
+
+    assert search('好听') == ['64001', '64003']
+    assert search('节') == ['64002']
+    # 曲谱码也参与匹配
+    assert search('4002') == ['64002']
+    assert search('不存在的词') == []
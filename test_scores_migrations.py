@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+scores.db 版本化迁移测试：迁移失败时 DDL 与 user_version 一起回滚
+"""
+
+import pytest
+
+
+def table_columns(c, table):
+    return [row[1] for row in c.execute(f'PRAGMA table_info({table})').fetchall()]
+
+
+def test_failed_migration_rolls_back_ddl(app_module, monkeypatch):
+    with app_module.scores_db.connection() as conn:
+        c = conn.cursor()
+        version = c.execute('PRAGMA user_version').fetchone()[0]
+        columns = table_columns(c, 'scores')
+
+    def broken_migration(c):
+        c.execute('ALTER TABLE scores ADD COLUMN broken_column TEXT')
+        c.execute('CREATE TABLE broken_table (id INTEGER PRIMARY KEY)')
+        raise RuntimeError('模拟迁移中途失败')
+
+    monkeypatch.setattr(app_module, 'SCORES_MIGRATIONS',
+                        app_module.SCORES_MIGRATIONS + [(version + 1, broken_migration)])
+    with pytest.raises(RuntimeError):
+        with app_module.scores_db.connection() as conn:
+            app_module.run_scores_migrations(conn)
+
+    with app_module.scores_db.connection() as conn:
+        c = conn.cursor()
+        assert c.execute('PRAGMA user_version').fetchone()[0] == version
+        assert table_columns(c, 'scores') == columns
+        assert c.execute("SELECT 1 FROM sqlite_master WHERE name = 'broken_table'").fetchone() is None
+
+    # 修好之后重新执行不会因为残留的列 / 表而失败
+    def fixed_migration(c):
+        c.execute('CREATE TABLE IF NOT EXISTS fixed_table (id INTEGER PRIMARY KEY)')
+
+    monkeypatch.setattr(app_module, 'SCORES_MIGRATIONS',
+                        app_module.SCORES_MIGRATIONS[:-1] + [(version + 1, fixed_migration)])
+    with app_module.scores_db.connection() as conn:
+        app_module.run_scores_migrations(conn)
+        c = conn.cursor()
+        assert c.execute('PRAGMA user_version').fetchone()[0] == version + 1
+        # 还原版本号，避免影响其他测试
+        c.execute('DROP TABLE fixed_table')
+        c.execute(f'PRAGMA user_version = {version}')
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Socket.IO 订阅测试：多个 socketio.test_client 按不同方式订阅，经 broadcast_bus 发出的
+score_updates 只送到相关的客户端
+"""
+
+import pytest
+
+from broadcast_bus import BroadcastBus
+
+
+@pytest.fixture
+def socket_clients(app_module, monkeypatch):
+    # 换一条独立的总线：不带前面测试留下的待发送变化；测试里手动 flush，不启动窗口结束时的延迟发送
+    monkeypatch.setattr(app_module, 'broadcast_bus', BroadcastBus(
+        app_module.socketio.emit, start_task=lambda target: None, targets=app_module.socket_subscriptions.targets))
+    clients = []
+
+    def connect():
+        socket_client = app_module.socketio.test_client(app_module.app)
+        clients.append(socket_client)
+        return socket_client
+
+    yield connect
+    for socket_client in clients:
+        if socket_client.is_connected():
+            socket_client.disconnect()
+
+
+def received_updates(socket_client):
+    """收到的 score_updates 中的曲谱码（按收到的顺序）"""
+    return [update['score_code']
+            for event in socket_client.get_received() if event['name'] == 'score_updates'
+            for update in event['args'][0]['updates']]
+
+
+def publish(app_module, *codes):
+    for code in codes:
+        app_module.broadcast_bus.publish(code, completion=50)
+    app_module.broadcast_bus.flush()
+
+
+def test_score_updates_follow_subscriptions(app_module, socket_clients):
+    picky = socket_clients()
+    ack = picky.emit('subscribe', {'page': 'index', 'codes': ['90001', 'abc']}, callback=True)
+    assert ack == {'success': True, 'all': False, 'codes': 1}
+    silent = socket_clients()
+    assert silent.emit('subscribe', {'page': 'index', 'codes': []}, callback=True) == \
+        {'success': True, 'all': False, 'codes': 0}
+    everything = socket_clients()
+    assert everything.emit('subscribe', {'page': 'batch'}, callback=True) == {'success': True, 'all': True}
+    # 没有订阅过的客户端（旧页面）留在 all 房间
+    legacy = socket_clients()
+    for socket_client in (picky, silent, everything, legacy):
+        socket_client.get_received()
+
+    publish(app_module, '90001', '90002')
+    assert received_updates(picky) == ['90001']
+    assert received_updates(silent) == []
+    assert received_updates(everything) == ['90001', '90002']
+    assert received_updates(legacy) == ['90001', '90002']
+
+    # 只订阅了其他曲谱码时收不到这批变化
+    publish(app_module, '90002')
+    assert received_updates(picky) == []
+
+    # 重新订阅为全部后回到 all 房间；断开后不再留下订阅
+    assert picky.emit('subscribe', {'page': 'index'}, callback=True)['all']
+    publish(app_module, '90002')
+    assert received_updates(picky) == ['90002']
+    stats = app_module.socket_subscriptions.stats()
+    silent.disconnect()
+    assert app_module.socket_subscriptions.stats()['code_subscribers'] == stats['code_subscribers'] - 1
+
+
+def test_page_events_follow_subscribed_page(app_module, socket_clients):
+    index = socket_clients()
+    index.emit('subscribe', {'page': 'index', 'codes': []}, callback=True)
+    legacy = socket_clients()
+    for socket_client in (index, legacy):
+        socket_client.get_received()
+
+    app_module.broadcast_bus.emit_now('jianshang_crawl_page', {'page': 1}, to=app_module.page_room('batch'))
+    assert [event['name'] for event in index.get_received()] == []
+    assert [event['name'] for event in legacy.get_received()] == ['jianshang_crawl_page']
+    assert index.emit('subscribe', {'page': 'nowhere'}, callback=True)['success'] is False
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQLitePool 测试：同线程复用、busy 重试、统计计数，以及协程模式下经线程池执行的 OffloadedConnection
+（每个测试使用独立的临时数据库）
+"""
+
+import sqlite3
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def make_pool(app_module, tmp_path):
+    def make(**kwargs):
+        kwargs.setdefault('offload', None)
+        return app_module.SQLitePool(str(tmp_path / 'pool.db'), **kwargs)
+    return make
+
+
+def test_nested_connection_reuses_same_connection(make_pool):
+    pool = make_pool()
+    with pool.connection() as outer:
+        outer.execute('CREATE TABLE t (x INTEGER)')
+        outer.execute('INSERT INTO t VALUES (1)')
+        with pool.connection() as inner:
+            assert inner is outer
+            # 嵌套块结束时不提交，仍在外层事务里
+            inner.execute('INSERT INTO t VALUES (2)')
+        assert outer.in_transaction
+    with pool.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 2
+    stats = pool.stats()
+    assert stats['opened'] == 1 and stats['checkouts'] == 2 and stats['idle'] == 1
+
+
+def test_threads_get_separate_connections(make_pool):
+    pool = make_pool()
+    inside = threading.Barrier(2)
+    seen = {}
+
+    def worker(name):
+        with pool.connection() as conn:
+            seen[name] = conn
+            inside.wait(5)
+
+    threads = [threading.Thread(target=worker, args=(name,)) for name in ('a', 'b')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert seen['a'] is not seen['b']
+    stats = pool.stats()
+    assert stats['opened'] == 2 and stats['size'] == 2 and stats['idle'] == 2
+
+
+def test_waits_when_pool_is_full(make_pool):
+    pool = make_pool(max_size=1)
+    holding = threading.Event()
+    release = threading.Event()
+
+    def holder():
+        with pool.connection():
+            holding.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=holder)
+    thread.start()
+    assert holding.wait(5)
+    threading.Timer(0.1, release.set).start()
+    with pool.connection():
+        pass
+    thread.join(5)
+    stats = pool.stats()
+    assert stats['opened'] == 1 and stats['waits'] == 1 and stats['wait_time_ms'] >= 50
+
+
+def test_exception_rolls_back(make_pool):
+    pool = make_pool()
+    with pool.connection() as conn:
+        conn.execute('CREATE TABLE t (x INTEGER)')
+    with pytest.raises(RuntimeError):
+        with pool.connection() as conn:
+            conn.execute('INSERT INTO t VALUES (1)')
+            raise RuntimeError('中途失败')
+    with pool.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+    assert pool.stats()['rollbacks'] == 1
+
+
+class FlakyCommitConnection:
+    """前 failures 次 commit 抛出 error"""
+
+    def __init__(self, failures, error='database is locked'):
+        self.failures = failures
+        self.error = error
+        self.commits = 0
+
+    def commit(self):
+        self.commits += 1
+        if self.commits <= self.failures:
+            raise sqlite3.OperationalError(self.error)
+
+
+def test_commit_retries_when_busy(make_pool):
+    pool = make_pool(max_busy_retries=3)
+    conn = FlakyCommitConnection(failures=2)
+    pool._commit(conn)
+    assert conn.commits == 3
+    stats = pool.stats()
+    assert stats['busy_retries'] == 2 and stats['busy_wait_time_ms'] > 0
+
+    # 重试次数用完后抛出原来的错误
+    with pytest.raises(sqlite3.OperationalError):
+        pool._commit(FlakyCommitConnection(failures=10))
+    assert pool.stats()['busy_retries'] == 5
+
+
+def test_commit_does_not_retry_other_errors(make_pool):
+    pool = make_pool()
+    conn = FlakyCommitConnection(failures=1, error='disk I/O error')
+    with pytest.raises(sqlite3.OperationalError):
+        pool._commit(conn)
+    assert conn.commits == 1 and pool.stats()['busy_retries'] == 0
+
+
+@pytest.fixture
+def thread_offload():
+    """用真实的线程池模拟 eventlet.tpool / gevent threadpool，记录实际执行调用的线程"""
+    from multiprocessing.pool import ThreadPool
+
+    workers = ThreadPool(2)
+    threads = set()
+
+    def call(func, args):
+        threads.add(threading.get_ident())
+        return func(*args)
+
+    def run(func, *args):
+        return workers.apply(call, (func, args))
+
+    run.threads = threads
+    yield run
+    workers.close()
+    workers.join()
+
+
+def test_offloaded_connection_commit_and_fetch(app_module, make_pool, thread_offload, tmp_path):
+    pool = make_pool(offload=thread_offload)
+    with pool.connection() as conn:
+        assert isinstance(conn, app_module.OffloadedConnection)
+        conn.executescript('CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT);')
+        c = conn.cursor()
+        c.executemany('INSERT INTO t (name) VALUES (?)', [(f'n{i}',) for i in range(600)])
+        assert c.rowcount == 600
+        c.execute('INSERT INTO t (name) VALUES (?)', ('last',))
+        assert c.lastrowid == 601
+        assert conn.in_transaction
+        with pool.connection() as inner:
+            assert inner is conn
+
+    # 退出时经线程池提交，其他连接能读到
+    other = sqlite3.connect(str(tmp_path / 'pool.db'))
+    assert other.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 601
+    other.close()
+
+    with pool.connection() as conn:
+        c = conn.cursor()
+        c.row_factory = sqlite3.Row
+        c.execute('SELECT id, name FROM t WHERE id = ?', (1,))
+        row = c.fetchone()
+        assert row['name'] == 'n0'
+        c = conn.cursor()
+        c.execute('SELECT id FROM t ORDER BY id')
+        assert [r[0] for r in c.fetchmany(3)] == [1, 2, 3]
+        assert len(c.fetchall()) == 598
+        # 迭代按块取结果，跨过 fetchmany 的块边界
+        assert [r[0] for r in conn.execute('SELECT id FROM t ORDER BY id')] == list(range(1, 602))
+
+    assert threading.get_ident() not in thread_offload.threads
+    assert thread_offload.threads
+    assert pool.stats()['offload'] is True
+
+
+def test_offloaded_connection_rollback(make_pool, thread_offload):
+    pool = make_pool(offload=thread_offload)
+    with pool.connection() as conn:
+        conn.execute('CREATE TABLE t (x INTEGER)')
+
+    with pytest.raises(RuntimeError):
+        with pool.connection() as conn:
+            conn.execute('INSERT INTO t VALUES (1)')
+            raise RuntimeError('中途失败')
+
+    with pool.connection() as conn:
+        conn.execute('INSERT INTO t VALUES (2)')
+        conn.rollback()
+        assert not conn.in_transaction
+        conn.execute('INSERT INTO t VALUES (3)')
+        conn.commit()
+
+    with pool.connection() as conn:
+        assert conn.execute('SELECT x FROM t').fetchall() == [(3,)]
+    stats = pool.stats()
+    assert stats['rollbacks'] == 1 and stats['opened'] == 1
+
+
+def test_offloaded_commit_retries_when_busy(app_module, make_pool, thread_offload):
+    pool = make_pool(offload=thread_offload, max_busy_retries=3)
+    conn = app_module.OffloadedConnection(FlakyCommitConnection(failures=2), thread_offload)
+    pool._commit(conn)
+    assert conn._conn.commits == 3 and pool.stats()['busy_retries'] == 2
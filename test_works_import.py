@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+作品元数据导入测试：临时目录中的 musicugc CSV 小样本经 import_works_file 写入 works / work_videos，
+再通过 /api/works 接口读回
+"""
+
+import csv
+import json
+import os
+
+import pytest
+
+CSV_COLUMNS = ('share_code', 'work_id', 'title', 'desc', 'nickname', 'like_cnt', 'publish_time',
+               'hot_score', 'video_json')
+
+
+@pytest.fixture
+def works(app_module):
+    with app_module.scores_db.connection() as conn:
+        conn.execute("DELETE FROM work_videos WHERE share_code LIKE '8%'")
+        conn.execute("DELETE FROM works WHERE share_code LIKE '8%'")
+    return app_module
+
+
+def write_csv(path, rows):
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+    return str(path)
+
+
+def get_work(client, code):
+    resp = client.get(f'/api/works/{code}')
+    return resp.get_json()['work'] if resp.status_code == 200 else None
+
+
+def count_works(app_module, prefix):
+    with app_module.scores_db.connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM works WHERE share_code LIKE ?', (prefix + '%',)).fetchone()[0]
+
+
+def test_import_is_idempotent(works, client, tmp_path):
+    path = write_csv(tmp_path / 'musicugc_all.csv', [
+        {'share_code': '80001', 'work_id': '1', 'title': '第一首', 'nickname': '甲', 'like_cnt': '12',
+         'publish_time': '1700000000', 'hot_score': '3.5'},
+        {'share_code': '80002', 'work_id': '2', 'title': '第二首', 'nickname': '乙', 'like_cnt': ''},
+        # 没有 share_code 的行跳过
+        {'share_code': '', 'work_id': '3', 'title': '无码'},
+    ])
+    assert works.import_works_file(path) == 2
+    first = get_work(client, '80001')
+    assert (first['title'], first['nickname'], first['like_cnt'], first['hot_score']) == ('第一首', '甲', 12, 3.5)
+    assert first['source'] == 'musicugc_all.csv'
+    assert get_work(client, '80002')['like_cnt'] is None
+
+    # 文件没变时直接跳过；强制重新导入按 share_code 覆盖，不会产生重复行
+    assert works.import_works_file(path) == 0
+    assert works.import_works_file(path, force=True) == 2
+    assert count_works(works, '8000') == 2
+    again = get_work(client, '80001')
+    assert {k: v for k, v in again.items() if k != 'updated_at'} == {k: v for k, v in first.items() if k != 'updated_at'}
+
+    # 文件更新后自动重新导入：空字段保留旧值，新增的行写入
+    write_csv(path, [
+        {'share_code': '80001', 'work_id': '1', 'title': '第一首（改）', 'nickname': '', 'like_cnt': '20'},
+        {'share_code': '80003', 'work_id': '4', 'title': '第三首'},
+    ])
+    os.utime(path, (0, 0))
+    assert works.import_works_file(path) == 2
+    assert count_works(works, '8000') == 3
+    updated = get_work(client, '80001')
+    assert (updated['title'], updated['nickname'], updated['like_cnt']) == ('第一首（改）', '甲', 20)
+    with works.scores_db.connection() as conn:
+        assert conn.execute('SELECT row_count FROM works_sources WHERE path = ?',
+                            (os.path.abspath(path),)).fetchone()[0] == 2
+
+
+def test_video_json_rows(works, client, tmp_path):
+    video_json = json.dumps({'duration': 61000, 'resolutions': [
+        {'height': 720, 'width': 1280, 'url': 'https://v/720-low', 'size': 100, 'bitrate': 800},
+        {'height': 720, 'width': 1280, 'url': 'https://v/720-high', 'size': 200, 'bitrate': 1600},
+        {'height': 480, 'width': 854, 'origin_url': 'https://v/480', 'size': 50},
+        {'height': 1080, 'width': 1920, 'bitrate': 3000},   # 没有播放地址
+        {'height': '1080', 'url': 'https://v/1080'},        # 高度不是整数
+        'not-a-resolution',
+    ]})
+    path = write_csv(tmp_path / 'musicugc_all.csv', [
+        {'share_code': '81001', 'title': '有视频', 'video_json': video_json},
+        {'share_code': '81002', 'title': '格式错误', 'video_json': '{"resolutions": ['},
+        {'share_code': '81003', 'title': '没有清晰度', 'video_json': json.dumps({'duration': 'long'})},
+        {'share_code': '81004', 'title': '没有视频'},
+    ])
+    assert works.import_works_file(path) == 4
+
+    work = get_work(client, '81001')
+    assert work['video_duration'] == 61000
+    assert work['videos'] == [
+        {'height': 480, 'width': 854, 'url': 'https://v/480', 'size': 50, 'bitrate': None},
+        {'height': 720, 'width': 1280, 'url': 'https://v/720-high', 'size': 200, 'bitrate': 1600},
+    ]
+    for code in ('81002', '81003', '81004'):
+        work = get_work(client, code)
+        assert work['videos'] == [] and work['video_duration'] is None
+
+    body = client.get('/api/works/81001/video?max_height=600').get_json()
+    assert body['video']['url'] == 'https://v/480' and body['video']['duration'] == 61000
+    assert body['heights'] == [480, 720]
+    assert client.get('/api/works/81001/video').get_json()['video']['height'] == 720
+    # 都超过 max_height 时退回最低清晰度
+    assert client.get('/api/works/81001/video?max_height=360').get_json()['video']['height'] == 480
+    assert client.get('/api/works/81002/video').status_code == 404
+
+    # 再次导入时无法解析的 video_json 不会清掉已有的视频行，有效但为空的清晰度列表会清掉
+    write_csv(path, [
+        {'share_code': '81001', 'video_json': 'not json'},
+        {'share_code': '81002', 'video_json': video_json},
+    ])
+    assert works.import_works_file(path, force=True) == 2
+    assert [v['height'] for v in get_work(client, '81001')['videos']] == [480, 720]
+    assert [v['height'] for v in get_work(client, '81002')['videos']] == [480, 720]
+    write_csv(path, [{'share_code': '81001', 'video_json': json.dumps({'resolutions': []})}])
+    assert works.import_works_file(path, force=True) == 1
+    assert get_work(client, '81001')['videos'] == []
@@ -1,9 +1,10 @@
 import time
 import json
 import csv
-import requests
 from typing import List, Dict
 
+from jianshang_crawler import JianshangCrawler, project_work_fields
+
 BASE_URL = "https://act-hk4e-api.miyoushe.com/event/musicugc/v1/second_page"
 
 BASE_PARAMS = {
@@ -37,20 +38,9 @@ HEADERS = {
 USE_PROXY = False
 PROXIES = {"http": "http://127.0.0.1:7897", "https": "http://127.0.0.1:7897"}
 
-def fetch_page(session: requests.Session, page: int, timeout=12) -> dict:
-    params = dict(BASE_PARAMS, page=page)
-    resp = session.get(
-        BASE_URL,
-        params=params,
-        headers=HEADERS,
-        timeout=timeout,
-        proxies=PROXIES if USE_PROXY else None,
-    )
-    resp.raise_for_status()
-    data = resp.json()
-    if data.get("retcode") != 0:
-        raise RuntimeError(f"retcode={data.get('retcode')} message={data.get('message')}")
-    return data
+# 并发数与限速（每秒请求数），过高容易触发 429/风控
+CONCURRENCY = 4
+RATE = 4.0
 
 def extract_items(payload: dict) -> List[Dict]:
     """
@@ -75,16 +65,20 @@ def extract_items(payload: dict) -> List[Dict]:
             return cur
     return []
 
-def crawl_all(max_pages=200, sleep_sec=0.25):
-    session = requests.Session()
-    page = int(BASE_PARAMS["page"])
-    page_size = int(BASE_PARAMS["page_size"])
+def crawl_all(max_pages=200, concurrency=CONCURRENCY, rate=RATE, base_url=BASE_URL):
+    crawler = JianshangCrawler(
+        base_url=base_url,
+        params=BASE_PARAMS,
+        headers=HEADERS,
+        concurrency=concurrency,
+        rate=rate,  # 令牌桶限速，防 429/风控
+        proxies=PROXIES if USE_PROXY else None,
+        extract=extract_items,
+    )
     all_items: List[Dict] = []
     seen = set()
 
-    for _ in range(max_pages):
-        payload = fetch_page(session, page)
-        items = extract_items(payload)
+    for page, items in crawler.crawl(max_pages=max_pages, start_page=int(BASE_PARAMS["page"])):
         print(f"page={page} -> {len(items)} items")
 
         for it in items:
@@ -93,45 +87,19 @@ def crawl_all(max_pages=200, sleep_sec=0.25):
                 continue
             seen.add(uid)
             all_items.append(it)
-
-        if len(items) < page_size:
-            break
-        page += 1
-        time.sleep(sleep_sec)  # 轻微限速，防 429/风控
     return all_items
 
 def project_fields(items: List[Dict]) -> List[Dict]:
     """
     把常用字段挑出来，方便看/导出。
-    可按需增删。
+    字段定义见 jianshang_crawler.project_work_fields（app 导入 works 表用的是同一份）。
     """
-    out = []
-    for it in items:
-        user = it.get("user") or {}
-        game = it.get("game_data") or {}
-        out.append({
-            "work_id": it.get("work_id"),
-            "share_code": it.get("share_code"),   # ⭐ 新增：曲谱码
-            "title": it.get("title"),
-            "desc": it.get("describe"),
-            "cover_url": it.get("cover_url"),
-            "region": it.get("region"),
-            "music_id": it.get("music_id") or game.get("music_id"),
-            "note_count": it.get("node_count") or game.get("note_count"),
-            "nickname": user.get("nickname"),
-            "uid": user.get("uid"),
-            "like_cnt": (it.get("interact_data") or {}).get("like_cnt"),
-            "save_cnt": (it.get("interact_data") or {}).get("save_cnt"),
-            "game_like_cnt": (it.get("interact_data") or {}).get("game_like_cnt"),
-            "publish_time": game.get("publish_time"),
-            "hot_score": it.get("hot_score"),
-            "quality_score": it.get("quality_score"),
-            "video_json": it.get("video_media_info"),  # 原始字符串，里面有多清晰度播放地址
-        })
-    return out
+    return [project_work_fields(it) for it in items]
 
 if __name__ == "__main__":
-    items = crawl_all(max_pages=200, sleep_sec=0.3)
+    start = time.perf_counter()
+    items = crawl_all(max_pages=200)
+    print(f"elapsed: {time.perf_counter() - start:.1f}s")
     print(f"total collected: {len(items)}")
 
     # 1) 存原始 JSON